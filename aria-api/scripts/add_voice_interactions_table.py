@@ -1,54 +1,142 @@
 """
 Database migration: Add voice_interactions table
 Run with: python scripts/add_voice_interactions_table.py
+
+New installs get a table range-partitioned by month on created_at. An
+existing unpartitioned table is left in place (converting it needs a data
+copy) and only gets its indexes built.
 """
 import psycopg2
 import os
+import sys
+from datetime import date
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Project root, so the script runs as `python scripts/add_voice_interactions_table.py`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Imported after load_dotenv(): src.database reads its settings at import
+from src.database import create_indexes_concurrently
+
+# Monthly partitions created ahead of the current month
+VOICE_PARTITIONS_AHEAD = int(os.getenv("VOICE_PARTITIONS_AHEAD", "3"))
+
+# (name, table + columns); (user_id, created_at DESC) serves "latest N for a user"
+VOICE_INDEXES = [
+    ("idx_voice_user_created", "voice_interactions(user_id, created_at DESC)"),
+    ("idx_voice_created_at", "voice_interactions(created_at DESC)"),
+    ("idx_voice_type", "voice_interactions(interaction_type)"),
+    ("idx_voice_metadata_gin", "voice_interactions USING GIN (metadata jsonb_path_ops)"),
+]
+
+# Partitioned layout: rows arrive in created_at order, so a BRIN index is a
+# tiny fraction of a btree's size and cheaper to maintain on insert
+PARTITIONED_VOICE_INDEXES = [
+    ("idx_voice_user_created", "voice_interactions(user_id, created_at DESC)"),
+    ("idx_voice_created_brin", "voice_interactions USING BRIN (created_at) WITH (pages_per_range = 32)"),
+    ("idx_voice_type", "voice_interactions(interaction_type)"),
+    ("idx_voice_metadata_gin", "voice_interactions USING GIN (metadata jsonb_path_ops)"),
+]
+
+# CREATE TYPE has no IF NOT EXISTS
+VOICE_TYPE_DDL = """
+    DO $$
+    BEGIN
+        CREATE TYPE voice_interaction_type AS ENUM ('transcription', 'synthesis', 'conversation');
+    EXCEPTION
+        WHEN duplicate_object THEN NULL;
+    END $$
+"""
+
+# The partition key must be part of the primary key
+VOICE_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS voice_interactions (
+        id SERIAL,
+        user_id VARCHAR(255) NOT NULL,
+        interaction_type voice_interaction_type NOT NULL,
+        input_text TEXT,
+        output_text TEXT,
+        audio_duration_seconds SMALLINT,
+        language VARCHAR(10),
+        voice_name VARCHAR(100),
+        confidence_score FLOAT,
+        audio_size_bytes INTEGER,
+        metadata JSONB,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at),
+        CONSTRAINT fk_voice_user FOREIGN KEY (user_id)
+            REFERENCES athlete_profiles(user_id) ON DELETE CASCADE
+    ) PARTITION BY RANGE (created_at)
+"""
+
+# Catches rows whose month has no partition yet (e.g. the partitions ran out
+# because nothing created new ones), so inserts never fail for lack of one
+VOICE_DEFAULT_PARTITION_DDL = """
+    CREATE TABLE IF NOT EXISTS voice_interactions_default
+    PARTITION OF voice_interactions DEFAULT
+"""
+
+def _month_start(year: int, month: int) -> date:
+    """First day of the month, normalising month overflow"""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return date(year, month, 1)
+
+def _partition_sql(month: date) -> str:
+    """DDL for the voice_interactions partition covering `month`"""
+    start = _month_start(month.year, month.month)
+    end = _month_start(month.year, month.month + 1)
+    return f"""
+        CREATE TABLE IF NOT EXISTS voice_interactions_{start:%Y_%m}
+        PARTITION OF voice_interactions
+        FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+    """
+
 def add_voice_interactions_table():
     """Add voice_interactions table to database"""
     conn = psycopg2.connect(os.getenv("DATABASE_URL"))
     cur = conn.cursor()
     
     try:
-        # Create voice_interactions table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS voice_interactions (
-                id SERIAL PRIMARY KEY,
-                user_id VARCHAR(255) NOT NULL,
-                interaction_type VARCHAR(50) NOT NULL,  -- 'transcription', 'synthesis', 'conversation'
-                input_text TEXT,
-                output_text TEXT,
-                audio_duration_seconds INTEGER,
-                language VARCHAR(10),
-                voice_name VARCHAR(100),
-                confidence_score FLOAT,
-                audio_size_bytes INTEGER,
-                metadata JSONB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                CONSTRAINT fk_voice_user FOREIGN KEY (user_id) 
-                    REFERENCES athlete_profiles(user_id) ON DELETE CASCADE
-            );
-        """)
-        
-        # Create indexes for performance
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_voice_user_id 
-            ON voice_interactions(user_id);
-        """)
+        # to_regclass resolves through search_path and is NULL if missing
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('voice_interactions')")
+        existing = cur.fetchone()
         
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_voice_created_at 
-            ON voice_interactions(created_at DESC);
-        """)
+        if existing and existing[0] == 'r':
+            print("ℹ️  voice_interactions exists unpartitioned; keeping it")
+            
+            # The lookup above opened a transaction; CONCURRENTLY needs none
+            conn.rollback()
+            create_indexes_concurrently(conn, [
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"
+                for name, definition in VOICE_INDEXES
+            ] + [
+                # Superseded by idx_voice_user_created, whose leading column covers it
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_voice_user_id"
+            ])
+            
+            print("✅ Indexes created successfully")
+            return
         
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_voice_type 
-            ON voice_interactions(interaction_type);
-        """)
+        # New (or already partitioned) table: the type, table, partitions and
+        # indexes all go in one multi-statement execute, i.e. one round trip
+        # and one transaction. Indexes on a partitioned table can't be built
+        # CONCURRENTLY; they cascade to every partition, including later ones
+        # The month comes from the database clock, which is what fills created_at
+        cur.execute("SELECT date_trunc('month', now())::date")
+        today = cur.fetchone()[0]
+        statements = [VOICE_TYPE_DDL, VOICE_TABLE_DDL]
+        statements += [
+            _partition_sql(_month_start(today.year, today.month + ahead))
+            for ahead in range(VOICE_PARTITIONS_AHEAD + 1)
+        ]
+        statements.append(VOICE_DEFAULT_PARTITION_DDL)
+        statements += [
+            f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"
+            for name, definition in PARTITIONED_VOICE_INDEXES
+        ]
+        cur.execute(";\n".join(statements))
         
         conn.commit()
         print("✅ voice_interactions table created successfully")
@@ -281,6 +281,21 @@ def comprehensive_all_users():
     logger.info(f"✅ Comprehensive analysis complete: {success_count} success, {error_count} errors")
     return {"success": success_count, "errors": error_count, "total": len(users)}
 
+@celery_app.task(name='celery_tasks.generate_data_export')
+def generate_data_export(user_id, format='zip'):
+    """Build a GDPR data export, upload it to blob storage and return a signed URL"""
+    logger.info(f"📦 Generating {format} data export for user {user_id}...")
+    
+    from src.data_export import generate_export_file
+    
+    result = generate_export_file(user_id, format)
+    
+    if result.get("success"):
+        logger.info(f"✅ Data export ready for user {user_id}")
+    else:
+        logger.error(f"❌ Data export failed for {user_id}: {result.get('error')}")
+    return result
+
 # =============================================================================
 # MANUAL TASK TRIGGER (for testing)
 # =============================================================================
@@ -3,13 +3,15 @@ Project Cleanup Script
 Identifies and optionally removes unnecessary files after reorganization
 """
 
+import fnmatch
 import os
+import re
+import stat
 from pathlib import Path
 
-# Change to project root
-script_dir = Path(__file__).parent
+# Project root; paths are resolved against it rather than chdir'ing there
+script_dir = Path(__file__).resolve().parent
 project_root = script_dir.parent
-os.chdir(project_root)
 
 print("=" * 80)
 print("🧹 PROJECT CLEANUP ANALYSIS")
@@ -46,65 +48,115 @@ files_to_check = {
     ]
 }
 
-# Check for old test files in root (should all be in tests/ now)
-old_test_files = []
-for item in os.listdir('.'):
-    if item.startswith('test_') and item.endswith('.py') and os.path.isfile(item):
-        old_test_files.append(item)
-
-if old_test_files:
-    files_to_check["Old Test Files (moved to tests/)"] = old_test_files
-
-# Check for old source files in root (should all be in src/ now)
-old_source_files = []
-source_file_names = [
-    'main.py', 'database.py', 'cache.py', 'rate_limit.py',
-    'auth_middleware.py', 'observability.py', 'wearable_integration.py',
-    'tracklit_integration.py'
-]
-for item in source_file_names:
-    if os.path.isfile(item):
-        old_source_files.append(item)
-
-if old_source_files:
-    files_to_check["Old Source Files (moved to src/)"] = old_source_files
-
-# Check for old documentation in root (should be in docs/)
-old_doc_files = []
-doc_patterns = ['README.md', 'IMPLEMENTATION_SUMMARY.md', 'PRODUCTION_READINESS_REPORT.md', 
-                'TESTING.md', 'QUICK_START_DEPLOYMENT.md']
-for item in doc_patterns:
-    if os.path.isfile(item):
-        old_doc_files.append(item)
-
-if old_doc_files:
-    files_to_check["Old Documentation (moved to docs/)"] = old_doc_files
-
-# Check for old scripts in root (should be in scripts/)
-old_script_files = []
-script_names = ['run_tests.py', 'verify_migration.py']
-for item in script_names:
-    if os.path.isfile(item):
-        old_script_files.append(item)
-
-if old_script_files:
-    files_to_check["Old Scripts (moved to scripts/)"] = old_script_files
+# Root-level leftovers of the reorganisation, by category
+moved_files = {
+    "Old Source Files (moved to src/)": [
+        'main.py', 'database.py', 'cache.py', 'rate_limit.py',
+        'auth_middleware.py', 'observability.py', 'wearable_integration.py',
+        'tracklit_integration.py'
+    ],
+    "Old Documentation (moved to docs/)": [
+        'README.md', 'IMPLEMENTATION_SUMMARY.md', 'PRODUCTION_READINESS_REPORT.md', 
+        'TESTING.md', 'QUICK_START_DEPLOYMENT.md'
+    ],
+    "Old Scripts (moved to scripts/)": ['run_tests.py', 'verify_migration.py'],
+}
+OLD_TEST_CATEGORY = "Old Test Files (moved to tests/)"
+
+# Glob entries of files_to_check (*.pyc, *~, ...), compiled once into one
+# alternation per category so each scanned name costs a single match
+glob_patterns = {
+    category: [item for item in items if any(ch in item for ch in "*?[")]
+    for category, items in files_to_check.items()
+}
+glob_res = {
+    category: re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+    for category, patterns in glob_patterns.items() if patterns
+}
+
+
+def _describe(entry):
+    """(name, is_dir, size) for a DirEntry; directories need no stat at all"""
+    if entry.is_dir():
+        return (entry.name, True, 0)
+    return (entry.name, False, entry.stat().st_size)
+
+
+def scan_root():
+    """
+    Collect every cleanup candidate that exists, stat'ing each at most once
+    
+    The root is read with a single os.scandir pass, whose DirEntry objects
+    carry the file type and cache their stat, so a root file costs at most
+    one stat (none on Windows) and a root directory none; only nested paths
+    such as src/__pycache__ need a stat of their own.
+    
+    Returns:
+        Dict of category -> list of (name, is_dir, size in bytes)
+    """
+    moved_category = {name: category for category, names in moved_files.items() for name in names}
+    found = {category: [] for category in files_to_check}
+    found[OLD_TEST_CATEGORY] = []
+    found.update({category: [] for category in moved_files})
+    
+    root_entries = {}
+    with os.scandir(project_root) as it:
+        for entry in it:
+            root_entries[entry.name] = entry
+            for category, glob_re in glob_res.items():
+                if glob_re.match(entry.name):
+                    found[category].append(_describe(entry))
+                    break
+            
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            
+            # Old test files in root (should all be in tests/ now)
+            if entry.name.startswith('test_') and entry.name.endswith('.py'):
+                found[OLD_TEST_CATEGORY].append(_describe(entry))
+            elif entry.name in moved_category:
+                found[moved_category[entry.name]].append(_describe(entry))
+    
+    for category, items in files_to_check.items():
+        for item in items:
+            if item in glob_patterns[category]:
+                continue
+            entry = root_entries.get(item)
+            if entry is not None:
+                found[category].append(_describe(entry))
+                continue
+            
+            # Nested paths (src/__pycache__) aren't in the root scan
+            try:
+                item_stat = os.stat(project_root / item)
+            except OSError:
+                continue
+            found[category].append((item, stat.S_ISDIR(item_stat.st_mode), item_stat.st_size))
+    
+    return found
+
+
+found = scan_root()
 
 # Display analysis
 total_items = 0
-for category, items in files_to_check.items():
-    if items:
+for category, items in found.items():
+    present = {name for name, _, _ in items}
+    missing = [
+        item for item in files_to_check.get(category, [])
+        if item not in present and item not in glob_patterns[category]
+    ]
+    if items or missing:
         print(f"\n📁 {category}:")
-        for item in items:
-            if os.path.exists(item):
-                if os.path.isdir(item):
-                    print(f"   📂 {item}/ (directory)")
-                else:
-                    file_size = os.path.getsize(item) / 1024  # KB
-                    print(f"   📄 {item} ({file_size:.1f} KB)")
-                total_items += 1
+        for name, is_dir, size in items:
+            if is_dir:
+                print(f"   📂 {name}/ (directory)")
             else:
-                print(f"   ⚠️  {item} (pattern - would need glob search)")
+                file_size = size / 1024  # KB
+                print(f"   📄 {name} ({file_size:.1f} KB)")
+            total_items += 1
+        for item in missing:
+            print(f"   ⚠️  {item} (pattern - would need glob search)")
 
 if total_items == 0:
     print("\n✅ No unnecessary files found! Project is clean.")
@@ -139,25 +191,16 @@ print("=" * 80)
 # Create a cleanup command script
 cleanup_commands = []
 
-if old_test_files:
-    cleanup_commands.append("# Delete old test files (moved to tests/)")
-    for f in old_test_files:
-        cleanup_commands.append(f'Remove-Item "{f}" -Force')
-
-if old_source_files:
-    cleanup_commands.append("\n# Delete old source files (moved to src/)")
-    for f in old_source_files:
-        cleanup_commands.append(f'Remove-Item "{f}" -Force')
-
-if old_doc_files:
-    cleanup_commands.append("\n# Delete old documentation (moved to docs/)")
-    for f in old_doc_files:
-        cleanup_commands.append(f'Remove-Item "{f}" -Force')
-
-if old_script_files:
-    cleanup_commands.append("\n# Delete old scripts (moved to scripts/)")
-    for f in old_script_files:
-        cleanup_commands.append(f'Remove-Item "{f}" -Force')
+# Delete root-level leftovers found by the scan
+for category, heading in [
+    (OLD_TEST_CATEGORY, "Delete old test files (moved to tests/)"),
+    ("Old Source Files (moved to src/)", "Delete old source files (moved to src/)"),
+    ("Old Documentation (moved to docs/)", "Delete old documentation (moved to docs/)"),
+    ("Old Scripts (moved to scripts/)", "Delete old scripts (moved to scripts/)"),
+]:
+    if found[category]:
+        cleanup_commands.append(f"\n# {heading}" if cleanup_commands else f"# {heading}")
+        cleanup_commands.extend(f'Remove-Item "{name}" -Force' for name, _, _ in found[category])
 
 # Add build artifacts cleanup
 cleanup_commands.append("\n# Clean build artifacts")
@@ -3,26 +3,61 @@ Database Migration Script for New Features
 Creates all tables required for the new functionality
 """
 import logging
+import re
 import sys
 import os
 
-# Add parent directory to path
+# Project root, so the script runs as `python scripts/migrate_database.py`
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import get_db_connection
+from src.database import db_connection, create_indexes_concurrently
+from src.equipment_tracking import EQUIPMENT_ALERT_PREDICATE
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_all_tables():
-    """Create all tables for new features"""
+# Session settings for the index builds: more sort memory and parallel
+# workers let btree builds on populated tables use several cores
+MIGRATION_MAINTENANCE_WORK_MEM = os.getenv("MIGRATION_MAINTENANCE_WORK_MEM", "1GB")
+MIGRATION_PARALLEL_WORKERS = int(os.getenv("MIGRATION_PARALLEL_WORKERS", "4"))
+
+# Tables verify_tables() expects after the migration
+MIGRATION_TABLES = (
+    'athlete_connections', 'messages', 'training_groups', 'training_group_members',
+    'leaderboard_entries', 'activity_feed', 'activity_comments', 'activity_reactions',
+    'races', 'race_prep_plans', 'race_results', 'race_checklists', 'warmup_routines',
+    'deletion_requests', 'data_access_logs',
+    'equipment', 'equipment_usage', 'equipment_maintenance',
+    'user_levels', 'achievements', 'user_achievements', 'virtual_races',
+    'virtual_race_participants', 'challenges', 'challenge_participants', 'xp_transactions'
+)
+
+# Name of the table a CREATE TABLE IF NOT EXISTS statement targets
+_CREATE_TARGET_RE = re.compile(r"\s*CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+def create_all_tables(conn):
+    """
+    Create all tables for new features
+    
+    Args:
+        conn: Open connection, shared with verify_tables()
+    """
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
     try:
         logger.info("Starting database migration...")
         
+        # Table DDL is collected here and sent in one execute at the end: one
+        # round trip instead of one per table. Indexes are built afterwards
+        ddl_stmts = []
+        index_stmts = []
+        
+        # One catalog read up front; on re-runs most tables already exist
+        # and their CREATEs are dropped before sending
+        cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
+        existing = {row[0] for row in cur.fetchall()}
+        
         # =============================================================================
         # SOCIAL FEATURES TABLES
         # =============================================================================
@@ -30,7 +65,7 @@ def create_all_tables():
         logger.info("Creating social features tables...")
         
         # Athlete connections (follow/following)
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS athlete_connections (
                 connection_id SERIAL PRIMARY KEY,
                 follower_id VARCHAR(255) NOT NULL,
@@ -41,7 +76,7 @@ def create_all_tables():
         """)
         
         # Direct messages
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS messages (
                 message_id SERIAL PRIMARY KEY,
                 sender_id VARCHAR(255) NOT NULL,
@@ -53,7 +88,7 @@ def create_all_tables():
         """)
         
         # Training groups
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS training_groups (
                 group_id SERIAL PRIMARY KEY,
                 creator_id VARCHAR(255) NOT NULL,
@@ -65,7 +100,7 @@ def create_all_tables():
         """)
         
         # Training group members
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS training_group_members (
                 member_id SERIAL PRIMARY KEY,
                 group_id INTEGER REFERENCES training_groups(group_id),
@@ -76,7 +111,7 @@ def create_all_tables():
         """)
         
         # Leaderboards
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS leaderboard_entries (
                 entry_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -89,7 +124,7 @@ def create_all_tables():
         """)
         
         # Activity feed
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS activity_feed (
                 activity_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -101,7 +136,7 @@ def create_all_tables():
         """)
         
         # Activity comments
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS activity_comments (
                 comment_id SERIAL PRIMARY KEY,
                 activity_id INTEGER REFERENCES activity_feed(activity_id),
@@ -112,7 +147,7 @@ def create_all_tables():
         """)
         
         # Activity reactions
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS activity_reactions (
                 reaction_id SERIAL PRIMARY KEY,
                 activity_id INTEGER REFERENCES activity_feed(activity_id),
@@ -123,7 +158,7 @@ def create_all_tables():
             )
         """)
         
-        logger.info("✓ Social features tables created")
+        logger.info("✓ Social features tables queued")
         
         # =============================================================================
         # RACE MANAGEMENT TABLES
@@ -132,7 +167,7 @@ def create_all_tables():
         logger.info("Creating race management tables...")
         
         # Races
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS races (
                 race_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -147,7 +182,7 @@ def create_all_tables():
         """)
         
         # Race preparation plans
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS race_prep_plans (
                 plan_id SERIAL PRIMARY KEY,
                 race_id INTEGER REFERENCES races(race_id),
@@ -158,7 +193,7 @@ def create_all_tables():
         """)
         
         # Race results
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS race_results (
                 result_id SERIAL PRIMARY KEY,
                 race_id INTEGER REFERENCES races(race_id),
@@ -173,7 +208,7 @@ def create_all_tables():
         """)
         
         # Race checklists
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS race_checklists (
                 checklist_id SERIAL PRIMARY KEY,
                 race_id INTEGER REFERENCES races(race_id),
@@ -184,7 +219,7 @@ def create_all_tables():
         """)
         
         # Warmup routines
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS warmup_routines (
                 routine_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -196,7 +231,7 @@ def create_all_tables():
             )
         """)
         
-        logger.info("✓ Race management tables created")
+        logger.info("✓ Race management tables queued")
         
         # =============================================================================
         # GDPR COMPLIANCE TABLES
@@ -205,7 +240,7 @@ def create_all_tables():
         logger.info("Creating GDPR compliance tables...")
         
         # Deletion requests
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS deletion_requests (
                 request_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -217,7 +252,7 @@ def create_all_tables():
         """)
         
         # Data access logs
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS data_access_logs (
                 log_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -228,7 +263,7 @@ def create_all_tables():
             )
         """)
         
-        logger.info("✓ GDPR compliance tables created")
+        logger.info("✓ GDPR compliance tables queued")
         
         # =============================================================================
         # EQUIPMENT TRACKING TABLES
@@ -237,7 +272,7 @@ def create_all_tables():
         logger.info("Creating equipment tracking tables...")
         
         # Equipment inventory
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS equipment (
                 equipment_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -250,12 +285,13 @@ def create_all_tables():
                 max_mileage FLOAT,
                 status VARCHAR(50) DEFAULT 'active',
                 notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                wear_ratio FLOAT GENERATED ALWAYS AS (current_mileage / NULLIF(max_mileage, 0)) STORED
             )
         """)
         
         # Equipment usage logs
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS equipment_usage (
                 usage_id SERIAL PRIMARY KEY,
                 equipment_id INTEGER REFERENCES equipment(equipment_id),
@@ -269,7 +305,7 @@ def create_all_tables():
         """)
         
         # Equipment maintenance
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS equipment_maintenance (
                 maintenance_id SERIAL PRIMARY KEY,
                 equipment_id INTEGER REFERENCES equipment(equipment_id),
@@ -281,7 +317,7 @@ def create_all_tables():
             )
         """)
         
-        logger.info("✓ Equipment tracking tables created")
+        logger.info("✓ Equipment tracking tables queued")
         
         # =============================================================================
         # GAMIFICATION TABLES
@@ -290,7 +326,7 @@ def create_all_tables():
         logger.info("Creating gamification tables...")
         
         # User levels and XP
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS user_levels (
                 user_id VARCHAR(255) PRIMARY KEY,
                 total_xp INTEGER DEFAULT 0,
@@ -304,7 +340,7 @@ def create_all_tables():
         """)
         
         # Achievements
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS achievements (
                 achievement_id SERIAL PRIMARY KEY,
                 achievement_name VARCHAR(255) UNIQUE NOT NULL,
@@ -319,7 +355,7 @@ def create_all_tables():
         """)
         
         # User achievements
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS user_achievements (
                 user_achievement_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -330,7 +366,7 @@ def create_all_tables():
         """)
         
         # Virtual races
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS virtual_races (
                 virtual_race_id SERIAL PRIMARY KEY,
                 race_name VARCHAR(255) NOT NULL,
@@ -347,7 +383,7 @@ def create_all_tables():
         """)
         
         # Virtual race participants
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS virtual_race_participants (
                 participant_id SERIAL PRIMARY KEY,
                 virtual_race_id INTEGER REFERENCES virtual_races(virtual_race_id),
@@ -361,7 +397,7 @@ def create_all_tables():
         """)
         
         # Challenges
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS challenges (
                 challenge_id SERIAL PRIMARY KEY,
                 challenge_name VARCHAR(255) NOT NULL,
@@ -380,7 +416,7 @@ def create_all_tables():
         """)
         
         # Challenge participants
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS challenge_participants (
                 participant_id SERIAL PRIMARY KEY,
                 challenge_id INTEGER REFERENCES challenges(challenge_id),
@@ -393,7 +429,7 @@ def create_all_tables():
         """)
         
         # XP transactions log
-        cur.execute("""
+        ddl_stmts.append("""
             CREATE TABLE IF NOT EXISTS xp_transactions (
                 transaction_id SERIAL PRIMARY KEY,
                 user_id VARCHAR(255) NOT NULL,
@@ -404,7 +440,7 @@ def create_all_tables():
             )
         """)
         
-        logger.info("✓ Gamification tables created")
+        logger.info("✓ Gamification tables queued")
         
         # =============================================================================
         # CREATE INDEXES FOR PERFORMANCE
@@ -412,33 +448,82 @@ def create_all_tables():
         
         logger.info("Creating indexes...")
         
-        # Social indexes
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_athlete_connections_follower ON athlete_connections(follower_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_athlete_connections_following ON athlete_connections(following_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_recipient ON messages(recipient_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_leaderboard_type_period ON leaderboard_entries(leaderboard_type, period)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_activity_feed_user ON activity_feed(user_id)")
+        # Social indexes; composites match the hot queries' filter + ORDER BY
+        # so the planner can walk the index instead of sorting
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_athlete_connections_follower ON athlete_connections(follower_id)")
+        # Reverse of UNIQUE(follower_id, following_id), for follower listings
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_athlete_connections_following_follower ON athlete_connections(following_id, follower_id)")
+        index_stmts.append("DROP INDEX CONCURRENTLY IF EXISTS idx_athlete_connections_following")
+        # Inbox newest-first; the partial index holds only unread rows, so the
+        # unread count/list stays tiny however large the inbox grows
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_recipient_sent ON messages(recipient_id, sent_at DESC)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_recipient_unread ON messages(recipient_id, sent_at DESC) WHERE is_read = FALSE")
+        index_stmts.append("DROP INDEX CONCURRENTLY IF EXISTS idx_messages_recipient")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_sender ON messages(sender_id)")
+        # Top-N for a board is a range scan (backwards for ascending boards)
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_leaderboard_type_period_value ON leaderboard_entries(leaderboard_type, period, metric_value DESC)")
+        index_stmts.append("DROP INDEX CONCURRENTLY IF EXISTS idx_leaderboard_type_period")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_activity_feed_user ON activity_feed(user_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_activity_feed_public_user_created ON activity_feed(user_id, created_at DESC) WHERE is_public = TRUE")
+        # JSONB containment (@>) lookups; jsonb_path_ops is smaller and faster
+        # than the default opclass when only @> is needed
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_activity_feed_data_gin ON activity_feed USING GIN (activity_data jsonb_path_ops)")
         
         # Race indexes
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_races_user ON races(user_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_races_date ON races(race_date)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_race_results_user ON race_results(user_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_races_user ON races(user_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_races_date ON races(race_date)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_race_results_user ON race_results(user_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_race_results_splits_gin ON race_results USING GIN (splits jsonb_path_ops)")
         
         # Equipment indexes
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_equipment_user ON equipment(user_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_equipment_status ON equipment(status)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_equipment_usage_equipment ON equipment_usage(equipment_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_equipment_user ON equipment(user_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_equipment_status ON equipment(status)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_equipment_usage_equipment ON equipment_usage(equipment_id)")
+        # Tables created before wear_ratio was part of the definition; adding a
+        # stored column rewrites the table, so it happens here once per
+        # deployment. Stays in the table batch: the alerts index depends on it
+        ddl_stmts.append("""
+            ALTER TABLE equipment ADD COLUMN IF NOT EXISTS wear_ratio FLOAT
+            GENERATED ALWAYS AS (current_mileage / NULLIF(max_mileage, 0)) STORED
+        """)
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_equipment_user_status ON equipment(user_id, status) INCLUDE (current_mileage, max_mileage)")
+        index_stmts.append("DROP INDEX CONCURRENTLY IF EXISTS idx_equipment_active_wear")
+        index_stmts.append(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_equipment_alerts ON equipment(user_id, wear_ratio DESC) INCLUDE (equipment_id, equipment_type, brand, model, current_mileage, max_mileage) WHERE {EQUIPMENT_ALERT_PREDICATE}")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_equipment_usage_eqid_date ON equipment_usage(equipment_id, usage_date DESC)")
         
-        # Gamification indexes
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_levels_user ON user_levels(user_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_achievements_user ON user_achievements(user_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_xp_transactions_user ON xp_transactions(user_id)")
+        # GDPR indexes
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_access_logs_user_time ON data_access_logs(user_id, access_time DESC)")
         
-        logger.info("✓ Indexes created")
+        # Gamification indexes
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_levels_user ON user_levels(user_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_achievements_user ON user_achievements(user_id)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_achievements_progress_gin ON user_achievements USING GIN (progress jsonb_path_ops)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_achievements_requirements_gin ON achievements USING GIN (requirements jsonb_path_ops)")
+        index_stmts.append("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_xp_transactions_user ON xp_transactions(user_id)")
+        
+        logger.info("✓ Indexes queued")
+        
+        # psycopg2 runs the whole multi-statement string inside the open
+        # transaction, so the tables still commit or roll back as a unit
+        ddl_stmts = [
+            stmt for stmt in ddl_stmts
+            if (match := _CREATE_TARGET_RE.match(stmt)) is None or match.group(1) not in existing
+        ]
+        logger.info(f"Executing {len(ddl_stmts)} DDL statements...")
+        if ddl_stmts:
+            cur.execute(";\n".join(ddl_stmts))
         
         # Commit all changes
         conn.commit()
+        logger.info("✓ Tables created")
+        
+        # One autocommit statement per index; ones that already exist and are
+        # valid are skipped, so re-runs stay cheap
+        create_indexes_concurrently(conn, index_stmts, settings={
+            "maintenance_work_mem": MIGRATION_MAINTENANCE_WORK_MEM,
+            "max_parallel_maintenance_workers": str(MIGRATION_PARALLEL_WORKERS),
+        })
+        logger.info("✓ Indexes created")
         
         logger.info("=" * 60)
         logger.info("DATABASE MIGRATION COMPLETED SUCCESSFULLY!")
@@ -461,30 +546,28 @@ def create_all_tables():
         
     finally:
         cur.close()
-        conn.close()
 
 
-def verify_tables():
-    """Verify all tables were created"""
-    conn = get_db_connection()
+def verify_tables(conn):
+    """
+    Verify all tables were created
+    
+    Args:
+        conn: Open connection, shared with create_all_tables()
+    """
     cur = conn.cursor()
     
     try:
+        # pg_class directly (an index scan on relname) rather than the
+        # information_schema.tables view and the joins behind it
         cur.execute("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'public' 
-            AND table_name IN (
-                'athlete_connections', 'messages', 'training_groups', 'training_group_members',
-                'leaderboard_entries', 'activity_feed', 'activity_comments', 'activity_reactions',
-                'races', 'race_prep_plans', 'race_results', 'race_checklists', 'warmup_routines',
-                'deletion_requests', 'data_access_logs',
-                'equipment', 'equipment_usage', 'equipment_maintenance',
-                'user_levels', 'achievements', 'user_achievements', 'virtual_races',
-                'virtual_race_participants', 'challenges', 'challenge_participants', 'xp_transactions'
-            )
-            ORDER BY table_name
-        """)
+            SELECT relname
+            FROM pg_class
+            WHERE relnamespace = 'public'::regnamespace
+            AND relkind = 'r'
+            AND relname = ANY(%s)
+            ORDER BY relname
+        """, (list(MIGRATION_TABLES),))
         
         tables = cur.fetchall()
         
@@ -504,20 +587,21 @@ def verify_tables():
         
     finally:
         cur.close()
-        conn.close()
 
 
 if __name__ == "__main__":
     logger.info("Starting database migration for new features...")
     logger.info("=" * 60 + "\n")
     
-    # Create tables
-    success = create_all_tables()
+    # One connection for both phases instead of a fresh connect per phase
+    with db_connection() as conn:
+        # Create tables
+        success = create_all_tables(conn)
+        
+        # Verify tables
+        verify_success = success and verify_tables(conn)
     
     if success:
-        # Verify tables
-        verify_success = verify_tables()
-        
         if verify_success:
             logger.info("✅ Migration completed successfully!")
             logger.info("All tables verified and ready to use.\n")
@@ -3,12 +3,15 @@ Additional API Endpoints for Aria
 Webhooks, social features, analytics, race management, data export, voice, real-time, multi-language
 """
 from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, UploadFile, File, Form
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, date
 import logging
+import asyncio
 import json
 import base64
+import orjson
 
 # Import services
 from src.notifications import notification_service
@@ -33,7 +36,7 @@ webhook_router = APIRouter(prefix="/webhooks", tags=["Webhooks"])
 social_router = APIRouter(prefix="/social", tags=["Social"])
 analytics_router = APIRouter(prefix="/analytics", tags=["Analytics"])
 race_router = APIRouter(prefix="/race", tags=["Race Management"])
-export_router = APIRouter(prefix="/export", tags=["Data Export"])
+export_router = APIRouter(prefix="/export", tags=["Data Export"], default_response_class=ORJSONResponse)
 voice_router = APIRouter(prefix="/voice", tags=["Voice"])
 realtime_router = APIRouter(prefix="/realtime", tags=["Real-time"])
 equipment_router = APIRouter(prefix="/equipment", tags=["Equipment"])
@@ -490,13 +493,63 @@ async def get_results_endpoint(request: Request, user_id: str):
 # DATA EXPORT ENDPOINTS
 # =============================================================================
 
-from src.data_export import export_user_data, import_user_data, delete_user_data, request_data_deletion, get_data_access_logs
+from src.data_export import (
+    export_user_data, import_user_data, delete_user_data, request_data_deletion, get_data_access_logs,
+    get_export_etag, EXPORT_CACHE_CONTROL
+)
 
 @export_router.get("/{user_id}/export")
 @apply_rate_limit("general")
 async def export_data_endpoint(request: Request, user_id: str, format: str = "json"):
     """Export user data (GDPR Article 20)"""
-    return await export_user_data(user_id, format)
+    # Unchanged data since the client's last download -> 304, no export built
+    etag = await get_export_etag(user_id, format)
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": EXPORT_CACHE_CONTROL})
+    
+    result = await export_user_data(user_id, format)
+    if isinstance(result, dict):
+        if not result.get("success"):
+            return result
+        # default=str covers Decimal columns that orjson can't encode natively
+        result = Response(
+            content=orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS, default=str),
+            media_type="application/json"
+        )
+    
+    if etag:
+        result.headers["ETag"] = etag
+        result.headers["Cache-Control"] = EXPORT_CACHE_CONTROL
+    return result
+
+@export_router.post("/{user_id}/export/jobs")
+@apply_rate_limit("general")
+async def enqueue_export_endpoint(request: Request, user_id: str, format: str = "zip"):
+    """Generate an export in the background; poll the status URL for the download link"""
+    from scripts.celery_tasks import celery_app
+    
+    job = celery_app.send_task("celery_tasks.generate_data_export", args=[user_id, format])
+    return {
+        "job_id": job.id,
+        "status": "queued",
+        "status_url": f"/api/v1/export/jobs/{job.id}"
+    }
+
+@export_router.get("/jobs/{job_id}")
+@apply_rate_limit("general")
+async def export_job_status_endpoint(request: Request, job_id: str):
+    """Get background export status and, once finished, the signed download URL"""
+    from scripts.celery_tasks import celery_app
+    
+    job = celery_app.AsyncResult(job_id)
+    if not job.ready():
+        return {"job_id": job_id, "status": job.status.lower()}
+    
+    result = job.result if job.successful() else {"success": False, "error": str(job.result)}
+    if not result.get("success"):
+        return {"job_id": job_id, "status": "failed", "error": result.get("error")}
+    
+    return {"job_id": job_id, "status": "completed", **result}
 
 @export_router.post("/{user_id}/import")
 @apply_rate_limit("general")
@@ -520,7 +573,8 @@ async def delete_data_endpoint(request: Request, user_id: str, verification_code
 @apply_rate_limit("general")
 async def get_access_logs_endpoint(request: Request, user_id: str):
     """Get data access logs (GDPR Article 15)"""
-    logs = get_data_access_logs(user_id)
+    # psycopg2 is blocking; keep it off the event loop
+    logs = await asyncio.to_thread(get_data_access_logs, user_id)
     return {"logs": logs, "count": len(logs)}
 
 # =============================================================================
@@ -536,7 +590,8 @@ from src.equipment_tracking import (
 @apply_rate_limit("general")
 async def add_equipment_endpoint(request: Request, equipment: EquipmentLog):
     """Add equipment to inventory"""
-    return add_equipment(
+    return await asyncio.to_thread(
+        add_equipment,
         equipment.user_id,
         equipment.equipment_type,
         equipment.brand,
@@ -549,7 +604,8 @@ async def add_equipment_endpoint(request: Request, equipment: EquipmentLog):
 @apply_rate_limit("general")
 async def log_usage_endpoint(request: Request, equipment_id: int, usage: EquipmentUsage):
     """Log equipment usage"""
-    return log_equipment_usage(
+    return await asyncio.to_thread(
+        log_equipment_usage,
         equipment_id,
         usage.user_id,
         usage.miles_added,
@@ -560,27 +616,27 @@ async def log_usage_endpoint(request: Request, equipment_id: int, usage: Equipme
 @apply_rate_limit("general")
 async def get_equipment_endpoint(request: Request, user_id: str, status: Optional[str] = None):
     """Get user's equipment"""
-    equipment = get_user_equipment(user_id, status)
+    equipment = await asyncio.to_thread(get_user_equipment, user_id, status)
     return {"equipment": equipment, "count": len(equipment)}
 
 @equipment_router.get("/{user_id}/alerts")
 @apply_rate_limit("general")
 async def get_alerts_endpoint(request: Request, user_id: str):
     """Get equipment replacement alerts"""
-    alerts = get_equipment_alerts(user_id)
+    alerts = await asyncio.to_thread(get_equipment_alerts, user_id)
     return {"alerts": alerts, "count": len(alerts)}
 
 @equipment_router.post("/{equipment_id}/retire")
 @apply_rate_limit("general")
 async def retire_equipment_endpoint(request: Request, equipment_id: int, user_id: str, notes: Optional[str] = None):
     """Retire equipment"""
-    return retire_equipment(equipment_id, user_id, notes)
+    return await asyncio.to_thread(retire_equipment, equipment_id, user_id, notes)
 
 @equipment_router.get("/{user_id}/analytics")
 @apply_rate_limit("general")
 async def equipment_analytics_endpoint(request: Request, user_id: str):
     """Get equipment analytics"""
-    return get_equipment_analytics(user_id)
+    return await asyncio.to_thread(get_equipment_analytics, user_id)
 
 # =============================================================================
 # GAMIFICATION ENDPOINTS
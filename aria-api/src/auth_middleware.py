@@ -5,11 +5,18 @@ Compatible with TrackLit's authentication system
 """
 
 from fastapi import Request, HTTPException, Depends, Header
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.security import HTTPBearer
 import jwt
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Union
 import os
+import json
+import time
+import ssl
+import hmac
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from src.cache import cache
 
@@ -25,6 +32,124 @@ JWT_EXPIRATION_HOURS = 24
 # Internal API Key for service-to-service authentication
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
 
+# Verified-token cache: lets repeat requests with the same JWT skip HMAC + JSON decode
+TOKEN_CACHE_MAX_SIZE = int(os.getenv("TOKEN_CACHE_MAX_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+_verified_token_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+_verified_token_lock = threading.Lock()
+
+def _token_cache_key(token: str) -> bytes:
+    """
+    Fixed-size key for a token (verified-token cache and revocation list)
+    so raw tokens are never held in memory or Redis as keys
+    """
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+def _get_cached_token(key: bytes, now: float) -> Optional[Dict[str, Any]]:
+    """Return the payload of a previously verified, unexpired token, or None on miss"""
+    with _verified_token_lock:
+        entry = _verified_token_cache.get(key)
+        if entry is None:
+            return None
+        payload, stale_at = entry
+        if now >= stale_at:
+            del _verified_token_cache[key]
+            return None
+        _verified_token_cache.move_to_end(key)
+        return payload
+
+def _cache_verified_token(key: bytes, payload: Dict[str, Any], now: float):
+    """Remember a verified payload until its exp (bounded by the cache TTL)"""
+    exp = payload.get("exp")
+    if not isinstance(exp, (int, float)):
+        return
+    with _verified_token_lock:
+        _verified_token_cache[key] = (payload, min(exp, now + TOKEN_CACHE_TTL_SECONDS))
+        _verified_token_cache.move_to_end(key)
+        while len(_verified_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _verified_token_cache.popitem(last=False)
+
+# Revoked-token index: an in-process view of blacklist:token:* so the common
+# (not revoked) case never pays a Redis round-trip. Kept coherent across replicas
+# via the blacklist_updates pub/sub channel plus a periodic rescan.
+BLACKLIST_KEY_PREFIX = "blacklist:token:"
+BLACKLIST_CHANNEL = "blacklist_updates"
+BLACKLIST_REFRESH_SECONDS = int(os.getenv("BLACKLIST_REFRESH_SECONDS", "60"))
+
+class RevokedTokenIndex:
+    """
+    Set of revoked token digests (hex of _token_cache_key) mirrored from Redis
+    
+    Membership is a "maybe" answer: entries are only dropped on rescan, so an
+    expired blacklist key can linger briefly and is confirmed against Redis.
+    A miss is authoritative and skips Redis entirely once start() has run
+    (the app lifespan does this) and a scan has succeeded; before that, and
+    in processes that never start it (workers, scripts, tests), every token
+    is a "maybe".
+    """
+    
+    def __init__(self):
+        self._digests = set()
+        self._lock = threading.Lock()
+        self._sync_thread = None
+        self._ready = False
+    
+    def __contains__(self, digest: str) -> bool:
+        return not self._ready or digest in self._digests
+    
+    def add(self, digest: str):
+        with self._lock:
+            self._digests.add(digest)
+    
+    def refresh(self):
+        """Rebuild the index from Redis with a non-blocking SCAN"""
+        if cache.redis is None:
+            return
+        start = len(BLACKLIST_KEY_PREFIX)
+        digests = {
+            key[start:]
+            for key in cache.redis.scan_iter(match=BLACKLIST_KEY_PREFIX + "*", count=500)
+        }
+        with self._lock:
+            self._digests = digests
+    
+    def start(self):
+        """Prime the index and start the background pub/sub + rescan thread"""
+        if cache.redis is None or self._sync_thread is not None:
+            return
+        try:
+            self.refresh()
+            self._ready = True
+        except Exception as e:
+            logger.warning(f"Could not prime revoked-token index: {e}")
+        self._sync_thread = threading.Thread(
+            target=self._sync_loop, name="revoked-token-sync", daemon=True
+        )
+        self._sync_thread.start()
+    
+    def _sync_loop(self):
+        pubsub = None
+        last_refresh = time.monotonic()
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = cache.redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(BLACKLIST_CHANNEL)
+                message = pubsub.get_message(timeout=1.0)
+                if message and message.get("type") == "message":
+                    self.add(message["data"])
+                if time.monotonic() - last_refresh >= BLACKLIST_REFRESH_SECONDS:
+                    self.refresh()
+                    self._ready = True
+                    last_refresh = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Revoked-token sync error: {e}")
+                pubsub = None
+                time.sleep(5)
+
+revoked_tokens = RevokedTokenIndex()
+
 class AuthMiddleware:
     """
     Authentication middleware for Aria API
@@ -39,6 +164,12 @@ class AuthMiddleware:
         self.algorithm = JWT_ALGORITHM
         self.internal_api_key = INTERNAL_API_KEY
         
+        # Pre-encoded once so PyJWT doesn't re-encode the key / rebuild the list per call.
+        # An unset secret stays None so decode fails rather than accepting empty-key HMACs.
+        self._secret_bytes = self.secret_key.encode("utf-8") if self.secret_key else None
+        self._algorithms = (self.algorithm,)
+        self._api_key_bytes = (self.internal_api_key or "").encode("utf-8")
+        
         if not self.secret_key:
             logger.warning("JWT_SECRET_KEY not set! Authentication will fail.")
     
@@ -86,15 +217,26 @@ class AuthMiddleware:
             HTTPException: If token is invalid or expired
         """
         try:
-            # Check cache first for blacklisted tokens
-            cache_key = f"blacklist:token:{token[:20]}"
-            if cache.get(cache_key):
+            # One digest of the whole token keys both the revocation list and
+            # the verified-token cache (a raw prefix would be the shared JWT header)
+            token_key = _token_cache_key(token)
+            
+            # Check blacklisted tokens first (revocation always wins); Redis is
+            # only consulted when the in-process index says "maybe"
+            digest = token_key.hex()
+            if digest in revoked_tokens and cache.redis is not None and cache.get(BLACKLIST_KEY_PREFIX + digest):
                 raise HTTPException(status_code=401, detail="Token has been revoked")
             
+            # Previously verified tokens only need their expiry re-checked
+            now = time.time()
+            cached = _get_cached_token(token_key, now)
+            if cached is not None:
+                return cached
+            
             payload = jwt.decode(
                 token, 
-                self.secret_key, 
-                algorithms=[self.algorithm],
+                self._secret_bytes, 
+                algorithms=self._algorithms,
                 options={"verify_exp": True}
             )
             
@@ -102,8 +244,11 @@ class AuthMiddleware:
             if not payload.get("user_id"):
                 raise HTTPException(status_code=401, detail="Invalid token: missing user_id")
             
+            _cache_verified_token(token_key, payload, now)
             return payload
             
+        except HTTPException:
+            raise
         except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail="Token has expired")
         except jwt.InvalidTokenError as e:
@@ -113,33 +258,52 @@ class AuthMiddleware:
             logger.error(f"Error verifying token: {e}")
             raise HTTPException(status_code=401, detail="Authentication failed")
     
-    def verify_api_key(self, api_key: str) -> bool:
+    def verify_api_key(self, api_key: Union[str, bytes]) -> bool:
         """
         Verify an API key for service-to-service authentication
         
         Args:
-            api_key: API key string
+            api_key: API key string, or the raw header bytes
             
         Returns:
             True if valid, False otherwise
         """
-        if not self.internal_api_key:
+        if not self._api_key_bytes:
             logger.error("INTERNAL_API_KEY not configured")
             return False
         
-        return api_key == self.internal_api_key
+        if isinstance(api_key, str):
+            api_key = api_key.encode("utf-8")
+        # Constant-time comparison so response timing doesn't leak the key
+        return hmac.compare_digest(api_key, self._api_key_bytes)
     
-    async def authenticate_request(self, request: Request) -> Dict[str, Any]:
+    def authenticate_headers(self, api_key: Optional[str], auth_header: Optional[str]) -> Dict[str, Any]:
         """
-        Authenticate a request using multiple methods
+        Authenticate from raw header values
         
-        Priority:
-        1. API Key (X-API-Key header)
-        2. JWT Bearer token (Authorization header)
-        3. Session cookie (for TrackLit platform integration)
+        Args:
+            api_key: Value of the X-API-Key header, if present
+            auth_header: Value of the Authorization header, if present
+            
+        Returns:
+            User information dict
+            
+        Raises:
+            HTTPException: If authentication fails
+        """
+        token = None
+        if auth_header and auth_header.startswith("Bearer "):
+            token = auth_header[7:]
+        return self.authenticate_credentials(api_key, token)
+    
+    def authenticate_credentials(self, api_key: Optional[Union[str, bytes]], token: Optional[str]) -> Dict[str, Any]:
+        """
+        Authenticate from an API key and/or an already-extracted bearer token
+        (shared by the ASGI and Request paths)
         
         Args:
-            request: FastAPI request object
+            api_key: Value of the X-API-Key header (str or raw bytes), if present
+            token: JWT from the Authorization header, without the "Bearer " scheme
             
         Returns:
             User information dict
@@ -148,7 +312,6 @@ class AuthMiddleware:
             HTTPException: If authentication fails
         """
         # Method 1: Check for API key (highest priority)
-        api_key = request.headers.get("X-API-Key")
         if api_key:
             if self.verify_api_key(api_key):
                 return {
@@ -162,34 +325,51 @@ class AuthMiddleware:
                 raise HTTPException(status_code=401, detail="Invalid API key")
         
         # Method 2: Check for JWT token
+        if token:
+            payload = self.verify_jwt_token(token)
+            return {
+                "authenticated": True,
+                "auth_method": "jwt",
+                "user_id": payload.get("user_id"),
+                "email": payload.get("email"),
+                "role": payload.get("role", "athlete")
+            }
+        
+        # No valid authentication found
+        raise HTTPException(
+            status_code=401, 
+            detail="Authentication required. Provide JWT token or API key."
+        )
+    
+    async def authenticate_request(self, request: Request) -> Dict[str, Any]:
+        """
+        Authenticate a request using multiple methods
+        
+        Priority:
+        1. API Key (X-API-Key header)
+        2. JWT Bearer token (Authorization header)
+        3. Session cookie (for TrackLit platform integration)
+        
+        Args:
+            request: FastAPI request object
+            
+        Returns:
+            User information dict
+            
+        Raises:
+            HTTPException: If authentication fails
+        """
+        api_key = request.headers.get("X-API-Key")
         auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            try:
-                payload = self.verify_jwt_token(token)
-                return {
-                    "authenticated": True,
-                    "auth_method": "jwt",
-                    "user_id": payload.get("user_id"),
-                    "email": payload.get("email"),
-                    "role": payload.get("role", "athlete")
-                }
-            except HTTPException:
-                raise
         
         # Method 3: Check for session cookie (TrackLit integration)
         # This would require coordination with TrackLit's session store
-        session_id = request.cookies.get("connect.sid")
-        if session_id:
+        if not api_key and not auth_header and request.cookies.get("connect.sid"):
             # Validate session with TrackLit or shared session store
             # For now, we'll skip this as it requires TrackLit's session secret
             logger.debug("Session-based auth not yet implemented")
         
-        # No valid authentication found
-        raise HTTPException(
-            status_code=401, 
-            detail="Authentication required. Provide JWT token or API key."
-        )
+        return self.authenticate_headers(api_key, auth_header)
     
     def revoke_token(self, token: str, ttl_seconds: int = 86400):
         """
@@ -199,8 +379,18 @@ class AuthMiddleware:
             token: JWT token to revoke
             ttl_seconds: How long to keep in blacklist (default 24 hours)
         """
-        cache_key = f"blacklist:token:{token[:20]}"
+        token_key = _token_cache_key(token)
+        digest = token_key.hex()
+        cache_key = BLACKLIST_KEY_PREFIX + digest
         cache.set(cache_key, True, ttl=ttl_seconds)
+        revoked_tokens.add(digest)
+        if cache.redis is not None:
+            try:
+                cache.redis.publish(BLACKLIST_CHANNEL, digest)
+            except Exception as e:
+                logger.warning(f"Could not publish token revocation: {e}")
+        with _verified_token_lock:
+            _verified_token_cache.pop(token_key, None)
         logger.info(f"Token revoked: {cache_key}")
     
     def require_role(self, required_roles: list):
@@ -210,27 +400,150 @@ class AuthMiddleware:
         Args:
             required_roles: List of allowed roles (e.g., ['admin', 'coach'])
         """
+        # Built once per route; "system" is always allowed
+        allowed = frozenset(required_roles) | {"system"}
+        detail = f"Insufficient permissions. Required roles: {', '.join(required_roles)}"
+        
         async def role_checker(auth_data: Dict = Depends(self.authenticate_request)):
-            user_role = auth_data.get("role", "athlete")
-            
-            if user_role not in required_roles and user_role != "system":
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"Insufficient permissions. Required roles: {', '.join(required_roles)}"
-                )
+            if auth_data.get("role", "athlete") not in allowed:
+                raise HTTPException(status_code=403, detail=detail)
             
             return auth_data
         
         return role_checker
 
+def check_hmac_backend() -> bool:
+    """
+    Log whether HS256 verification runs on OpenSSL or on pure Python.
+    
+    PyJWT signs/verifies HS256 with hmac.new(key, msg, hashlib.sha256); that
+    dispatches to OpenSSL (and its SHA-NI code paths on modern x86) only when
+    hashlib is OpenSSL-backed. Only public signals are used: an OpenSSL-backed
+    hashlib offers algorithms beyond algorithms_guaranteed (e.g. sha512_256),
+    the builtin fallback doesn't. Logs the backend once at startup.
+    
+    Returns:
+        True if hashlib is OpenSSL-backed
+    """
+    openssl_hashlib = bool(hashlib.algorithms_available - hashlib.algorithms_guaranteed)
+    if openssl_hashlib and ssl.OPENSSL_VERSION_INFO >= (1, 1, 1):
+        logger.info(f"JWT HMAC backend: {ssl.OPENSSL_VERSION} (hardware SHA-256 capable)")
+    else:
+        logger.warning(
+            f"JWT HMAC backend may not be OpenSSL-accelerated "
+            f"(openssl_hashlib={openssl_hashlib}, {ssl.OPENSSL_VERSION}); token verification will be slower"
+        )
+    return openssl_hashlib
+
 # Initialize global auth middleware
+check_hmac_backend()
 auth_middleware = AuthMiddleware()
 
+class AuthASGIMiddleware:
+    """
+    Pure ASGI authentication middleware
+    
+    Pulls the credentials straight from scope["headers"] (no Starlette
+    Request construction) into scope["state"]["auth_credentials"]. They are
+    only verified on first access through _auth_from_scope, so requests that
+    never read the principal don't pay for JWT checks or the revocation GET.
+    
+    Requests under protected_paths are authenticated up front and rejected
+    with a 401 directly.
+    
+    Usage:
+        app.add_middleware(AuthASGIMiddleware, protected_paths=("/admin",))
+    """
+    
+    def __init__(self, app, protected_paths: tuple = ()):
+        self.app = app
+        self.protected_paths = tuple(protected_paths)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        api_key = None
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                # Compared as bytes by verify_api_key, no decode needed
+                api_key = value
+            elif name == b"authorization" and value[:7] == b"Bearer ":
+                # Slice the scheme off the raw bytes; only the token is decoded
+                token = value[7:].decode("latin-1")
+        
+        state = scope.setdefault("state", {})
+        state["auth_credentials"] = (api_key, token)
+        if self.protected_paths and scope["path"].startswith(self.protected_paths):
+            if _resolve_scope_auth(state) is None:
+                await self._send_unauthorized(send, state["auth_error"].detail)
+                return
+        
+        await self.app(scope, receive, send)
+    
+    @staticmethod
+    async def _send_unauthorized(send, detail: str):
+        """Send a 401 JSON response without going through the app"""
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 401,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"www-authenticate", b"Bearer"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+def _resolve_scope_auth(state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Verify the credentials AuthASGIMiddleware stored, once per request
+    
+    Returns:
+        The principal, or None with the failure kept in state["auth_error"]
+    """
+    if "auth" not in state:
+        try:
+            state["auth"] = auth_middleware.authenticate_credentials(*state["auth_credentials"])
+        except HTTPException as e:
+            state["auth"] = None
+            state["auth_error"] = e
+    return state["auth"]
+
+def _auth_from_scope(request: Request) -> Optional[Dict[str, Any]]:
+    """
+    Return the principal for the credentials captured by AuthASGIMiddleware,
+    raising the authentication HTTPException on failure.
+    
+    Returns None when the middleware is not mounted (e.g. in isolated tests);
+    require_auth then authenticates the Request itself.
+    """
+    state = request.scope.get("state")
+    if state is None or "auth_credentials" not in state:
+        return None
+    auth = _resolve_scope_auth(state)
+    if auth is None:
+        raise state["auth_error"]
+    return auth
+
+def principal_from_scope(request: Request) -> Optional[Dict[str, Any]]:
+    """
+    The request's authenticated principal, or None when it carries no valid
+    credentials or the middleware is not mounted (never raises)
+    
+    Used by rate limiting, which must not trust a user_id the client sends.
+    """
+    scope = getattr(request, "scope", None)
+    state = scope.get("state") if isinstance(scope, dict) else None
+    if not isinstance(state, dict) or "auth_credentials" not in state:
+        return None
+    return _resolve_scope_auth(state)
+
 # FastAPI Dependencies for route protection
-async def require_auth(
-    request: Request,
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
-) -> Dict[str, Any]:
+async def require_auth(request: Request) -> Dict[str, Any]:
     """
     FastAPI dependency to require authentication on protected endpoints
     
@@ -240,12 +553,12 @@ async def require_auth(
             user_id = auth["user_id"]
             ...
     """
-    return await auth_middleware.authenticate_request(request)
+    auth = _auth_from_scope(request)
+    if auth is None:
+        auth = await auth_middleware.authenticate_request(request)
+    return auth
 
-async def optional_auth(
-    request: Request,
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
-) -> Optional[Dict[str, Any]]:
+async def optional_auth(request: Request) -> Optional[Dict[str, Any]]:
     """
     FastAPI dependency for optional authentication
     Returns None if not authenticated, user data if authenticated
@@ -260,7 +573,7 @@ async def optional_auth(
                 # Anonymous user
     """
     try:
-        return await auth_middleware.authenticate_request(request)
+        return await require_auth(request)
     except HTTPException:
         return None
 
@@ -273,14 +586,13 @@ def require_roles(*roles: str):
         async def admin_action(auth: dict = Depends(require_roles("admin", "coach"))):
             ...
     """
+    # Built once per route; "system" is always allowed
+    allowed = frozenset(roles) | {"system"}
+    detail = f"Insufficient permissions. Required roles: {', '.join(roles)}"
+    
     async def role_checker(auth_data: Dict = Depends(require_auth)):
-        user_role = auth_data.get("role", "athlete")
-        
-        if user_role not in roles and user_role != "system":
-            raise HTTPException(
-                status_code=403,
-                detail=f"Insufficient permissions. Required roles: {', '.join(roles)}"
-            )
+        if auth_data.get("role", "athlete") not in allowed:
+            raise HTTPException(status_code=403, detail=detail)
         
         return auth_data
     
@@ -293,7 +605,7 @@ async def get_user_id_from_request(request: Request) -> Optional[str]:
     Used by rate limiting system
     """
     try:
-        auth_data = await auth_middleware.authenticate_request(request)
+        auth_data = await require_auth(request)
         return auth_data.get("user_id")
     except:
         # Try to get from request body
@@ -2,7 +2,7 @@
 import redis
 import json
 import os
-from typing import Any, Optional
+from typing import Any, List, Optional
 import logging
 from src.keyvault_helper import get_env_with_keyvault_resolution
 
@@ -10,10 +10,48 @@ from src.keyvault_helper import get_env_with_keyvault_resolution
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keys per SCAN page and per UNLINK pipeline in clear_pattern
+CLEAR_PATTERN_BATCH_SIZE = int(os.getenv("CLEAR_PATTERN_BATCH_SIZE", "500"))
+
+# Check-then-INCR across rate-limit windows; ARGV holds ttl, limit pairs
+_INCR_WINDOWS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local count = tonumber(redis.call('GET', key) or '0')
+    if count >= tonumber(ARGV[2 * i]) then
+        return {0, i, count}
+    end
+end
+local result = {1, 0}
+for i, key in ipairs(KEYS) do
+    result[i + 2] = redis.call('INCR', key)
+    redis.call('EXPIRE', key, ARGV[2 * i - 1])
+end
+return result
+"""
+
+# INCR only when the key is already cached
+_INCR_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return nil
+"""
+
 class AriaCache:
     """Cache system for Aria using Azure Redis Cache (compatible with TrackLit)"""
     
     def __init__(self):
+        self._connect()
+        
+        # Lua scripts are registered once and then sent as EVALSHA (a 40-byte
+        # hash) rather than their full source on every call
+        self._scripts = {}
+        if self.redis is not None:
+            for source in (_INCR_WINDOWS_SCRIPT, _INCR_IF_EXISTS_SCRIPT):
+                self._script(source)
+    
+    def _connect(self):
+        """Connect self.redis, trying the URL and then host/port configurations"""
         try:
             # Support multiple Redis configuration methods
             # Method 1: Full Redis URL (Azure format: rediss://...)
@@ -142,6 +180,18 @@ class AriaCache:
             logger.error(f"Redis connection failed with unexpected error: {e}")
             self.redis = None
     
+    def _script(self, source: str):
+        """
+        redis-py Script for `source`, bound to the current client
+        
+        Re-registered if the client was replaced. Script falls back to
+        SCRIPT LOAD when the server has lost the script (restart, flush).
+        """
+        script = self._scripts.get(source)
+        if script is None or script.registered_client is not self.redis:
+            script = self._scripts[source] = self.redis.register_script(source)
+        return script
+    
     def is_connected(self) -> bool:
         """Check if Redis is connected and responsive"""
         try:
@@ -187,6 +237,26 @@ class AriaCache:
             logger.error(f"Unexpected error during cache get for key {key}: {e}")
             return None
     
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Get several keys in a single MGET round trip (None for misses)"""
+        if not keys or self.redis is None:
+            return [None] * len(keys)
+        
+        try:
+            values = self.redis.mget(keys)
+        except redis.RedisError as e:
+            logger.error(f"Redis error during mget for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+        
+        results = []
+        for key, data in zip(keys, values):
+            try:
+                results.append(json.loads(data) if data else None)
+            except json.JSONDecodeError as e:
+                logger.error(f"JSON decode error for key {key}: {e}")
+                results.append(None)
+        return results
+    
     def set(self, key: str, value: Any, ttl: int = 3600) -> bool:
         """Set data in cache with TTL (Time To Live in seconds)"""
         if not self.is_connected():
@@ -217,6 +287,55 @@ class AriaCache:
             logger.error(f"Unexpected error during cache set for key {key}: {e}")
             return False
     
+    def incr_windows(self, keys: List[str], ttls: List[int], limits: List[int]) -> Optional[List[int]]:
+        """
+        Atomically check and count one hit against several fixed windows
+        
+        Runs server-side in one round trip: if any window is already at its
+        limit nothing is incremented, otherwise every counter is INCRed and
+        given its TTL.
+        
+        Args:
+            keys: One counter key per window
+            ttls: Expiry in seconds for each key
+            limits: Max hits per window
+            
+        Returns:
+            [1, 0, count, ...] with the new counts when allowed,
+            [0, i, count] when window i (1-based) is full, or None if Redis
+            is unavailable
+        """
+        if self.redis is None:
+            logger.warning("Redis not connected, skipping window counters")
+            return None
+        
+        args = []
+        for ttl, limit in zip(ttls, limits):
+            args += [ttl, limit]
+        
+        try:
+            return [int(value) for value in self._script(_INCR_WINDOWS_SCRIPT)(keys=keys, args=args)]
+        except redis.RedisError as e:
+            logger.error(f"Redis error during window incr for {keys}: {e}")
+            return None
+    
+    def incr_if_exists(self, key: str) -> Optional[int]:
+        """
+        Increment a cached count in place, keeping its TTL
+        
+        Returns None without creating the key when it isn't cached, so a
+        missing count is reloaded from the database rather than restarting at 1.
+        """
+        if self.redis is None:
+            return None
+        
+        try:
+            result = self._script(_INCR_IF_EXISTS_SCRIPT)(keys=[key])
+            return int(result) if result is not None else None
+        except redis.RedisError as e:
+            logger.error(f"Redis error during incr for key {key}: {e}")
+            return None
+    
     def delete(self, key: str) -> bool:
         """Delete data from cache"""
         if not self.is_connected():
@@ -246,17 +365,22 @@ class AriaCache:
             return 0
             
         try:
-            # Find keys matching pattern
-            keys = list(self.redis.scan_iter(match=pattern))
+            # SCAN incrementally and UNLINK in batches, so neither the scan
+            # nor one huge DEL blocks Redis on a large keyspace
+            count = 0
+            pipe = self.redis.pipeline(transaction=False)
+            for key in self.redis.scan_iter(match=pattern, count=CLEAR_PATTERN_BATCH_SIZE):
+                pipe.unlink(key)
+                if len(pipe) >= CLEAR_PATTERN_BATCH_SIZE:
+                    count += sum(pipe.execute())
+            if len(pipe):
+                count += sum(pipe.execute())
             
-            if keys:
-                # Delete all matching keys
-                count = self.redis.delete(*keys)
+            if count:
                 logger.info(f"Cleared {count} cache keys matching pattern: {pattern}")
-                return count
             else:
                 logger.info(f"No keys found matching pattern: {pattern}")
-                return 0
+            return count
                 
         except redis.RedisError as e:
             logger.error(f"Redis error during pattern clear: {e}")
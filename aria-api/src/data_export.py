@@ -2,18 +2,48 @@
 Data Export and GDPR Compliance Module
 Handles data export, import, and user data management for privacy compliance
 """
+import os
 import logging
-import json
-import csv
 import io
+import asyncio
+import atexit
+import functools
+import hashlib
+import queue
+import tempfile
+import threading
+import time
+import uuid
 import zipfile
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator
 from datetime import datetime, timedelta
-from src.database import get_db_connection
+from src.database import db_connection, db_cursor, INTERNAL_ERROR
 import psycopg2.extras
+import orjson
+from fastapi.responses import StreamingResponse
 
 logger = logging.getLogger(__name__)
 
+# orjson emits bytes directly; datetimes and UUIDs are native, Decimal falls back to str
+EXPORT_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+# Repeat downloads within this window are served from the browser cache
+EXPORT_CACHE_CONTROL = f"private, max-age={int(os.getenv('EXPORT_CACHE_MAX_AGE', '60'))}"
+
+# Rows per multi-VALUES INSERT when importing
+IMPORT_PAGE_SIZE = int(os.getenv("IMPORT_PAGE_SIZE", "1000"))
+
+# Rows fetched per round-trip when streaming from a server-side cursor
+EXPORT_CURSOR_ITERSIZE = int(os.getenv("EXPORT_CURSOR_ITERSIZE", "2000"))
+
+# Max export queries in flight at once per process, so concurrent exports
+# fanning out in parallel can't exhaust the shared connection pool
+EXPORT_DB_CONCURRENCY = int(os.getenv("EXPORT_DB_CONCURRENCY", "4"))
+_export_query_slots = threading.BoundedSemaphore(EXPORT_DB_CONCURRENCY)
+
+# Streamed export rows are buffered in memory up to this size, then on disk
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+
 # =============================================================================
 # DATA EXPORT FUNCTIONS
 # =============================================================================
@@ -24,24 +54,7 @@ async def export_user_data(user_id: str, format: str = "json") -> Dict[str, Any]
     GDPR Article 20: Right to data portability
     """
     try:
-        # Collect all user data from various tables
-        user_data = {
-            "export_metadata": {
-                "user_id": user_id,
-                "export_date": datetime.now().isoformat(),
-                "format": format
-            },
-            "profile": await _get_user_profile(user_id),
-            "training_sessions": await _get_training_sessions(user_id),
-            "goals": await _get_user_goals(user_id),
-            "conversations": await _get_user_conversations(user_id),
-            "race_history": await _get_race_history(user_id),
-            "social_connections": await _get_social_connections(user_id),
-            "analytics": await _get_user_analytics(user_id),
-            "notifications": await _get_user_notifications(user_id),
-            "equipment": await _get_user_equipment(user_id),
-            "achievements": await _get_user_achievements(user_id)
-        }
+        user_data = await _collect_export_data(user_id, format)
         
         if format == "json":
             return {
@@ -62,167 +75,382 @@ async def export_user_data(user_id: str, format: str = "json") -> Dict[str, Any]
             }
         
         elif format == "zip":
-            # Create ZIP with multiple files
-            zip_data = await _create_zip_export(user_data, user_id)
-            return {
-                "success": True,
-                "data": zip_data,
-                "content_type": "application/zip",
-                "filename": f"aria_data_export_{user_id}_{datetime.now().strftime('%Y%m%d')}.zip"
-            }
+            # Stream ZIP with multiple files
+            filename = f"aria_data_export_{user_id}_{datetime.now().strftime('%Y%m%d')}.zip"
+            return StreamingResponse(
+                _create_zip_export(user_data, user_id),
+                media_type="application/zip",
+                headers={"Content-Disposition": f"attachment; filename={filename}"}
+            )
         
         else:
             return {"success": False, "error": f"Unsupported format: {format}"}
             
+    except Exception:
+        logger.exception("Error exporting user data")
+        return INTERNAL_ERROR
+
+
+async def _collect_export_data(user_id: str, format: str) -> Dict[str, Any]:
+    """Gather export metadata plus every data category for a user"""
+    if format == "zip":
+        # Row-heavy categories are read from server-side cursors
+        # while the archive is being written
+        categories = await _get_export_categories(user_id, stream_rows=True)
+    else:
+        # Collect all user data in one round-trip, falling back to
+        # per-category queries if the combined query fails
+        categories = await _get_export_bundle(user_id)
+        if categories is None:
+            categories = await _get_export_categories(user_id)
+    
+    return {
+        "export_metadata": {
+            "user_id": user_id,
+            "export_date": datetime.now().isoformat(),
+            "format": format
+        },
+        **categories
+    }
+
+
+# Every category is aggregated server-side so the whole export is one
+# statement; jsonb does not keep key order, so categories are re-ordered
+# in Python.
+_EXPORT_BUNDLE_QUERY = """
+    SELECT jsonb_build_object(
+        'profile', (
+            SELECT to_jsonb(u) FROM users u WHERE u.user_id = %(user_id)s
+        ),
+        'training_sessions', (
+            SELECT jsonb_agg(t ORDER BY t.session_date DESC)
+            FROM training_sessions t WHERE t.user_id = %(user_id)s
+        ),
+        'goals', (
+            SELECT jsonb_agg(g) FROM goals g WHERE g.user_id = %(user_id)s
+        ),
+        'conversations', (
+            SELECT jsonb_agg(c ORDER BY c.created_at DESC)
+            FROM conversations c WHERE c.user_id = %(user_id)s
+        ),
+        'race_history', (
+            SELECT jsonb_agg(rh ORDER BY rh.race_date DESC)
+            FROM (
+                SELECT r.*, rr.finish_time, rr.placement, rr.splits
+                FROM races r
+                LEFT JOIN race_results rr ON r.race_id = rr.race_id
+                WHERE r.user_id = %(user_id)s
+            ) rh
+        ),
+        'followers', (
+            SELECT jsonb_agg(jsonb_build_object('follower_id', ac.follower_id, 'created_at', ac.created_at))
+            FROM athlete_connections ac WHERE ac.following_id = %(user_id)s
+        ),
+        'following', (
+            SELECT jsonb_agg(jsonb_build_object('following_id', ac.following_id, 'created_at', ac.created_at))
+            FROM athlete_connections ac WHERE ac.follower_id = %(user_id)s
+        ),
+        'messages', (
+            SELECT jsonb_agg(m ORDER BY m.sent_at DESC)
+            FROM messages m WHERE m.sender_id = %(user_id)s OR m.recipient_id = %(user_id)s
+        ),
+        'notifications', (
+            SELECT jsonb_agg(n ORDER BY n.created_at DESC)
+            FROM (
+                SELECT * FROM notifications
+                WHERE user_id = %(user_id)s
+                ORDER BY created_at DESC
+                LIMIT 1000
+            ) n
+        ),
+        'equipment', (
+            SELECT jsonb_agg(e) FROM equipment e WHERE e.user_id = %(user_id)s
+        ),
+        'achievements', (
+            SELECT jsonb_agg(a) FROM achievements a WHERE a.user_id = %(user_id)s
+        )
+    ) AS export
+"""
+
+
+async def _get_export_bundle(user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Fetch every export category with a single query.
+    
+    Returns:
+        Category dict, or None if the combined query failed
+    """
+    try:
+        rows = await asyncio.to_thread(_fetch_all, _EXPORT_BUNDLE_QUERY, {"user_id": user_id})
     except Exception as e:
-        logger.error(f"Error exporting user data: {e}")
-        return {"success": False, "error": str(e)}
+        logger.warning(f"Combined export query failed, using per-category queries: {e}")
+        return None
+    
+    bundle = rows[0]["export"]
+    return {
+        "profile": bundle.get("profile") or {},
+        "training_sessions": bundle.get("training_sessions") or [],
+        "goals": bundle.get("goals") or [],
+        "conversations": bundle.get("conversations") or [],
+        "race_history": bundle.get("race_history") or [],
+        "social_connections": {
+            "followers": bundle.get("followers") or [],
+            "following": bundle.get("following") or [],
+            "messages": bundle.get("messages") or []
+        },
+        "analytics": await _get_user_analytics(user_id),
+        "notifications": bundle.get("notifications") or [],
+        "equipment": bundle.get("equipment") or [],
+        "achievements": bundle.get("achievements") or []
+    }
+
+
+# Cheap change detector for the exported data: per table, the row count plus
+# an order-free digest of the row versions (xmin changes on every
+# INSERT/UPDATE). Summing hashes instead of taking max(xmin) stays correct
+# across xid wraparound, where a newer row can carry a smaller xmin; the
+# exported tables have no updated_at column to use instead. Every table an
+# export reads must be listed here, or edits to it are served as 304s.
+_VERSION_FINGERPRINT = "count(*) || ':' || coalesce(sum(hashtext({alias}.xmin::text)), 0)"
+_EXPORT_VERSION_SOURCES = (
+    ("u", "users u WHERE u.user_id = %(user_id)s"),
+    ("t", "training_sessions t WHERE t.user_id = %(user_id)s"),
+    ("g", "goals g WHERE g.user_id = %(user_id)s"),
+    ("c", "conversations c WHERE c.user_id = %(user_id)s"),
+    ("r", "races r WHERE r.user_id = %(user_id)s"),
+    ("rr", "race_results rr JOIN races r ON r.race_id = rr.race_id WHERE r.user_id = %(user_id)s"),
+    ("ac", "athlete_connections ac WHERE ac.follower_id = %(user_id)s OR ac.following_id = %(user_id)s"),
+    ("m", "messages m WHERE m.sender_id = %(user_id)s OR m.recipient_id = %(user_id)s"),
+    ("n", "notifications n WHERE n.user_id = %(user_id)s"),
+    ("e", "equipment e WHERE e.user_id = %(user_id)s"),
+    ("a", "achievements a WHERE a.user_id = %(user_id)s"),
+)
+_EXPORT_VERSION_QUERY = "SELECT concat_ws('|',\n" + ",\n".join(
+    f"    (SELECT {_VERSION_FINGERPRINT.format(alias=alias)} FROM {source})"
+    for alias, source in _EXPORT_VERSION_SOURCES
+) + "\n) AS version"
+
+
+async def get_export_etag(user_id: str, format: str) -> Optional[str]:
+    """
+    Weak ETag for a user's export, derived from a single version query
+    
+    Args:
+        user_id: User ID
+        format: Export format (part of the tag, since bodies differ per format)
+        
+    Returns:
+        ETag header value, or None if the version could not be determined
+    """
+    try:
+        rows = await asyncio.to_thread(_fetch_all, _EXPORT_VERSION_QUERY, {"user_id": user_id})
+    except Exception as e:
+        logger.warning(f"Could not compute export version: {e}")
+        return None
+    
+    version = f"{user_id}:{format}:{rows[0]['version']}"
+    return 'W/"' + hashlib.blake2b(version.encode("utf-8"), digest_size=8).hexdigest() + '"'
+
+
+async def _get_export_categories(user_id: str, stream_rows: bool = False) -> Dict[str, Any]:
+    """
+    Fetch each export category with its own query, concurrently
+    
+    Args:
+        user_id: User ID
+        stream_rows: Return row-heavy categories as row iterator factories
+            instead of fetching them
+    """
+    fetchers = {
+        "profile": _get_user_profile,
+        "training_sessions": _get_training_sessions,
+        "goals": _get_user_goals,
+        "conversations": _get_user_conversations,
+        "race_history": _get_race_history,
+        "social_connections": _get_social_connections,
+        "analytics": _get_user_analytics,
+        "notifications": _get_user_notifications,
+        "equipment": _get_user_equipment,
+        "achievements": _get_user_achievements
+    }
+    streamed = _STREAMED_EXPORT_QUERIES if stream_rows else {}
+    
+    fetched = [category for category in fetchers if category not in streamed]
+    results = await asyncio.gather(*(fetchers[category](user_id) for category in fetched))
+    categories = dict(zip(fetched, results))
+    
+    return {
+        category: categories[category] if category in categories
+        else functools.partial(_iter_rows, streamed[category], (user_id,))
+        for category in fetchers
+    }
+
+
+# Row-heavy categories; the ZIP export streams these from server-side cursors
+_TRAINING_SESSIONS_QUERY = """
+    SELECT * FROM training_sessions 
+    WHERE user_id = %s 
+    ORDER BY session_date DESC
+"""
+
+_CONVERSATIONS_QUERY = """
+    SELECT * FROM conversations 
+    WHERE user_id = %s 
+    ORDER BY created_at DESC
+"""
+
+_RACE_HISTORY_QUERY = """
+    SELECT r.*, rr.finish_time, rr.placement, rr.splits
+    FROM races r
+    LEFT JOIN race_results rr ON r.race_id = rr.race_id
+    WHERE r.user_id = %s
+    ORDER BY r.race_date DESC
+"""
+
+_NOTIFICATIONS_QUERY = """
+    SELECT * FROM notifications 
+    WHERE user_id = %s 
+    ORDER BY created_at DESC
+    LIMIT 1000
+"""
+
+_STREAMED_EXPORT_QUERIES = {
+    "training_sessions": _TRAINING_SESSIONS_QUERY,
+    "conversations": _CONVERSATIONS_QUERY,
+    "race_history": _RACE_HISTORY_QUERY,
+    "notifications": _NOTIFICATIONS_QUERY
+}
+
+
+def _fetch_all(query: str, params: Any) -> List[Dict[str, Any]]:
+    """
+    Run a SELECT and return all rows as dicts (blocking).
+    Called through asyncio.to_thread so export queries run in parallel
+    without stalling the event loop.
+    """
+    with _export_query_slots:
+        with db_connection() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            
+            try:
+                cur.execute(query, params)
+                return [dict(row) for row in cur.fetchall()]
+            finally:
+                cur.close()
+
+
+def _iter_rows(query: str, params: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Stream rows from a named (server-side) cursor.
+    
+    The cursor is drained EXPORT_CURSOR_ITERSIZE rows at a time into a spool
+    (memory, spilling to a temp file past EXPORT_SPOOL_MAX_BYTES) while the
+    query slot and pooled connection are held; rows are yielded from the
+    spool afterwards, so a client reading the response slowly never pins
+    either of them.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES) as spool:
+        with _export_query_slots:
+            with db_connection() as conn:
+                cur = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.RealDictCursor)
+                cur.itersize = EXPORT_CURSOR_ITERSIZE
+                
+                try:
+                    cur.execute(query, params)
+                    for row in cur:
+                        # orjson escapes newlines inside strings, so one row per line
+                        spool.write(orjson.dumps(dict(row), option=orjson.OPT_NON_STR_KEYS, default=str))
+                        spool.write(b"\n")
+                finally:
+                    cur.close()
+        
+        spool.seek(0)
+        for line in spool:
+            yield orjson.loads(line)
 
 
 async def _get_user_profile(user_id: str) -> Dict[str, Any]:
     """Get user profile data"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
+        rows = await asyncio.to_thread(_fetch_all, """
             SELECT * FROM users WHERE user_id = %s
         """, (user_id,))
-        profile = cur.fetchone()
-        return dict(profile) if profile else {}
+        return rows[0] if rows else {}
     except Exception as e:
         logger.error(f"Error fetching profile: {e}")
         return {}
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_training_sessions(user_id: str) -> List[Dict[str, Any]]:
     """Get all training sessions"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            SELECT * FROM training_sessions 
-            WHERE user_id = %s 
-            ORDER BY session_date DESC
-        """, (user_id,))
-        sessions = cur.fetchall()
-        return [dict(session) for session in sessions]
+        return await asyncio.to_thread(_fetch_all, _TRAINING_SESSIONS_QUERY, (user_id,))
     except Exception as e:
         logger.error(f"Error fetching training sessions: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_user_goals(user_id: str) -> List[Dict[str, Any]]:
     """Get user goals"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
+        return await asyncio.to_thread(_fetch_all, """
             SELECT * FROM goals WHERE user_id = %s
         """, (user_id,))
-        goals = cur.fetchall()
-        return [dict(goal) for goal in goals]
     except Exception as e:
         logger.error(f"Error fetching goals: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_user_conversations(user_id: str) -> List[Dict[str, Any]]:
     """Get conversation history"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            SELECT * FROM conversations 
-            WHERE user_id = %s 
-            ORDER BY created_at DESC
-        """, (user_id,))
-        conversations = cur.fetchall()
-        return [dict(conv) for conv in conversations]
+        return await asyncio.to_thread(_fetch_all, _CONVERSATIONS_QUERY, (user_id,))
     except Exception as e:
         logger.error(f"Error fetching conversations: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_race_history(user_id: str) -> List[Dict[str, Any]]:
     """Get race history"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            SELECT r.*, rr.finish_time, rr.placement, rr.splits
-            FROM races r
-            LEFT JOIN race_results rr ON r.race_id = rr.race_id
-            WHERE r.user_id = %s
-            ORDER BY r.race_date DESC
-        """, (user_id,))
-        races = cur.fetchall()
-        return [dict(race) for race in races]
+        return await asyncio.to_thread(_fetch_all, _RACE_HISTORY_QUERY, (user_id,))
     except Exception as e:
         logger.error(f"Error fetching race history: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_social_connections(user_id: str) -> Dict[str, Any]:
     """Get social connections"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        # Followers
-        cur.execute("""
-            SELECT follower_id, created_at 
-            FROM athlete_connections 
-            WHERE following_id = %s
-        """, (user_id,))
-        followers = cur.fetchall()
-        
-        # Following
-        cur.execute("""
-            SELECT following_id, created_at 
-            FROM athlete_connections 
-            WHERE follower_id = %s
-        """, (user_id,))
-        following = cur.fetchall()
-        
-        # Messages
-        cur.execute("""
-            SELECT * FROM messages 
-            WHERE sender_id = %s OR recipient_id = %s
-            ORDER BY sent_at DESC
-        """, (user_id, user_id))
-        messages = cur.fetchall()
+        followers, following, messages = await asyncio.gather(
+            # Followers
+            asyncio.to_thread(_fetch_all, """
+                SELECT follower_id, created_at 
+                FROM athlete_connections 
+                WHERE following_id = %s
+            """, (user_id,)),
+            # Following
+            asyncio.to_thread(_fetch_all, """
+                SELECT following_id, created_at 
+                FROM athlete_connections 
+                WHERE follower_id = %s
+            """, (user_id,)),
+            # Messages
+            asyncio.to_thread(_fetch_all, """
+                SELECT * FROM messages 
+                WHERE sender_id = %s OR recipient_id = %s
+                ORDER BY sent_at DESC
+            """, (user_id, user_id))
+        )
         
         return {
-            "followers": [dict(f) for f in followers],
-            "following": [dict(f) for f in following],
-            "messages": [dict(m) for m in messages]
+            "followers": followers,
+            "following": following,
+            "messages": messages
         }
     except Exception as e:
         logger.error(f"Error fetching social connections: {e}")
         return {"followers": [], "following": [], "messages": []}
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_user_analytics(user_id: str) -> Dict[str, Any]:
@@ -234,115 +462,122 @@ async def _get_user_analytics(user_id: str) -> Dict[str, Any]:
 
 async def _get_user_notifications(user_id: str) -> List[Dict[str, Any]]:
     """Get notification history"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            SELECT * FROM notifications 
-            WHERE user_id = %s 
-            ORDER BY created_at DESC
-            LIMIT 1000
-        """, (user_id,))
-        notifications = cur.fetchall()
-        return [dict(notif) for notif in notifications]
+        return await asyncio.to_thread(_fetch_all, _NOTIFICATIONS_QUERY, (user_id,))
     except Exception as e:
         logger.error(f"Error fetching notifications: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_user_equipment(user_id: str) -> List[Dict[str, Any]]:
     """Get equipment tracking data"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
+        return await asyncio.to_thread(_fetch_all, """
             SELECT * FROM equipment 
             WHERE user_id = %s
         """, (user_id,))
-        equipment = cur.fetchall()
-        return [dict(eq) for eq in equipment]
     except Exception as e:
         logger.error(f"Error fetching equipment: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 async def _get_user_achievements(user_id: str) -> List[Dict[str, Any]]:
     """Get achievements and badges"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
+        return await asyncio.to_thread(_fetch_all, """
             SELECT * FROM achievements 
             WHERE user_id = %s
         """, (user_id,))
-        achievements = cur.fetchall()
-        return [dict(ach) for ach in achievements]
     except Exception as e:
         logger.error(f"Error fetching achievements: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
+
+
+# Flattened CSV layout: (category, source list, date field)
+_CSV_SOURCES = (
+    ("training_session", "training_sessions", "session_date"),
+    ("race", "race_history", "race_date"),
+    ("goal", "goals", "created_at")
+)
 
 
 async def _convert_to_csv(data: Dict[str, Any]) -> str:
-    """Convert data to CSV format"""
+    """
+    Convert data to CSV format
+    
+    The schema is fixed (category, date, data), so rows are formatted directly
+    instead of going through csv.DictWriter. Only the JSON data column can
+    contain quotes or commas; it is always quoted with inner quotes doubled.
+    """
+    def format_rows():
+        for category, key, date_field in _CSV_SOURCES:
+            for item in data.get(key, []):
+                date = item.get(date_field)
+                payload = orjson.dumps(item, option=orjson.OPT_NON_STR_KEYS, default=str).decode()
+                quoted = payload.replace('"', '""')
+                yield f'{category},{"" if date is None else date},"{quoted}"\r\n'
+    
     output = io.StringIO()
+    rows = format_rows()
+    first_row = next(rows, None)
     
-    # Flatten the data structure for CSV
-    flattened_data = []
-    
-    # Add training sessions
-    for session in data.get("training_sessions", []):
-        flattened_data.append({
-            "category": "training_session",
-            "date": session.get("session_date"),
-            "data": json.dumps(session)
-        })
-    
-    # Add races
-    for race in data.get("race_history", []):
-        flattened_data.append({
-            "category": "race",
-            "date": race.get("race_date"),
-            "data": json.dumps(race)
-        })
-    
-    # Add goals
-    for goal in data.get("goals", []):
-        flattened_data.append({
-            "category": "goal",
-            "date": goal.get("created_at"),
-            "data": json.dumps(goal)
-        })
-    
-    if flattened_data:
-        writer = csv.DictWriter(output, fieldnames=["category", "date", "data"])
-        writer.writeheader()
-        writer.writerows(flattened_data)
+    if first_row is not None:
+        output.write("category,date,data\r\n")
+        output.write(first_row)
+        output.writelines(rows)
     
     return output.getvalue()
 
 
-async def _create_zip_export(data: Dict[str, Any], user_id: str) -> bytes:
-    """Create ZIP file with multiple JSON files"""
-    zip_buffer = io.BytesIO()
+class _ZipChunkSink:
+    """Write-only file object that collects zip output until it is drained"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _create_zip_export(data: Dict[str, Any], user_id: str) -> Iterator[bytes]:
+    """
+    Stream a ZIP file with multiple JSON files.
     
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    Yields compressed chunks after each category is encoded, so peak memory
+    is bounded by a single category rather than the whole archive. A
+    category given as a callable is treated as a row iterator factory and
+    written incrementally.
+    """
+    sink = _ZipChunkSink()
+    # The sink is not seekable, so zipfile writes data descriptors after
+    # each member instead of seeking back to patch local headers
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zip_file:
         # Add each data category as separate JSON file
         for category, content in data.items():
             if category != "export_metadata":
                 filename = f"{category}.json"
-                zip_file.writestr(filename, json.dumps(content, indent=2, default=str))
+                with zip_file.open(filename, 'w', force_zip64=True) as member:
+                    if callable(content):
+                        # Streamed category: write a JSON array row by row
+                        member.write(b"[")
+                        for i, row in enumerate(content()):
+                            member.write(b",\n" if i else b"\n")
+                            member.write(orjson.dumps(row, option=EXPORT_JSON_OPTIONS, default=str))
+                            if i % EXPORT_CURSOR_ITERSIZE == 0:
+                                yield sink.drain()
+                        member.write(b"\n]")
+                    else:
+                        member.write(orjson.dumps(content, option=EXPORT_JSON_OPTIONS, default=str))
+                yield sink.drain()
         
         # Add README
         readme = f"""
@@ -369,7 +604,88 @@ For questions about this export, contact support@aria.com
 """
         zip_file.writestr("README.txt", readme)
     
-    return zip_buffer.getvalue()
+    yield sink.drain()
+
+# =============================================================================
+# BACKGROUND EXPORT (BLOB STORAGE + SIGNED URL)
+# =============================================================================
+
+EXPORT_BLOB_CONTAINER = os.getenv("AZURE_STORAGE_EXPORT_CONTAINER", "aria-exports")
+EXPORT_URL_TTL_HOURS = int(os.getenv("EXPORT_URL_TTL_HOURS", "24"))
+
+_EXPORT_CONTENT_TYPES = {
+    "json": "application/json",
+    "csv": "text/csv",
+    "zip": "application/zip"
+}
+
+
+def generate_export_file(user_id: str, format: str = "zip") -> Dict[str, Any]:
+    """
+    Build a user's export and upload it to blob storage (runs in a Celery worker)
+    
+    Args:
+        user_id: User ID
+        format: Export format (json, csv, or zip)
+        
+    Returns:
+        Dict with a time-limited SAS download URL
+    """
+    from azure.storage.blob import BlobServiceClient, ContentSettings, BlobSasPermissions, generate_blob_sas
+    
+    if format not in _EXPORT_CONTENT_TYPES:
+        return {"success": False, "error": f"Unsupported format: {format}"}
+    
+    connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    if not connection_string:
+        return {"success": False, "error": "Blob storage not configured"}
+    
+    try:
+        user_data = asyncio.run(_collect_export_data(user_id, format))
+        
+        if format == "zip":
+            # Chunks are uploaded as they are compressed
+            body = _create_zip_export(user_data, user_id)
+        elif format == "csv":
+            body = asyncio.run(_convert_to_csv(user_data)).encode("utf-8")
+        else:
+            body = orjson.dumps(user_data, option=orjson.OPT_NON_STR_KEYS, default=str)
+        
+        filename = f"aria_data_export_{user_id}_{datetime.now().strftime('%Y%m%d')}.{format}"
+        blob_name = f"users/{user_id}/exports/{uuid.uuid4().hex}/{filename}"
+        
+        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_client = blob_service_client.get_blob_client(container=EXPORT_BLOB_CONTAINER, blob=blob_name)
+        blob_client.upload_blob(
+            body,
+            overwrite=True,
+            content_settings=ContentSettings(
+                content_type=_EXPORT_CONTENT_TYPES[format],
+                content_disposition=f"attachment; filename={filename}"
+            )
+        )
+        
+        expires_at = datetime.utcnow() + timedelta(hours=EXPORT_URL_TTL_HOURS)
+        sas_token = generate_blob_sas(
+            account_name=blob_service_client.account_name,
+            container_name=EXPORT_BLOB_CONTAINER,
+            blob_name=blob_name,
+            account_key=blob_service_client.credential.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=expires_at
+        )
+        
+        logger.info(f"Data export uploaded for {user_id}: {blob_name}")
+        return {
+            "success": True,
+            "download_url": f"{blob_client.url}?{sas_token}",
+            "expires_at": expires_at.isoformat(),
+            "filename": filename
+        }
+        
+    except Exception:
+        logger.exception("Error generating export file")
+        return INTERNAL_ERROR
 
 # =============================================================================
 # DATA IMPORT FUNCTIONS
@@ -384,17 +700,17 @@ async def import_user_data(user_id: str, data: Dict[str, Any]) -> Dict[str, Any]
         
         # Import training sessions
         if "training_sessions" in data:
-            count = await _import_training_sessions(user_id, data["training_sessions"])
+            count = await asyncio.to_thread(_import_training_sessions, user_id, data["training_sessions"])
             imported_counts["training_sessions"] = count
         
         # Import goals
         if "goals" in data:
-            count = await _import_goals(user_id, data["goals"])
+            count = await asyncio.to_thread(_import_goals, user_id, data["goals"])
             imported_counts["goals"] = count
         
         # Import equipment
         if "equipment" in data:
-            count = await _import_equipment(user_id, data["equipment"])
+            count = await asyncio.to_thread(_import_equipment, user_id, data["equipment"])
             imported_counts["equipment"] = count
         
         return {
@@ -403,88 +719,70 @@ async def import_user_data(user_id: str, data: Dict[str, Any]) -> Dict[str, Any]
             "message": "Data imported successfully"
         }
         
-    except Exception as e:
-        logger.error(f"Error importing user data: {e}")
-        return {"success": False, "error": str(e)}
+    except Exception:
+        logger.exception("Error importing user data")
+        return INTERNAL_ERROR
 
 
-async def _import_training_sessions(user_id: str, sessions: List[Dict[str, Any]]) -> int:
+def _import_training_sessions(user_id: str, sessions: List[Dict[str, Any]]) -> int:
     """Import training sessions"""
-    conn = get_db_connection()
-    cur = conn.cursor()
     count = 0
-    
     try:
-        for session in sessions:
-            cur.execute("""
+        with db_cursor() as cur:
+            # One statement per page instead of one round-trip per row;
+            # RETURNING counts only rows not skipped by ON CONFLICT
+            inserted = psycopg2.extras.execute_values(cur, """
                 INSERT INTO training_sessions (user_id, session_date, session_data)
-                VALUES (%s, %s, %s)
+                VALUES %s
                 ON CONFLICT DO NOTHING
-            """, (user_id, session.get("session_date"), psycopg2.extras.Json(session)))
-            count += cur.rowcount
+                RETURNING 1
+            """, [(user_id, session.get("session_date"), psycopg2.extras.Json(session)) for session in sessions],
+                page_size=IMPORT_PAGE_SIZE, fetch=True)
+            count = len(inserted)
         
-        conn.commit()
         return count
         
     except Exception as e:
         logger.error(f"Error importing sessions: {e}")
-        conn.rollback()
         return count
-    finally:
-        cur.close()
-        conn.close()
 
 
-async def _import_goals(user_id: str, goals: List[Dict[str, Any]]) -> int:
+def _import_goals(user_id: str, goals: List[Dict[str, Any]]) -> int:
     """Import goals"""
-    conn = get_db_connection()
-    cur = conn.cursor()
     count = 0
-    
     try:
-        for goal in goals:
-            cur.execute("""
+        with db_cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
                 INSERT INTO goals (user_id, goal_data)
-                VALUES (%s, %s)
-            """, (user_id, psycopg2.extras.Json(goal)))
-            count += cur.rowcount
+                VALUES %s
+            """, [(user_id, psycopg2.extras.Json(goal)) for goal in goals],
+                page_size=IMPORT_PAGE_SIZE)
+            count = len(goals)
         
-        conn.commit()
         return count
         
     except Exception as e:
         logger.error(f"Error importing goals: {e}")
-        conn.rollback()
         return count
-    finally:
-        cur.close()
-        conn.close()
 
 
-async def _import_equipment(user_id: str, equipment: List[Dict[str, Any]]) -> int:
+def _import_equipment(user_id: str, equipment: List[Dict[str, Any]]) -> int:
     """Import equipment data"""
-    conn = get_db_connection()
-    cur = conn.cursor()
     count = 0
-    
     try:
-        for eq in equipment:
-            cur.execute("""
+        with db_cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
                 INSERT INTO equipment (user_id, equipment_data)
-                VALUES (%s, %s)
-            """, (user_id, psycopg2.extras.Json(eq)))
-            count += cur.rowcount
+                VALUES %s
+            """, [(user_id, psycopg2.extras.Json(eq)) for eq in equipment],
+                page_size=IMPORT_PAGE_SIZE)
+            count = len(equipment)
         
-        conn.commit()
         return count
         
     except Exception as e:
         logger.error(f"Error importing equipment: {e}")
-        conn.rollback()
         return count
-    finally:
-        cur.close()
-        conn.close()
 
 # =============================================================================
 # DATA DELETION (RIGHT TO BE FORGOTTEN)
@@ -496,96 +794,217 @@ async def delete_user_data(user_id: str, verification_code: str) -> Dict[str, An
     GDPR Article 17: Right to erasure (right to be forgotten)
     Requires verification code for safety
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
+    # psycopg2 is blocking; keep it off the event loop
+    return await asyncio.to_thread(_sync_delete_user_data, user_id, verification_code)
+
+
+# Tables wiped by delete_user_data, in the order deleted_counts reports them
+_USER_DATA_TABLES = (
+    "training_sessions",
+    "goals",
+    "conversations",
+    "race_results",
+    "races",
+    "athlete_connections",
+    "messages",
+    "training_group_members",
+    "leaderboard_entries",
+    "activity_feed",
+    "activity_comments",
+    "activity_reactions",
+    "notifications",
+    "equipment",
+    "achievements",
+    "users",
+)
+
+# Tables that reference a user by something other than user_id; every listed
+# column present is matched (the migration and social_features schemas differ)
+_USER_DATA_COLUMNS = {
+    "athlete_connections": ("follower_id", "following_id", "follower_user_id", "following_user_id"),
+    "messages": ("sender_id", "recipient_id", "sender_user_id", "recipient_user_id"),
+}
+
+_USER_DATA_TABLES_QUERY = """
+    SELECT table_name, column_name FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = ANY(%s)
+    AND column_name = ANY(%s)
+"""
+
+_present_user_data_tables: Optional[tuple] = None
+
+
+def _get_user_data_tables(cur) -> tuple:
+    """
+    (table, user columns) for each table of _USER_DATA_TABLES that exists
     
-    try:
-        # Verify the deletion request
-        cur.execute("""
-            SELECT * FROM deletion_requests
-            WHERE user_id = %s AND verification_code = %s
+    A single CTE fails outright if any one table is missing, so the statement
+    is built only over tables that are there. The lookup is cached only once
+    every table is found; while any is missing it is repeated on each call so
+    a later migration is picked up without a restart.
+    """
+    global _present_user_data_tables
+    if _present_user_data_tables is not None:
+        return _present_user_data_tables
+    
+    candidates = {column for columns in _USER_DATA_COLUMNS.values() for column in columns}
+    candidates.add("user_id")
+    cur.execute(_USER_DATA_TABLES_QUERY, (list(_USER_DATA_TABLES), list(candidates)))
+    found: Dict[str, set] = {}
+    for table, column in cur.fetchall():
+        found.setdefault(table, set()).add(column)
+    
+    tables = []
+    missing = []
+    for table in _USER_DATA_TABLES:
+        columns = tuple(
+            column for column in _USER_DATA_COLUMNS.get(table, ("user_id",))
+            if column in found.get(table, ())
+        )
+        if columns:
+            tables.append((table, columns))
+        else:
+            missing.append(table)
+    
+    if missing:
+        logger.error(f"User data tables missing or without a user column, not deleted: {', '.join(missing)}")
+        return tuple(tables)
+    _present_user_data_tables = tuple(tables)
+    return _present_user_data_tables
+
+
+def _user_match(table: str, columns: tuple, value: str) -> str:
+    """WHERE clause matching a user on any of the table's user columns"""
+    return " OR ".join(f"{table}.{column} = {value}" for column in columns)
+
+
+@functools.lru_cache(maxsize=4)
+def _delete_user_data_query(tables: tuple) -> str:
+    """
+    One statement instead of a verify + per-table DELETE + UPDATE round-trip chain
+    
+    The deletion request is claimed atomically by UPDATE ... RETURNING (a second
+    caller blocks on the row lock, then sees status <> 'pending'), and every
+    DELETE is gated on that claim, so an invalid, expired or already-used code
+    deletes nothing.
+    """
+    return (
+        """
+        WITH verified AS (
+            UPDATE deletion_requests
+            SET status = 'completed', completed_at = NOW()
+            WHERE user_id = %(user_id)s AND verification_code = %(code)s
             AND created_at > NOW() - INTERVAL '24 hours'
             AND status = 'pending'
-        """, (user_id, verification_code))
+            RETURNING request_id
+        )
+        """
+        + "".join(
+            f",\nd{i} AS (DELETE FROM {table} WHERE ({_user_match(table, columns, '%(user_id)s')}) "
+            f"AND EXISTS (SELECT 1 FROM verified) RETURNING 1)"
+            for i, (table, columns) in enumerate(tables)
+        )
+        + "\nSELECT (SELECT min(request_id) FROM verified)"
+        + "".join(f", (SELECT count(*) FROM d{i})" for i in range(len(tables)))
+    )
+
+
+def _sync_delete_user_data(user_id: str, verification_code: str) -> Dict[str, Any]:
+    """Blocking body of delete_user_data"""
+    try:
+        with db_cursor() as cur:
+            tables = _get_user_data_tables(cur)
+            cur.execute(_delete_user_data_query(tables), {"user_id": user_id, "code": verification_code})
+            request_id, *counts = cur.fetchone()
         
-        if not cur.fetchone():
+        if request_id is None:
             return {
                 "success": False,
                 "error": "Invalid or expired verification code"
             }
         
-        # Delete from all tables
-        tables = [
-            "training_sessions",
-            "goals",
-            "conversations",
-            "race_results",
-            "races",
-            "athlete_connections",
-            "messages",
-            "training_group_members",
-            "leaderboard_entries",
-            "activity_feed",
-            "activity_comments",
-            "activity_reactions",
-            "notifications",
-            "equipment",
-            "achievements",
-            "users"
-        ]
-        
-        deleted_counts = {}
-        for table in tables:
-            try:
-                cur.execute(f"DELETE FROM {table} WHERE user_id = %s", (user_id,))
-                deleted_counts[table] = cur.rowcount
-            except Exception as e:
-                logger.warning(f"Could not delete from {table}: {e}")
-        
-        # Mark deletion request as completed
-        cur.execute("""
-            UPDATE deletion_requests
-            SET status = 'completed', completed_at = NOW()
-            WHERE user_id = %s AND verification_code = %s
-        """, (user_id, verification_code))
-        
-        conn.commit()
+        deleted_counts = dict(zip((table for table, _ in tables), counts))
         
-        logger.info(f"User data deleted for {user_id}")
+        logger.info(f"User data deleted for {user_id} (deletion request {request_id})")
         return {
             "success": True,
             "deleted_counts": deleted_counts,
             "message": "All user data has been permanently deleted"
         }
         
-    except Exception as e:
-        logger.error(f"Error deleting user data: {e}")
-        conn.rollback()
-        return {"success": False, "error": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+    except Exception:
+        logger.exception("Error deleting user data")
+        return INTERNAL_ERROR
 
 
-async def request_data_deletion(user_id: str, email: str) -> Dict[str, Any]:
-    """
-    Request data deletion (sends verification email)
+@functools.lru_cache(maxsize=4)
+def _bulk_delete_user_data_query(tables: tuple) -> str:
+    return (
+        "WITH ids AS (SELECT unnest(%(user_ids)s::text[]) AS uid)"
+        + "".join(
+            f",\nd{i} AS (DELETE FROM {table} USING ids WHERE {_user_match(table, columns, 'ids.uid')} RETURNING 1)"
+            for i, (table, columns) in enumerate(tables)
+        )
+        + "\nSELECT "
+        + ", ".join(f"(SELECT count(*) FROM d{i})" for i in range(len(tables)))
+    )
+
+
+def hard_delete_user_data_bulk(user_ids: Optional[List[str]] = None) -> Dict[str, Any]:
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
+    Hard-delete data for many users in one statement, skipping verification
+    
+    Meant for admin jobs and test-database resets, not user-facing erasure
+    (use delete_user_data for that).
     
+    Args:
+        user_ids: Users to wipe. None truncates every user data table, which
+            avoids per-row WAL and is only safe on per-user or test databases.
+    
+    Returns:
+        Deleted row counts per table (omitted when truncating)
+    """
     try:
-        # Generate verification code
-        import secrets
-        verification_code = secrets.token_urlsafe(32)
+        with db_cursor() as cur:
+            tables = _get_user_data_tables(cur)
+            if user_ids is None:
+                names = [table for table, _ in tables]
+                cur.execute(f"TRUNCATE {', '.join(names)} RESTART IDENTITY CASCADE")
+                logger.info("User data tables truncated")
+                return {"success": True, "truncated": names}
+            
+            cur.execute(_bulk_delete_user_data_query(tables), {"user_ids": list(user_ids)})
+            counts = cur.fetchone()
         
-        # Store deletion request
-        cur.execute("""
-            INSERT INTO deletion_requests (user_id, verification_code, status)
-            VALUES (%s, %s, 'pending')
-        """, (user_id, verification_code))
+        logger.info(f"User data deleted for {len(user_ids)} users")
+        return {"success": True, "deleted_counts": dict(zip((table for table, _ in tables), counts))}
         
-        conn.commit()
+    except Exception:
+        logger.exception("Error bulk deleting user data")
+        return INTERNAL_ERROR
+
+
+async def request_data_deletion(user_id: str, email: str) -> Dict[str, Any]:
+    """
+    Request data deletion (sends verification email)
+    """
+    # psycopg2 is blocking; keep it off the event loop
+    return await asyncio.to_thread(_sync_request_data_deletion, user_id, email)
+
+
+def _sync_request_data_deletion(user_id: str, email: str) -> Dict[str, Any]:
+    """Blocking body of request_data_deletion"""
+    try:
+        with db_cursor() as cur:
+            # Generate verification code
+            import secrets
+            verification_code = secrets.token_urlsafe(32)
+            
+            # Store deletion request
+            cur.execute("""
+                INSERT INTO deletion_requests (user_id, verification_code, status)
+                VALUES (%s, %s, 'pending')
+            """, (user_id, verification_code))
         
         # Send verification email (would use notification service in production)
         logger.info(f"Deletion request created for {user_id}")
@@ -596,40 +1015,101 @@ async def request_data_deletion(user_id: str, email: str) -> Dict[str, Any]:
             "message": "Deletion request created. Use verification code to confirm."
         }
         
-    except Exception as e:
-        logger.error(f"Error creating deletion request: {e}")
-        conn.rollback()
-        return {"success": False, "error": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+    except Exception:
+        logger.exception("Error creating deletion request")
+        return INTERNAL_ERROR
 
 # =============================================================================
 # DATA ACCESS LOGS (GDPR COMPLIANCE)
 # =============================================================================
 
+# Access-log rows are queued and written by a background thread in batches,
+# so callers on the read path don't pay a connection + commit per access
+ACCESS_LOG_BATCH_SIZE = int(os.getenv("ACCESS_LOG_BATCH_SIZE", "500"))
+ACCESS_LOG_FLUSH_MS = int(os.getenv("ACCESS_LOG_FLUSH_MS", "100"))
+
+_access_log_queue: "queue.Queue[tuple]" = queue.Queue()
+_access_log_thread: Optional[threading.Thread] = None
+_access_log_thread_lock = threading.Lock()
+
+
 def log_data_access(user_id: str, accessed_by: str, purpose: str, data_categories: List[str]):
     """
     Log data access for audit trail
     GDPR requires maintaining records of data processing activities
-    """
-    conn = get_db_connection()
-    cur = conn.cursor()
     
+    The row is queued and written by the access-log flusher within
+    ACCESS_LOG_FLUSH_MS; access_time is taken here, not at flush time.
+    """
+    _ensure_access_log_flusher()
+    _access_log_queue.put(
+        (user_id, accessed_by, purpose, psycopg2.extras.Json(data_categories), datetime.now())
+    )
+
+
+def flush_data_access_logs():
+    """Write out every queued access-log row now (used at shutdown)"""
+    batch = []
+    while True:
+        try:
+            batch.append(_access_log_queue.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        _write_access_logs(batch)
+
+
+def _ensure_access_log_flusher():
+    global _access_log_thread
+    if _access_log_thread is not None:
+        return
+    with _access_log_thread_lock:
+        if _access_log_thread is None:
+            _access_log_thread = threading.Thread(
+                target=_access_log_flusher, name="access-log-flusher", daemon=True
+            )
+            _access_log_thread.start()
+            atexit.register(flush_data_access_logs)
+
+
+def _access_log_flusher():
+    flush_interval = ACCESS_LOG_FLUSH_MS / 1000
+    while True:
+        # Block for the first row, then gather more until the batch fills or
+        # the flush window closes
+        batch = [_access_log_queue.get()]
+        deadline = time.monotonic() + flush_interval
+        while len(batch) < ACCESS_LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_access_log_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _write_access_logs(batch)
+
+
+def _reset_access_log_after_fork():
+    # Queued rows belong to the parent; the child starts its own flusher
+    global _access_log_queue, _access_log_thread, _access_log_thread_lock
+    _access_log_queue = queue.Queue()
+    _access_log_thread = None
+    _access_log_thread_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_access_log_after_fork)
+
+
+def _write_access_logs(batch: List[tuple]):
     try:
-        cur.execute("""
-            INSERT INTO data_access_logs (user_id, accessed_by, purpose, data_categories, access_time)
-            VALUES (%s, %s, %s, %s, NOW())
-        """, (user_id, accessed_by, purpose, psycopg2.extras.Json(data_categories)))
-        
-        conn.commit()
-        
+        with db_cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO data_access_logs (user_id, accessed_by, purpose, data_categories, access_time)
+                VALUES %s
+            """, batch, page_size=ACCESS_LOG_BATCH_SIZE)
     except Exception as e:
-        logger.error(f"Error logging data access: {e}")
-        conn.rollback()
-    finally:
-        cur.close()
-        conn.close()
+        logger.error(f"Error logging data access ({len(batch)} rows dropped): {e}")
 
 
 def get_data_access_logs(user_id: str) -> List[Dict[str, Any]]:
@@ -637,25 +1117,20 @@ def get_data_access_logs(user_id: str) -> List[Dict[str, Any]]:
     Get data access logs for user
     GDPR Article 15: Right of access
     """
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            SELECT * FROM data_access_logs
-            WHERE user_id = %s
-            ORDER BY access_time DESC
-        """, (user_id,))
-        
-        logs = cur.fetchall()
-        return [dict(log) for log in logs]
-        
+        with db_cursor() as cur:
+            cur.execute("""
+                SELECT * FROM data_access_logs
+                WHERE user_id = %s
+                ORDER BY access_time DESC
+            """, (user_id,))
+            
+            columns = [col[0] for col in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+            
     except Exception as e:
         logger.error(f"Error fetching access logs: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 # =============================================================================
 # CREATE GDPR TABLES
@@ -663,43 +1138,41 @@ def get_data_access_logs(user_id: str) -> List[Dict[str, Any]]:
 
 def create_gdpr_tables():
     """Create tables for GDPR compliance"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     try:
-        # Deletion requests table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS deletion_requests (
-                request_id SERIAL PRIMARY KEY,
-                user_id VARCHAR(255) NOT NULL,
-                verification_code VARCHAR(255) NOT NULL,
-                status VARCHAR(50) DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP
-            )
-        """)
-        
-        # Data access logs table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS data_access_logs (
-                log_id SERIAL PRIMARY KEY,
-                user_id VARCHAR(255) NOT NULL,
-                accessed_by VARCHAR(255) NOT NULL,
-                purpose TEXT,
-                data_categories JSONB,
-                access_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        with db_cursor() as cur:
+            # Deletion requests table
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS deletion_requests (
+                    request_id SERIAL PRIMARY KEY,
+                    user_id VARCHAR(255) NOT NULL,
+                    verification_code VARCHAR(255) NOT NULL,
+                    status VARCHAR(50) DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    completed_at TIMESTAMP
+                )
+            """)
+            
+            # Data access logs table
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS data_access_logs (
+                    log_id SERIAL PRIMARY KEY,
+                    user_id VARCHAR(255) NOT NULL,
+                    accessed_by VARCHAR(255) NOT NULL,
+                    purpose TEXT,
+                    data_categories JSONB,
+                    access_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_access_logs_user_time
+                ON data_access_logs (user_id, access_time DESC)
+            """)
         
-        conn.commit()
         logger.info("GDPR compliance tables created successfully")
         
     except Exception as e:
         logger.error(f"Error creating GDPR tables: {e}")
-        conn.rollback()
-    finally:
-        cur.close()
-        conn.close()
 
 
 # Initialize tables
@@ -5,14 +5,23 @@ Connects to TrackLit's Azure PostgreSQL Flexible Server
 """
 
 import os
+import re
+import asyncio
 import logging
-from typing import Optional, Dict, Any, List
+import hashlib
+import atexit
+import functools
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Union, Iterator
 from contextlib import contextmanager
 import psycopg2
 from psycopg2 import pool, extras
-from psycopg2.extensions import connection as Connection
-import json
-from src.keyvault_helper import get_env_with_keyvault_resolution
+from psycopg2.extensions import connection as Connection, register_adapter, TRANSACTION_STATUS_IDLE
+from src.keyvault_helper import get_env_with_keyvault_resolution, clear_keyvault_cache
 
 logger = logging.getLogger(__name__)
 
@@ -25,23 +34,144 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_SSL_MODE = os.getenv("DB_SSL_MODE", "require")
 
-# Pool configuration
+# Optional read replica for lag-tolerant reads (may be a Key Vault reference)
+DB_REPLICA_URL = os.getenv("DB_REPLICA_URL")
+
+# Pool configuration. The cap is per process: keep
+# processes * DB_MAX_CONNECTIONS under ~80% of the server's max_connections.
 DB_MIN_CONNECTIONS = int(os.getenv("DB_MIN_CONNECTIONS", "2"))
 DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
 
+# Seconds to wait for a free pooled connection before giving up
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+
+# TCP keepalive / user timeout for pooled connections. Azure's load balancer
+# silently drops flows idle for ~4 minutes; probing every 30s keeps them
+# open, and a dead peer is detected in ~15s instead of minutes.
+DB_KEEPALIVES_IDLE = int(os.getenv("DB_KEEPALIVES_IDLE", "30"))
+DB_TCP_USER_TIMEOUT_MS = int(os.getenv("DB_TCP_USER_TIMEOUT_MS", "15000"))
+
+# Pooled connections are closed instead of reused once they are this old
+# (seconds) or have been checked out this many times, bounding per-backend
+# memory (plan caches, catalog caches) on the server
+DB_MAX_CONN_LIFETIME = int(os.getenv("DB_MAX_CONN_LIFETIME", "3600"))
+DB_MAX_CONN_USES = int(os.getenv("DB_MAX_CONN_USES", "1000"))
+
+# A health check within this many seconds of a successful one skips the DB
+DB_HEALTH_CACHE_SECONDS = float(os.getenv("DB_HEALTH_CACHE_SECONDS", "5"))
+
+# Failure result for service functions: a stable code instead of str(e), which
+# can carry SQL text and parameters. The exception itself goes to the log.
+# Shared singleton - callers must not mutate it.
+INTERNAL_ERROR = {"success": False, "error": "internal_error"}
+
+# dict parameters go to JSON/JSONB columns as JSON. Lists keep psycopg2's
+# native ARRAY adaptation (tags TEXT[], IN/ANY lists), so JSON list values
+# still need an explicit extras.Json at the call site.
+register_adapter(dict, extras.Json)
+
+# Per-connection cap on statements auto-prepared by execute_cached
+STMT_CACHE_SIZE = int(os.getenv("DB_STMT_CACHE_SIZE", "500"))
+
+# Open the pool on first use instead of at import (e.g. under a pre-forking server)
+ARIA_LAZY_POOL = os.getenv("ARIA_LAZY_POOL") == "1"
+
+# Pools inherited across fork(). Their sockets belong to the parent, so the
+# child must never close them (that would end the parent's sessions) and
+# keeps them referenced here so garbage collection doesn't either.
+_inherited_pools: List[Any] = []
+
+class PreparingConnection(Connection):
+    """psycopg2 connection that remembers which statements it has PREPAREd, and its age and checkout count"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.born = time.monotonic()
+        self.uses = 0
+        # SQL text -> prepared statement name, least recently used first
+        self.stmt_cache: "OrderedDict[str, str]" = OrderedDict()
+        # Statement names whose plan went stale mid-transaction; DEALLOCATEd
+        # before they are next PREPAREd
+        self.stale_statements = set()
+
+class WarmConnectionPool(pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that keeps returned connections open
+    
+    Stock psycopg2 closes any connection handed back while `minconn` are
+    already idle, so every burst above minconn pays a fresh TCP + TLS + auth
+    handshake to Azure (and loses its prepared statements). This keeps up to
+    `maxconn` idle; reuse is already LIFO, so the warmest connection goes out
+    first.
+    """
+    
+    def _putconn(self, conn, key=None, close=False):
+        # Runs under the pool lock; minconn is only consulted here after __init__
+        minconn, self.minconn = self.minconn, self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+
+
+def _on_event_loop() -> bool:
+    """True when called from a thread that is running an asyncio event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
 class DatabasePool:
     """
     PostgreSQL connection pool for TrackLit database
     Provides thread-safe connection management
     """
     
-    def __init__(self):
+    def __init__(self, lazy: bool = False, readonly: bool = False):
         self.connection_pool = None
-        self._initialize_pool()
+        # Resolved once (Key Vault included) and reused by every pool rebuild;
+        # refresh_secrets() re-resolves
+        self._conn_params: Optional[Dict[str, Any]] = None
+        self._lazy = lazy
+        self._readonly = readonly
+        self._init_lock = threading.Lock()
+        # Server facts that can't change for the pool's lifetime
+        self._static_db_info: Dict[str, Any] = {}
+        self._last_healthy = 0.0
+        # Connections currently checked out, instead of reading psycopg2's
+        # private _pool/_used
+        self._in_use = 0
+        self._in_use_lock = threading.Lock()
+        if not lazy:
+            self._initialize_pool()
     
     def _get_connection_params(self) -> Dict[str, Any]:
         """Build connection parameters from environment"""
+        params = self._get_server_params()
+        params.update(
+            keepalives=1,
+            keepalives_idle=DB_KEEPALIVES_IDLE,
+            keepalives_interval=10,
+            keepalives_count=5,
+            tcp_user_timeout=DB_TCP_USER_TIMEOUT_MS,
+            # Shows up in pg_stat_activity
+            application_name="aria-api"
+        )
+        if self._readonly:
+            # Belt and braces: the replica rejects writes anyway
+            params["options"] = "-c default_transaction_read_only=on"
+        return params
+    
+    def _get_server_params(self) -> Dict[str, Any]:
         # Resolve Key Vault references at runtime, not at module load
+        if self._readonly:
+            replica_url = get_env_with_keyvault_resolution("DB_REPLICA_URL")
+            if replica_url and not replica_url.startswith("@Microsoft.KeyVault("):
+                return {"dsn": replica_url}
+            logger.warning("DB_REPLICA_URL could not be resolved. Read-only pool will use the primary.")
+        
         database_url = get_env_with_keyvault_resolution("DATABASE_URL")
         if database_url and database_url.startswith("@Microsoft.KeyVault("):
             logger.warning("DATABASE_URL contains unresolved Key Vault reference. Falling back to individual params.")
@@ -70,19 +200,25 @@ class DatabasePool:
     def _initialize_pool(self):
         """Initialize the connection pool"""
         try:
-            conn_params = self._get_connection_params()
+            if self._conn_params is None:
+                self._conn_params = self._get_connection_params()
+            conn_params = self._conn_params
             
-            self.connection_pool = pool.ThreadedConnectionPool(
+            self.connection_pool = WarmConnectionPool(
                 minconn=DB_MIN_CONNECTIONS,
                 maxconn=DB_MAX_CONNECTIONS,
+                connection_factory=PreparingConnection,
                 **conn_params
             )
             
+            # cores * 2 + 1: more connections than this just queue inside Postgres
+            recommended = min(DB_MAX_CONNECTIONS, (os.cpu_count() or 1) * 2 + 1)
             logger.info(
                 "Database connection pool initialized",
                 extra={
                     "min_connections": DB_MIN_CONNECTIONS,
                     "max_connections": DB_MAX_CONNECTIONS,
+                    "recommended_max_connections": recommended,
                     "database": DB_NAME
                 }
             )
@@ -99,10 +235,17 @@ class DatabasePool:
         """Test database connectivity"""
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
+            cursor = conn.cursor(cursor_factory=extras.RealDictCursor)
+            cursor.execute("""
+                SELECT 
+                    version() as version,
+                    current_database() as database,
+                    current_user as user
+            """)
+            self._static_db_info = dict(cursor.fetchone())
             cursor.close()
             self.return_connection(conn)
+            self._last_healthy = time.monotonic()
             logger.info("Database connection test successful")
         except Exception as e:
             logger.error(f"Database connection test failed: {e}")
@@ -117,14 +260,43 @@ class DatabasePool:
         Returns:
             PostgreSQL connection object
         """
+        if not self.connection_pool and self._lazy:
+            with self._init_lock:
+                if not self.connection_pool:
+                    self._initialize_pool()
+        
         if not self.connection_pool:
             raise Exception("Database connection pool not initialized")
         
-        try:
-            return self.connection_pool.getconn()
-        except Exception as e:
-            logger.error(f"Failed to get database connection: {e}")
-            raise
+        # getconn() fails at once when every connection is checked out, so
+        # poll with backoff until one is returned or DB_ACQUIRE_TIMEOUT passes.
+        # Sleeping on the event loop thread would stall every other request,
+        # so callers there fail fast instead (run them with asyncio.to_thread).
+        timeout = 0 if _on_event_loop() else DB_ACQUIRE_TIMEOUT
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while True:
+            try:
+                conn = self.connection_pool.getconn()
+                conn.uses = getattr(conn, "uses", 0) + 1
+                with self._in_use_lock:
+                    self._in_use += 1
+                return conn
+            except pool.PoolError as e:
+                remaining = deadline - time.monotonic()
+                if "exhausted" not in str(e) or remaining <= 0:
+                    logger.error(f"Failed to get database connection: {e}")
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"No database connection available within {timeout}s"
+                            + (" (acquired on the event loop; use asyncio.to_thread)" if not timeout else "")
+                        ) from e
+                    raise
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.25)
+            except Exception as e:
+                logger.error(f"Failed to get database connection: {e}")
+                raise
     
     def return_connection(self, connection: Connection):
         """
@@ -137,10 +309,22 @@ class DatabasePool:
             logger.warning("Cannot return connection: pool not initialized")
             return
         
+        # Retire worn-out connections; the pool opens a fresh one on demand
+        retire = (
+            getattr(connection, "uses", 0) >= DB_MAX_CONN_USES
+            or time.monotonic() - getattr(connection, "born", time.monotonic()) >= DB_MAX_CONN_LIFETIME
+        )
+        
         try:
-            self.connection_pool.putconn(connection)
+            self.connection_pool.putconn(connection, close=retire)
+        except pool.PoolError:
+            # Borrowed from a pool since replaced by refresh_secrets()
+            connection.close()
         except Exception as e:
             logger.error(f"Failed to return database connection: {e}")
+        finally:
+            with self._in_use_lock:
+                self._in_use = max(self._in_use - 1, 0)
     
     def close_all_connections(self):
         """Close all connections in the pool"""
@@ -148,6 +332,68 @@ class DatabasePool:
             self.connection_pool.closeall()
             logger.info("All database connections closed")
     
+    def reinitialize(self):
+        """
+        Replace the pool with a fresh one, e.g. in a worker after fork()
+        
+        The old pool's connections are abandoned rather than closed, since
+        after a fork they share sockets with the parent process.
+        """
+        self._abandon_pool()
+        self._initialize_pool()
+    
+    def refresh_secrets(self):
+        """
+        Re-resolve connection settings, e.g. after a Key Vault rotation,
+        and swap in a pool built with them
+        
+        Idle connections of the old pool close when it is dropped; ones
+        checked out are closed as they are returned.
+        """
+        clear_keyvault_cache()
+        old_params, old_pool = self._conn_params, self.connection_pool
+        with self._init_lock:
+            try:
+                self._conn_params = self._get_connection_params()
+                self._initialize_pool()
+            except Exception:
+                # Keep serving on the old settings
+                self._conn_params, self.connection_pool = old_params, old_pool
+                raise
+    
+    def _abandon_pool(self):
+        if self.connection_pool is not None:
+            _inherited_pools.append(self.connection_pool)
+        self.connection_pool = None
+        self._init_lock = threading.Lock()
+        self._in_use = 0
+        self._in_use_lock = threading.Lock()
+        self._last_healthy = 0.0
+    
+    def _after_fork_in_child(self):
+        # Connecting inside a fork hook can't report failures, so the child
+        # opens its own pool on first use instead
+        self._abandon_pool()
+        self._lazy = True
+    
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that borrows a pooled connection
+        
+        Usage:
+            with db_pool.connection() as conn:
+                cur = conn.cursor()
+        
+        The connection is always handed back to the pool (never closed),
+        with any open transaction rolled back by the pool.
+        """
+        conn = self.get_connection()
+        try:
+            yield conn
+        finally:
+            self.return_connection(conn)
+    
     @contextmanager
     def get_cursor(self, commit: bool = False):
         """
@@ -187,9 +433,45 @@ class DatabasePool:
             List of dictionaries (rows)
         """
         with self.get_cursor() as cursor:
+            execute_cached(cursor, query, params)
+            # RealDictRow is already a dict subclass; no per-row copy needed
+            return cursor.fetchall()
+    
+    def execute_stream(self, query: str, params: tuple = None, itersize: int = 2000) -> Iterator[Dict]:
+        """
+        Execute a SELECT query and yield rows as Postgres produces them
+        
+        Uses a server-side (named) cursor, so at most `itersize` rows are held
+        in memory at once. The pooled connection stays checked out until the
+        generator is exhausted or closed. Prefer execute_query for small
+        result sets.
+        
+        Args:
+            query: SQL query string
+            params: Query parameters (optional)
+            itersize: Rows fetched per round trip
+            
+        Yields:
+            Dictionaries (rows)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor(name=f"aria_{uuid.uuid4().hex}", cursor_factory=extras.RealDictCursor)
+        cursor.itersize = itersize
+        
+        try:
             cursor.execute(query, params)
-            results = cursor.fetchall()
-            return [dict(row) for row in results]
+            yield from cursor
+        except Exception as e:
+            logger.error(f"Database operation failed: {e}")
+            raise
+        finally:
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                pass
+            # Ends the read transaction the named cursor lived in
+            conn.rollback()
+            self.return_connection(conn)
     
     def execute_one(self, query: str, params: tuple = None) -> Optional[Dict]:
         """
@@ -203,9 +485,28 @@ class DatabasePool:
             Dictionary (single row) or None
         """
         with self.get_cursor() as cursor:
-            cursor.execute(query, params)
-            result = cursor.fetchone()
-            return dict(result) if result else None
+            execute_cached(cursor, query, params)
+            return cursor.fetchone()
+    
+    def execute_scalar(self, query: str, params: tuple = None) -> Any:
+        """
+        Execute a SELECT query and return the first column of the first row
+        
+        Uses a plain tuple cursor, since a dict per row is wasted on counts
+        and probes.
+        
+        Args:
+            query: SQL query string
+            params: Query parameters (optional)
+            
+        Returns:
+            The value, or None if no row was returned
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                execute_cached(cursor, query, params)
+                row = cursor.fetchone()
+                return row[0] if row else None
     
     def execute_write(self, query: str, params: tuple = None) -> int:
         """
@@ -219,7 +520,7 @@ class DatabasePool:
             Number of affected rows
         """
         with self.get_cursor(commit=True) as cursor:
-            cursor.execute(query, params)
+            execute_cached(cursor, query, params)
             return cursor.rowcount
     
     def execute_insert_returning(self, query: str, params: tuple = None) -> Optional[Dict]:
@@ -234,9 +535,47 @@ class DatabasePool:
             Dictionary with returned columns
         """
         with self.get_cursor(commit=True) as cursor:
-            cursor.execute(query, params)
-            result = cursor.fetchone()
-            return dict(result) if result else None
+            execute_cached(cursor, query, params)
+            return cursor.fetchone()
+    
+    def bulk_insert(
+        self,
+        table: str,
+        cols: Tuple[str, ...],
+        rows: List[tuple],
+        on_conflict: Optional[str] = None,
+        returning: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Insert many rows in as few statements as possible (execute_values)
+        
+        `table`, `cols`, `on_conflict` and `returning` are interpolated into
+        the SQL as-is, so they must be constants, never user input.
+        
+        Args:
+            table: Table name
+            cols: Column names, in the order of each row tuple
+            rows: Row tuples to insert
+            on_conflict: Optional "ON CONFLICT ..." clause
+            returning: Optional RETURNING column list
+            
+        Returns:
+            Returned rows if `returning` was given, otherwise an empty list
+        """
+        if not rows:
+            return []
+        
+        query = f"INSERT INTO {table} ({', '.join(cols)}) VALUES %s"
+        if on_conflict:
+            query += f" {on_conflict}"
+        if returning:
+            query += f" RETURNING {returning}"
+        
+        with self.get_cursor(commit=True) as cursor:
+            result = extras.execute_values(
+                cursor, query, rows, page_size=1000, fetch=bool(returning)
+            )
+        return result or []
     
     def health_check(self) -> Dict[str, Any]:
         """
@@ -246,33 +585,26 @@ class DatabasePool:
             Dictionary with health status
         """
         try:
-            with self.get_cursor() as cursor:
-                # Check connection
-                cursor.execute("SELECT 1 as ok")
-                result = cursor.fetchone()
-                
-                # Get database info
-                cursor.execute("""
-                    SELECT 
-                        version() as version,
-                        current_database() as database,
-                        current_user as user
-                """)
-                db_info = cursor.fetchone()
-                
-                # Get connection pool stats
-                pool_info = {
-                    "available": len(self.connection_pool._pool) if self.connection_pool else 0,
-                    "min_connections": DB_MIN_CONNECTIONS,
-                    "max_connections": DB_MAX_CONNECTIONS
-                }
-                
-                return {
-                    "status": "healthy",
-                    "connected": True,
-                    "database": dict(db_info) if db_info else {},
-                    "pool": pool_info
-                }
+            # Frequent probes reuse a recent success instead of taking a
+            # connection each time
+            if time.monotonic() - self._last_healthy >= DB_HEALTH_CACHE_SECONDS:
+                self.execute_scalar("SELECT 1")
+                self._last_healthy = time.monotonic()
+            
+            # Get connection pool stats
+            pool_info = {
+                "in_use": self._in_use,
+                "available": DB_MAX_CONNECTIONS - self._in_use if self.connection_pool else 0,
+                "min_connections": DB_MIN_CONNECTIONS,
+                "max_connections": DB_MAX_CONNECTIONS
+            }
+            
+            return {
+                "status": "healthy",
+                "connected": True,
+                "database": self._static_db_info,
+                "pool": pool_info
+            }
         
         except Exception as e:
             return {
@@ -282,7 +614,18 @@ class DatabasePool:
             }
 
 # Initialize global database pool
-db_pool = DatabasePool()
+db_pool = DatabasePool(lazy=ARIA_LAZY_POOL)
+atexit.register(db_pool.close_all_connections)
+
+# Reads that tolerate replica lag go here. Without a replica this is simply
+# db_pool. Anything read straight after a write (profiles, subscriptions,
+# usage counts) stays on the primary, or the TTL caches and quota checks
+# would pick up stale rows.
+if DB_REPLICA_URL:
+    db_pool_ro = DatabasePool(lazy=True, readonly=True)
+    atexit.register(db_pool_ro.close_all_connections)
+else:
+    db_pool_ro = db_pool
 
 # Legacy function for backwards compatibility
 def get_db_connection():
@@ -293,8 +636,229 @@ def get_db_connection():
     """
     return db_pool.get_connection()
 
+def db_connection():
+    """
+    Borrow a pooled connection for the duration of a with-block.
+    Preferred over get_db_connection(), whose callers must return it manually.
+    """
+    return db_pool.connection()
+
+@contextmanager
+def db_cursor(dict_cursor: bool = False):
+    """
+    Pooled cursor for a single unit of work
+    
+    Commits when the block exits cleanly, rolls back and re-raises on error,
+    and always hands the connection back to the pool.
+    
+    Usage:
+        with db_cursor(dict_cursor=True) as cur:
+            cur.execute("SELECT ...")
+    
+    Args:
+        dict_cursor: Return rows as dicts (RealDictCursor) instead of tuples
+    """
+    with db_pool.connection() as conn:
+        cur = conn.cursor(cursor_factory=extras.RealDictCursor) if dict_cursor else conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+_PLACEHOLDER_RE = re.compile(r"%\((\w+)\)s|%s|%%|'")
+_PREPARABLE_RE = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH|VALUES)\b", re.IGNORECASE)
+
+# SQL text -> ($n-numbered SQL, parameter order) or None when not preparable;
+# shared by all connections since it only depends on the text
+_converted_sql: Dict[str, Optional[Tuple[str, Union[int, Tuple[str, ...]]]]] = {}
+
+# PREPARE failures that will recur for the same SQL text: indeterminate or
+# ambiguous parameter types, datatype mismatch, syntax error
+_UNPREPARABLE_PGCODES = frozenset({"42P18", "42P08", "42804", "42601"})
+
+def _convert_placeholders(query: str) -> Optional[Tuple[str, Union[int, Tuple[str, ...]]]]:
+    """
+    Rewrite psycopg2 %s / %(name)s placeholders as $1, $2, ... for PREPARE
+    
+    Returns:
+        (converted SQL, positional count or ordered parameter names), or None
+        for statements PREPARE can't take: DDL, multiple statements, or
+        placeholders inside quoted literals such as INTERVAL '%s days'
+    """
+    if not _PREPARABLE_RE.match(query) or ";" in query.strip().rstrip(";"):
+        return None
+    
+    parts = []
+    names: List[str] = []
+    positional = 0
+    in_literal = False
+    last = 0
+    for match in _PLACEHOLDER_RE.finditer(query):
+        token = match.group(0)
+        if token == "'":
+            in_literal = not in_literal
+            continue
+        parts.append(query[last:match.start()])
+        last = match.end()
+        if token == "%%":
+            parts.append("%")
+        elif in_literal:
+            return None
+        elif token == "%s":
+            positional += 1
+            parts.append(f"${positional}")
+        else:
+            name = match.group(1)
+            if name not in names:
+                names.append(name)
+            parts.append(f"${names.index(name) + 1}")
+    parts.append(query[last:])
+    
+    if positional and names:
+        return None
+    return "".join(parts), tuple(names) if names else positional
+
+def execute_cached(cur, query: str, params: Union[tuple, list, dict, None] = None):
+    """
+    cursor.execute() that transparently prepares repeated statements
+    
+    Each pooled connection keeps an LRU of SQL text -> server-side prepared
+    statement, so fixed queries are parsed and planned once per connection
+    and then run with EXECUTE. Statements that can't be prepared (or that
+    fail to) run as plain execute().
+    
+    Args:
+        cur: Cursor on a pooled (PreparingConnection) connection
+        query: SQL with psycopg2 placeholders
+        params: Tuple/list for %s or dict for %(name)s
+    """
+    if query not in _converted_sql:
+        _converted_sql[query] = _convert_placeholders(query)
+    converted = _converted_sql[query]
+    cache = getattr(cur.connection, "stmt_cache", None)
+    if converted is None or cache is None:
+        cur.execute(query, params)
+        return
+    
+    sql, order = converted
+    if isinstance(order, tuple):
+        if not isinstance(params, dict):
+            cur.execute(query, params)
+            return
+        args = tuple(params[name] for name in order)
+    else:
+        args = tuple(params or ())
+        if len(args) != order:
+            cur.execute(query, params)
+            return
+    
+    conn = cur.connection
+    fresh = conn.info.transaction_status == TRANSACTION_STATUS_IDLE
+    name = cache.get(query)
+    if name is None:
+        name = "stmt_" + hashlib.blake2b(query.encode(), digest_size=8).hexdigest()
+        try:
+            # Savepoint so a PREPARE the server rejects (e.g. a parameter type
+            # it can't infer) doesn't abort the caller's transaction
+            prepare = f"SAVEPOINT aria_prepare; PREPARE {name} AS {sql}; RELEASE SAVEPOINT aria_prepare"
+            if name in conn.stale_statements:
+                # The stale plan is still on the server under this name
+                conn.stale_statements.discard(name)
+                prepare = f"DEALLOCATE {name}; {prepare}"
+            cur.execute(prepare)
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT aria_prepare; RELEASE SAVEPOINT aria_prepare")
+            # Only a rejection inherent to the SQL text rules it out for good;
+            # anything else (locks, a table not created yet) is retried next time
+            if e.pgcode in _UNPREPARABLE_PGCODES:
+                _converted_sql[query] = None
+            cur.execute(query, params)
+            return
+        cache[query] = name
+        if len(cache) > STMT_CACHE_SIZE:
+            _, evicted = cache.popitem(last=False)
+            cur.execute(f"DEALLOCATE {evicted}")
+    else:
+        cache.move_to_end(query)
+    
+    execute = f"EXECUTE {name} ({', '.join(['%s'] * len(args))})" if args else f"EXECUTE {name}"
+    try:
+        cur.execute(execute, args or None)
+    except psycopg2.errors.FeatureNotSupported:
+        # "cached plan must not change result type": the table changed since
+        # this connection PREPAREd the statement, so it is prepared again on
+        # next use. The failed EXECUTE aborted the transaction; when it was
+        # the first statement nothing is lost by rolling back and retrying
+        del cache[query]
+        conn.stale_statements.add(name)
+        if not fresh:
+            raise
+        conn.rollback()
+        execute_cached(cur, query, params)
+
 # Database utility functions for Aria specific operations
 
+# Hot-path lookups cached in-process; entries are dropped on the writes below
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "120"))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after `ttl` seconds
+    
+    Dict values are stored and handed out as shallow copies so callers
+    can't mutate the cached dict.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key) -> Optional[Any]:
+        key = str(key)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return dict(value) if isinstance(value, dict) else value
+    
+    def set(self, key, value: Any):
+        key = str(key)
+        if isinstance(value, dict):
+            value = dict(value)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(str(key), None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_subscription_cache = TTLCache(USER_CACHE_MAX_ENTRIES, SUBSCRIPTION_CACHE_TTL)
+_profile_cache = TTLCache(USER_CACHE_MAX_ENTRIES, PROFILE_CACHE_TTL)
+
+def forget_cached_subscription(user_id: str):
+    """Drop this process's cached subscription, e.g. after a write in another worker"""
+    _subscription_cache.pop(user_id)
+
 def get_athlete_profile(user_id: str) -> Optional[Dict]:
     """
     Get athlete profile from TrackLit database
@@ -305,6 +869,10 @@ def get_athlete_profile(user_id: str) -> Optional[Dict]:
     Returns:
         Athlete profile dictionary or None
     """
+    cached = _profile_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
     query = """
         SELECT 
             u.id,
@@ -326,7 +894,10 @@ def get_athlete_profile(user_id: str) -> Optional[Dict]:
         FROM users u
         WHERE u.id = %s
     """
-    return db_pool.execute_one(query, (user_id,))
+    result = db_pool.execute_one(query, (user_id,))
+    if result:
+        _profile_cache.set(user_id, result)
+    return result
 
 def get_user_subscription(user_id: str) -> Dict:
     """
@@ -338,6 +909,10 @@ def get_user_subscription(user_id: str) -> Dict:
     Returns:
         Subscription dictionary
     """
+    cached = _subscription_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
     query = """
         SELECT 
             user_id,
@@ -354,7 +929,7 @@ def get_user_subscription(user_id: str) -> Dict:
     
     if not result:
         # Return default free tier
-        return {
+        result = {
             "user_id": user_id,
             "tier": "free",
             "subscription_status": "active",
@@ -362,12 +937,54 @@ def get_user_subscription(user_id: str) -> Dict:
             "next_billing_date": None
         }
     
+    _subscription_cache.set(user_id, result)
     return result
 
+# Optional columns update_user_subscription may set, and the kwarg aliases
+# callers use for them
+_SUBSCRIPTION_UPDATABLE = frozenset({
+    "subscription_status", "billing_cycle_start", "next_billing_date",
+    "stripe_subscription_id", "stripe_customer_id"
+})
+_SUBSCRIPTION_ALIASES = {"status": "subscription_status"}
+
+@functools.lru_cache(maxsize=64)
+def _build_subscription_upsert_sql(cols: Tuple[str, ...]) -> str:
+    """INSERT ... ON CONFLICT (user_id) DO UPDATE for one set of optional columns"""
+    insert_cols = ", ".join(("user_id", "tier") + cols)
+    values = ", ".join(f"%({col})s" for col in ("user_id", "tier") + cols)
+    updates = "".join(f", {col} = EXCLUDED.{col}" for col in cols)
+    return f"""
+        INSERT INTO user_subscriptions ({insert_cols}, created_at, updated_at)
+        VALUES ({values}, NOW(), NOW())
+        ON CONFLICT (user_id) DO UPDATE
+        SET tier = EXCLUDED.tier, updated_at = NOW(){updates}
+        RETURNING user_id
+    """
+
+# Async variants for route handlers: cache hits are answered inline, misses
+# run the blocking psycopg2 query on a worker thread instead of the event loop
+
+async def aget_athlete_profile(user_id: str) -> Optional[Dict]:
+    """Async get_athlete_profile"""
+    cached = _profile_cache.get(user_id)
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(get_athlete_profile, user_id)
+
+async def aget_user_subscription(user_id: str) -> Dict:
+    """Async get_user_subscription"""
+    cached = _subscription_cache.get(user_id)
+    if cached is not None:
+        return cached
+    return await asyncio.to_thread(get_user_subscription, user_id)
+
 def update_user_subscription(user_id: str, tier: str, **kwargs) -> bool:
     """
     Update user subscription
     
+    Creates the row if the user has none, in the same statement.
+    
     Args:
         user_id: User ID
         tier: Subscription tier (free, pro, star)
@@ -376,74 +993,180 @@ def update_user_subscription(user_id: str, tier: str, **kwargs) -> bool:
     Returns:
         True if successful
     """
-    # Check if subscription exists
-    existing = db_pool.execute_one(
-        "SELECT user_id FROM user_subscriptions WHERE user_id = %s",
-        (user_id,)
-    )
+    kwargs = {_SUBSCRIPTION_ALIASES.get(key, key): value for key, value in kwargs.items()}
+    fields = _filter_updates(kwargs, _SUBSCRIPTION_UPDATABLE, 'user_id')
     
-    if existing:
-        # Update existing
-        set_clause = "tier = %s, updated_at = NOW()"
-        params = [tier]
-        
-        for key, value in kwargs.items():
-            set_clause += f", {key} = %s"
-            params.append(value)
-        
-        params.append(user_id)
-        query = f"UPDATE user_subscriptions SET {set_clause} WHERE user_id = %s"
-        
-        db_pool.execute_write(query, tuple(params))
-    else:
-        # Insert new
-        fields = ["user_id", "tier", "created_at", "updated_at"]
-        values = [user_id, tier, "NOW()", "NOW()"]
-        placeholders = ["%s", "%s", "NOW()", "NOW()"]
-        
-        for key, value in kwargs.items():
-            fields.append(key)
-            values.append(value)
-            placeholders.append("%s")
-        
-        query = f"""
-            INSERT INTO user_subscriptions ({', '.join(fields)})
-            VALUES ({', '.join(placeholders)})
-        """
-        
-        db_pool.execute_write(query, tuple([v for v in values if v != "NOW()"]))
+    query = _build_subscription_upsert_sql(tuple(sorted(fields)))
+    db_pool.execute_insert_returning(query, {**fields, 'user_id': user_id, 'tier': tier})
+    
+    _subscription_cache.pop(user_id)
     
     return True
 
+# Usage rows are buffered and written by a background thread in batches, so
+# the request path doesn't pay a subscription lookup + INSERT + commit per call
+QUERY_USAGE_BATCH_SIZE = int(os.getenv("QUERY_USAGE_BATCH_SIZE", "500"))
+QUERY_USAGE_FLUSH_MS = int(os.getenv("QUERY_USAGE_FLUSH_MS", "2000"))
+
+_usage_buffer: "deque[tuple]" = deque()
+# Held while a batch is drained and written, so flush_query_usage() returns
+# only once everything queued before it is committed
+_usage_write_lock = threading.Lock()
+# Guards _usage_buffer and _usage_inflight_users; only held for list
+# operations, never across a DB write
+_usage_pending_lock = threading.Lock()
+# Users with rows in the batch currently being written
+_usage_inflight_users: set = set()
+_usage_wakeup = threading.Event()
+_usage_thread: Optional[threading.Thread] = None
+_usage_thread_lock = threading.Lock()
+
+# subscription_tier is resolved in the INSERT itself rather than with a
+# get_user_subscription() round trip per call
+_INSERT_QUERY_USAGE_SQL = """
+    INSERT INTO query_usage (
+        user_id, 
+        endpoint, 
+        query_timestamp, 
+        tokens_consumed,
+        subscription_tier,
+        request_cost
+    )
+    SELECT v.user_id, v.endpoint, v.query_timestamp, v.tokens_consumed,
+           COALESCE(s.tier, 'free'), v.request_cost
+    FROM (VALUES %s) AS v(user_id, endpoint, query_timestamp, tokens_consumed, request_cost)
+    LEFT JOIN LATERAL (
+        SELECT tier FROM user_subscriptions WHERE user_id = v.user_id LIMIT 1
+    ) s ON TRUE
+"""
+_QUERY_USAGE_TEMPLATE = "(%s::integer, %s, %s::timestamp, %s::integer, %s::numeric)"
+
 def track_query_usage(user_id: str, endpoint: str, tokens_consumed: int = 0):
     """
     Track API query usage
     
+    The row is buffered and written by the usage flusher within
+    QUERY_USAGE_FLUSH_MS; query_timestamp is taken here, not at flush time.
+    
     Args:
         user_id: User ID
         endpoint: API endpoint
         tokens_consumed: Number of tokens used
     """
-    subscription = get_user_subscription(user_id)
-    tier = subscription.get("tier", "free")
+    # query_usage.user_id is an integer FK; a row that can't be cast would
+    # fail the whole batch INSERT it lands in
+    key = _usage_user_key(user_id)
+    if key is None:
+        logger.warning(f"Not tracking query usage for non-numeric user_id {user_id!r}")
+        return
     
-    query = """
-        INSERT INTO query_usage (
-            user_id, 
-            endpoint, 
-            query_timestamp, 
-            tokens_consumed,
-            subscription_tier,
-            request_cost
-        ) VALUES (%s, %s, NOW(), %s, %s, %s)
+    cost = tokens_consumed * 0.00001  # Rough estimate
+    
+    _ensure_usage_flusher()
+    with _usage_pending_lock:
+        _usage_buffer.append((key, endpoint, datetime.now(), int(tokens_consumed or 0), cost))
+        full = len(_usage_buffer) >= QUERY_USAGE_BATCH_SIZE
+    if full:
+        _usage_wakeup.set()
+
+def _usage_user_key(user_id: Any) -> Optional[int]:
+    """user_id as stored in query_usage, or None if it isn't an integer"""
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+def flush_query_usage(user_id: Any = None):
     """
+    Write out buffered usage rows now (used before counting and at shutdown)
     
-    cost = tokens_consumed * 0.00001  # Rough estimate
+    Args:
+        user_id: Only write this user's rows, and only wait for the flusher
+            if it is writing some of them; other users' rows stay batched
+    """
+    if user_id is not None:
+        _flush_user_usage(_usage_user_key(user_id))
+        return
     
-    db_pool.execute_write(
-        query,
-        (user_id, endpoint, tokens_consumed, tier, cost)
-    )
+    with _usage_write_lock:
+        while True:
+            with _usage_pending_lock:
+                batch = []
+                while _usage_buffer and len(batch) < QUERY_USAGE_BATCH_SIZE:
+                    batch.append(_usage_buffer.popleft())
+                _usage_inflight_users.update(row[0] for row in batch)
+            if not batch:
+                break
+            try:
+                _write_query_usage(batch)
+            finally:
+                with _usage_pending_lock:
+                    _usage_inflight_users.clear()
+
+def _flush_user_usage(key: Optional[int]):
+    with _usage_pending_lock:
+        pending = key in _usage_inflight_users or any(row[0] == key for row in _usage_buffer)
+    if not pending:
+        return
+    
+    # The write lock also waits out a batch in flight with this user's rows
+    with _usage_write_lock:
+        with _usage_pending_lock:
+            mine = []
+            for _ in range(len(_usage_buffer)):
+                row = _usage_buffer.popleft()
+                (mine if row[0] == key else _usage_buffer).append(row)
+        if mine:
+            _write_query_usage(mine)
+
+def _ensure_usage_flusher():
+    global _usage_thread
+    if _usage_thread is not None:
+        return
+    with _usage_thread_lock:
+        if _usage_thread is None:
+            _usage_thread = threading.Thread(
+                target=_usage_flusher, name="query-usage-flusher", daemon=True
+            )
+            _usage_thread.start()
+            atexit.register(flush_query_usage)
+
+def _usage_flusher():
+    flush_interval = QUERY_USAGE_FLUSH_MS / 1000
+    while True:
+        # Woken early once a full batch is waiting
+        _usage_wakeup.wait(flush_interval)
+        _usage_wakeup.clear()
+        flush_query_usage()
+
+def _write_query_usage(batch: List[tuple]):
+    try:
+        with db_cursor() as cur:
+            extras.execute_values(
+                cur, _INSERT_QUERY_USAGE_SQL, batch,
+                template=_QUERY_USAGE_TEMPLATE, page_size=QUERY_USAGE_BATCH_SIZE
+            )
+        return
+    except Exception as e:
+        if len(batch) == 1:
+            logger.error(f"Error tracking query usage (1 row dropped): {e}")
+            return
+        logger.warning(f"Query usage batch of {len(batch)} rows failed, retrying row by row: {e}")
+    
+    # One bad row (e.g. a user deleted before the flush) must not cost the
+    # rest of the batch; each row gets a savepoint in a single transaction
+    try:
+        with db_cursor() as cur:
+            for row in batch:
+                cur.execute("SAVEPOINT usage_row")
+                try:
+                    extras.execute_values(cur, _INSERT_QUERY_USAGE_SQL, [row], template=_QUERY_USAGE_TEMPLATE)
+                    cur.execute("RELEASE SAVEPOINT usage_row")
+                except psycopg2.Error as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT usage_row")
+                    logger.error(f"Dropping query usage row for user {row[0]}: {e}")
+    except Exception as e:
+        logger.error(f"Error tracking query usage ({len(batch)} rows dropped): {e}")
 
 def get_monthly_usage(user_id: str) -> int:
     """
@@ -455,81 +1178,157 @@ def get_monthly_usage(user_id: str) -> int:
     Returns:
         Number of queries this month
     """
+    # Count this user's rows still sitting in the usage buffer too
+    flush_query_usage(user_id)
+    
     query = """
-        SELECT COUNT(*) as count
+        SELECT COUNT(*)
         FROM query_usage
         WHERE user_id = %s
         AND query_timestamp >= date_trunc('month', CURRENT_DATE)
+        AND query_timestamp < date_trunc('month', CURRENT_DATE) + interval '1 month'
         AND endpoint IN ('ask', 'ask_media', 'generate_plan', 'training_readiness')
     """
     
-    result = db_pool.execute_one(query, (user_id,))
-    return result.get("count", 0) if result else 0
+    return db_pool.execute_scalar(query, (user_id,)) or 0
+
+async def aget_monthly_usage(user_id: str) -> int:
+    """Async get_monthly_usage"""
+    return await asyncio.to_thread(get_monthly_usage, user_id)
 
 # Database migration utilities
 
+_ARIA_TABLES_DDL = [
+    # User subscriptions table
+    """
+    CREATE TABLE IF NOT EXISTS user_subscriptions (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        tier VARCHAR(20) NOT NULL DEFAULT 'free',
+        subscription_status VARCHAR(20) DEFAULT 'active',
+        billing_cycle_start DATE,
+        next_billing_date DATE,
+        stripe_subscription_id VARCHAR(255),
+        stripe_customer_id VARCHAR(255),
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW(),
+        UNIQUE(user_id)
+    )
+    """,
+    
+    # Query usage tracking
+    """
+    CREATE TABLE IF NOT EXISTS query_usage (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        endpoint VARCHAR(100) NOT NULL,
+        query_timestamp TIMESTAMP DEFAULT NOW(),
+        tokens_consumed INTEGER DEFAULT 0,
+        subscription_tier VARCHAR(20),
+        request_cost DECIMAL(10, 6) DEFAULT 0.0
+    )
+    """,
+    
+    # Index for query usage
+    """
+    CREATE INDEX IF NOT EXISTS idx_query_usage_user_date 
+    ON query_usage(user_id, query_timestamp DESC)
+    """,
+    
+    # API keys table
+    """
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        key_hash VARCHAR(64) NOT NULL UNIQUE,
+        name VARCHAR(200),
+        expires_at TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        last_used TIMESTAMP,
+        is_active BOOLEAN DEFAULT true
+    )
+    """,
+    
+    # Index for API keys
+    """
+    CREATE INDEX IF NOT EXISTS idx_api_keys_hash 
+    ON api_keys(key_hash) WHERE is_active = true
+    """
+]
+
+# Indexes on tables that are already large in production, built CONCURRENTLY
+# so writers aren't blocked; (name, statement), run outside any transaction
+_ARIA_CONCURRENT_INDEXES = [
+    # Partial covering index for get_monthly_usage's count (index-only scan).
+    # The endpoint list must match the query's IN list exactly.
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_usage_monthly 
+    ON query_usage(user_id, query_timestamp DESC) INCLUDE (endpoint)
+    WHERE endpoint IN ('ask', 'ask_media', 'generate_plan', 'training_readiness')
+    """,
+]
+
+# Name of the index a CREATE INDEX ... IF NOT EXISTS statement builds
+_CREATE_INDEX_TARGET_RE = re.compile(
+    r"\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+def create_indexes_concurrently(conn, statements: List[str], settings: Optional[Dict[str, str]] = None):
+    """
+    Run CREATE / DROP INDEX CONCURRENTLY statements on a connection with no
+    open transaction
+    
+    CONCURRENTLY can't run inside a transaction block (or a multi-statement
+    string, which is one implicit transaction), so the connection is switched
+    to autocommit and each statement runs on its own; builds on populated
+    tables don't block writers. Indexes that already exist and are valid are
+    skipped. One left INVALID by an interrupted build is dropped and rebuilt,
+    since IF NOT EXISTS would otherwise keep it.
+    
+    Args:
+        conn: psycopg2 connection, outside a transaction
+        statements: Index DDL, run in order
+        settings: Session settings for the builds (e.g. maintenance_work_mem),
+            reset afterwards
+    """
+    targets = []
+    for stmt in statements:
+        match = _CREATE_INDEX_TARGET_RE.match(stmt)
+        targets.append((match.group(1) if match else None, stmt))
+    settings = settings or {}
+    
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT c.relname, i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relnamespace = current_schema()::regnamespace AND c.relname = ANY(%s)",
+            ([name for name, _ in targets if name],)
+        )
+        valid = dict(cur.fetchall())
+        for name, value in settings.items():
+            cur.execute(f"SET {name} = %s", (value,))
+        for name, stmt in targets:
+            if name is not None:
+                if valid.get(name):
+                    continue
+                if name in valid:
+                    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            cur.execute(stmt)
+    finally:
+        for name in settings:
+            cur.execute(f"RESET {name}")
+        cur.close()
+        conn.autocommit = autocommit
+
 def create_Aria_tables():
     """
     Create Aria-specific tables if they don't exist
     (Supplements TrackLit's existing schema)
     """
-    queries = [
-        # User subscriptions table
-        """
-        CREATE TABLE IF NOT EXISTS user_subscriptions (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            tier VARCHAR(20) NOT NULL DEFAULT 'free',
-            subscription_status VARCHAR(20) DEFAULT 'active',
-            billing_cycle_start DATE,
-            next_billing_date DATE,
-            stripe_subscription_id VARCHAR(255),
-            stripe_customer_id VARCHAR(255),
-            created_at TIMESTAMP DEFAULT NOW(),
-            updated_at TIMESTAMP DEFAULT NOW(),
-            UNIQUE(user_id)
-        )
-        """,
-        
-        # Query usage tracking
-        """
-        CREATE TABLE IF NOT EXISTS query_usage (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            endpoint VARCHAR(100) NOT NULL,
-            query_timestamp TIMESTAMP DEFAULT NOW(),
-            tokens_consumed INTEGER DEFAULT 0,
-            subscription_tier VARCHAR(20),
-            request_cost DECIMAL(10, 6) DEFAULT 0.0
-        )
-        """,
-        
-        # Index for query usage
-        """
-        CREATE INDEX IF NOT EXISTS idx_query_usage_user_date 
-        ON query_usage(user_id, query_timestamp DESC)
-        """,
-        
-        # API keys table
-        """
-        CREATE TABLE IF NOT EXISTS api_keys (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            key_hash VARCHAR(64) NOT NULL UNIQUE,
-            name VARCHAR(200),
-            expires_at TIMESTAMP NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW(),
-            last_used TIMESTAMP,
-            is_active BOOLEAN DEFAULT true
-        )
-        """,
-        
-        # Index for API keys
-        """
-        CREATE INDEX IF NOT EXISTS idx_api_keys_hash 
-        ON api_keys(key_hash) WHERE is_active = true
-        """
-    ]
+    queries = _ARIA_TABLES_DDL
     
     for query in queries:
         try:
@@ -538,11 +1337,42 @@ def create_Aria_tables():
         except Exception as e:
             logger.error(f"Failed to create table: {e}")
             raise
+    
+    with db_pool.connection() as conn:
+        create_indexes_concurrently(conn, _ARIA_CONCURRENT_INDEXES)
 
 # =============================================================================
 # ATHLETE PROFILE FUNCTIONS
 # =============================================================================
 
+# Columns the dynamic UPDATE helpers may set. Keys outside these sets are
+# dropped, so caller-supplied dict keys never reach the SQL text.
+_ATHLETE_UPDATABLE = frozenset({
+    "name", "gender", "email", "age", "training_goal", "injury_status",
+    "sleep_hours", "sleep_quality", "coach_mode", "training_days_per_week",
+    "mood", "streak_count", "badges"
+})
+_KNOWLEDGE_UPDATABLE = frozenset({"title", "summary", "tags", "url"})
+
+@functools.lru_cache(maxsize=256)
+def _build_update_sql(table: str, cols: Tuple[str, ...], key_col: str, key_param: str) -> str:
+    """
+    UPDATE ... RETURNING * for one set of columns
+    
+    `cols` must be sorted and whitelisted, so each column set maps to one
+    SQL text (and one cached server-side plan).
+    """
+    set_clause = ", ".join(f"{col} = %({col})s" for col in cols)
+    return f"UPDATE {table} SET {set_clause} WHERE {key_col} = %({key_param})s RETURNING *"
+
+def _filter_updates(updates: Dict[str, Any], allowed: frozenset, ignore_silently: str) -> Dict[str, Any]:
+    """Keep only whitelisted update fields, logging any others"""
+    fields = {k: v for k, v in updates.items() if k in allowed}
+    ignored = updates.keys() - fields.keys() - {ignore_silently}
+    if ignored:
+        logger.warning(f"Ignoring non-updatable fields: {sorted(ignored)}")
+    return fields
+
 def create_athlete_profile(profile_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Create a new athlete profile
@@ -584,26 +1414,17 @@ def update_athlete_profile(user_id: int, updates: Dict[str, Any]) -> Optional[Di
     Returns:
         Updated profile or None
     """
-    # Build dynamic UPDATE query
-    set_clauses = []
-    params = {'user_id': user_id}
-    
-    for key, value in updates.items():
-        if key != 'user_id':  # Don't update user_id
-            set_clauses.append(f"{key} = %({key})s")
-            params[key] = value
+    fields = _filter_updates(updates, _ATHLETE_UPDATABLE, 'user_id')
     
-    if not set_clauses:
+    if not fields:
         return get_athlete_profile(user_id)
     
-    query = f"""
-        UPDATE athlete_profiles 
-        SET {', '.join(set_clauses)}
-        WHERE user_id = %(user_id)s
-        RETURNING *
-    """
+    query = _build_update_sql('athlete_profiles', tuple(sorted(fields)), 'user_id', 'user_id')
+    params = {**fields, 'user_id': user_id}
     
-    return db_pool.execute_one(query, params)
+    result = db_pool.execute_one(query, params)
+    _profile_cache.pop(user_id)
+    return result
 
 def delete_athlete_profile(user_id: int) -> bool:
     """
@@ -617,6 +1438,7 @@ def delete_athlete_profile(user_id: int) -> bool:
     """
     query = "DELETE FROM athlete_profiles WHERE user_id = %(user_id)s"
     rows_affected = db_pool.execute_write(query, {'user_id': user_id})
+    _profile_cache.pop(user_id)
     return rows_affected > 0
 
 def update_athlete_mood(user_id: int, mood: str) -> Optional[Dict[str, Any]]:
@@ -627,7 +1449,9 @@ def update_athlete_mood(user_id: int, mood: str) -> Optional[Dict[str, Any]]:
         WHERE user_id = %(user_id)s
         RETURNING *
     """
-    return db_pool.execute_one(query, {'user_id': user_id, 'mood': mood})
+    result = db_pool.execute_one(query, {'user_id': user_id, 'mood': mood})
+    _profile_cache.pop(user_id)
+    return result
 
 # =============================================================================
 # KNOWLEDGE LIBRARY FUNCTIONS
@@ -640,12 +1464,12 @@ def get_knowledge_items(limit: int = 50, offset: int = 0) -> List[Dict[str, Any]
         ORDER BY created_at DESC
         LIMIT %(limit)s OFFSET %(offset)s
     """
-    return db_pool.execute_query(query, {'limit': limit, 'offset': offset})
+    return db_pool_ro.execute_query(query, {'limit': limit, 'offset': offset})
 
 def get_knowledge_item_by_id(item_id: int) -> Optional[Dict[str, Any]]:
     """Get single knowledge library item by ID"""
     query = "SELECT * FROM knowledge_library WHERE id = %(item_id)s"
-    return db_pool.execute_one(query, {'item_id': item_id})
+    return db_pool_ro.execute_one(query, {'item_id': item_id})
 
 def create_knowledge_item(item_data: Dict[str, Any]) -> Dict[str, Any]:
     """Create new knowledge library item"""
@@ -658,23 +1482,13 @@ def create_knowledge_item(item_data: Dict[str, Any]) -> Dict[str, Any]:
 
 def update_knowledge_item(item_id: int, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Update knowledge library item"""
-    set_clauses = []
-    params = {'item_id': item_id}
-    
-    for key, value in updates.items():
-        if key != 'id':
-            set_clauses.append(f"{key} = %({key})s")
-            params[key] = value
+    fields = _filter_updates(updates, _KNOWLEDGE_UPDATABLE, 'id')
     
-    if not set_clauses:
+    if not fields:
         return get_knowledge_item_by_id(item_id)
     
-    query = f"""
-        UPDATE knowledge_library 
-        SET {', '.join(set_clauses)}
-        WHERE id = %(item_id)s
-        RETURNING *
-    """
+    query = _build_update_sql('knowledge_library', tuple(sorted(fields)), 'id', 'item_id')
+    params = {**fields, 'item_id': item_id}
     
     return db_pool.execute_one(query, params)
 
@@ -684,15 +1498,26 @@ def delete_knowledge_item(item_id: int) -> bool:
     rows_affected = db_pool.execute_write(query, {'item_id': item_id})
     return rows_affected > 0
 
+# Weighted document for knowledge search. idx_knowledge_fts is built on this
+# exact expression, so the query and the index must share it.
+_KNOWLEDGE_TSV = (
+    "(setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', coalesce(summary, '')), 'B'))"
+)
+
 def search_knowledge_items(search_query: str) -> List[Dict[str, Any]]:
-    """Search knowledge library by title"""
-    query = """
+    """Search knowledge library by title and summary, best matches first"""
+    if not search_query.strip():
+        return get_knowledge_items(limit=50)
+    
+    query = f"""
         SELECT * FROM knowledge_library 
-        WHERE title ILIKE %(search)s OR summary ILIKE %(search)s
-        ORDER BY created_at DESC
+        WHERE {_KNOWLEDGE_TSV} @@ plainto_tsquery('english', %(search)s)
+        ORDER BY ts_rank({_KNOWLEDGE_TSV}, plainto_tsquery('english', %(search)s)) DESC,
+                 created_at DESC
         LIMIT 50
     """
-    return db_pool.execute_query(query, {'search': f'%{search_query}%'})
+    return db_pool_ro.execute_query(query, {'search': search_query})
 
 # =============================================================================
 # COACH-ATHLETE RELATIONSHIP FUNCTIONS
@@ -723,6 +1548,17 @@ def link_coach_athlete(coach_email: str, athlete_id: int) -> Dict[str, Any]:
         'athlete_id': athlete_id
     })
 
+def link_coach_athletes_bulk(coach_email: str, athlete_ids: List[int]) -> List[Dict[str, Any]]:
+    """Link a coach to many athletes in one round trip"""
+    return db_pool.bulk_insert(
+        "coach_athletes",
+        ("coach_email", "athlete_id"),
+        # A repeated id would make ON CONFLICT touch the same row twice
+        [(coach_email, athlete_id) for athlete_id in dict.fromkeys(athlete_ids)],
+        on_conflict="ON CONFLICT (coach_email, athlete_id) DO UPDATE SET created_at = NOW()",
+        returning="*"
+    )
+
 def unlink_coach_athlete(coach_email: str, athlete_id: int) -> bool:
     """Unlink a coach from an athlete"""
     query = """
@@ -739,16 +1575,22 @@ def unlink_coach_athlete(coach_email: str, athlete_id: int) -> bool:
 # QUERY USAGE DETAILED FUNCTIONS  
 # =============================================================================
 
+_QUERY_USAGE_DETAILS_SQL = """
+    SELECT * FROM query_usage
+    WHERE user_id = %(user_id)s
+    AND query_timestamp >= %(start_date)s
+    AND query_timestamp <= %(end_date)s
+    ORDER BY query_timestamp DESC
+"""
+
 def get_query_usage_details(user_id: int, start_date: Any, end_date: Any) -> List[Dict[str, Any]]:
     """Get detailed query usage for a date range"""
-    query = """
-        SELECT * FROM query_usage
-        WHERE user_id = %(user_id)s
-        AND query_timestamp >= %(start_date)s
-        AND query_timestamp <= %(end_date)s
-        ORDER BY query_timestamp DESC
-    """
-    return db_pool.execute_query(query, {
+    return list(iter_query_usage_details(user_id, start_date, end_date))
+
+def iter_query_usage_details(user_id: int, start_date: Any, end_date: Any) -> Iterator[Dict[str, Any]]:
+    """Stream detailed query usage for a date range without loading it all into memory"""
+    flush_query_usage(user_id)
+    return db_pool.execute_stream(_QUERY_USAGE_DETAILS_SQL, {
         'user_id': user_id,
         'start_date': start_date,
         'end_date': end_date
@@ -758,43 +1600,48 @@ def get_query_usage_details(user_id: int, start_date: Any, end_date: Any) -> Lis
 # TABLE CREATION FOR MISSING TABLES
 # =============================================================================
 
+_ADDITIONAL_TABLES_DDL = [
+    # Knowledge library table
+    """
+    CREATE TABLE IF NOT EXISTS knowledge_library (
+        id SERIAL PRIMARY KEY,
+        title VARCHAR(500) NOT NULL,
+        summary TEXT NOT NULL,
+        tags TEXT[] DEFAULT '{}',
+        url VARCHAR(1000),
+        created_at TIMESTAMP DEFAULT NOW()
+    )
+    """,
+    
+    # Coach-athlete relationships
+    """
+    CREATE TABLE IF NOT EXISTS coach_athletes (
+        id SERIAL PRIMARY KEY,
+        coach_email VARCHAR(255) NOT NULL,
+        athlete_id INTEGER NOT NULL REFERENCES athlete_profiles(user_id) ON DELETE CASCADE,
+        created_at TIMESTAMP DEFAULT NOW(),
+        UNIQUE(coach_email, athlete_id)
+    )
+    """,
+    
+    # Indexes
+    # Full-text index for search_knowledge_items (replaces the title-only one)
+    f"""
+    CREATE INDEX IF NOT EXISTS idx_knowledge_fts 
+    ON knowledge_library USING gin({_KNOWLEDGE_TSV})
+    """,
+    
+    "DROP INDEX IF EXISTS idx_knowledge_title",
+    
+    """
+    CREATE INDEX IF NOT EXISTS idx_coach_athletes_email 
+    ON coach_athletes(coach_email)
+    """
+]
+
 def create_additional_tables():
     """Create additional tables needed for full functionality"""
-    queries = [
-        # Knowledge library table
-        """
-        CREATE TABLE IF NOT EXISTS knowledge_library (
-            id SERIAL PRIMARY KEY,
-            title VARCHAR(500) NOT NULL,
-            summary TEXT NOT NULL,
-            tags TEXT[] DEFAULT '{}',
-            url VARCHAR(1000),
-            created_at TIMESTAMP DEFAULT NOW()
-        )
-        """,
-        
-        # Coach-athlete relationships
-        """
-        CREATE TABLE IF NOT EXISTS coach_athletes (
-            id SERIAL PRIMARY KEY,
-            coach_email VARCHAR(255) NOT NULL,
-            athlete_id INTEGER NOT NULL REFERENCES athlete_profiles(user_id) ON DELETE CASCADE,
-            created_at TIMESTAMP DEFAULT NOW(),
-            UNIQUE(coach_email, athlete_id)
-        )
-        """,
-        
-        # Indexes
-        """
-        CREATE INDEX IF NOT EXISTS idx_knowledge_title 
-        ON knowledge_library USING gin(to_tsvector('english', title))
-        """,
-        
-        """
-        CREATE INDEX IF NOT EXISTS idx_coach_athletes_email 
-        ON coach_athletes(coach_email)
-        """
-    ]
+    queries = _ADDITIONAL_TABLES_DDL
     
     for query in queries:
         try:
@@ -803,9 +1650,72 @@ def create_additional_tables():
         except Exception as e:
             logger.error(f"Failed to create additional table: {e}")
 
-# Initialize Aria tables on import (safe to run multiple times)
-try:
-    create_Aria_tables()
-    create_additional_tables()
-except Exception as e:
-    logger.warning(f"Could not create Aria tables: {e}")
+# Key for the advisory lock that keeps concurrent boots from racing the DDL
+MIGRATION_LOCK_NAME = "aria_migrations"
+
+def run_migrations() -> bool:
+    """
+    Create Aria's tables and indexes in a single transaction
+    
+    Indexes on large tables (_ARIA_CONCURRENT_INDEXES) are built afterwards,
+    CONCURRENTLY and in autocommit, still under the advisory lock.
+    
+    Meant to run once per deployment (python -m src.migrate) rather than on
+    every worker import. A Postgres advisory lock makes replicas that start
+    together skip the DDL instead of running it concurrently.
+    
+    Returns:
+        True if the migrations ran here, False if another process held the lock
+    """
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (MIGRATION_LOCK_NAME,))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                logger.info("Migrations are running in another process, skipping")
+                return False
+            
+            try:
+                for query in _ARIA_TABLES_DDL:
+                    cur.execute(query)
+                # Additional tables stay best-effort, as in create_additional_tables
+                for query in _ADDITIONAL_TABLES_DDL:
+                    cur.execute("SAVEPOINT aria_migration")
+                    try:
+                        cur.execute(query)
+                        cur.execute("RELEASE SAVEPOINT aria_migration")
+                    except psycopg2.Error as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT aria_migration")
+                        logger.error(f"Failed to create additional table: {e}")
+                conn.commit()
+                create_indexes_concurrently(conn, _ARIA_CONCURRENT_INDEXES)
+                logger.info("Aria tables created or already exist")
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (MIGRATION_LOCK_NAME,))
+                conn.commit()
+            return True
+        finally:
+            cur.close()
+
+def _reset_after_fork():
+    """Give a forked child its own pool, flusher thread and locks"""
+    global _usage_write_lock, _usage_pending_lock, _usage_wakeup, _usage_thread, _usage_thread_lock
+    db_pool._after_fork_in_child()
+    if db_pool_ro is not db_pool:
+        db_pool_ro._after_fork_in_child()
+    # Buffered usage rows belong to the parent, which will write them
+    _usage_buffer.clear()
+    _usage_inflight_users.clear()
+    _usage_write_lock = threading.Lock()
+    _usage_pending_lock = threading.Lock()
+    _usage_wakeup = threading.Event()
+    _usage_thread = None
+    _usage_thread_lock = threading.Lock()
+    for cache in (_subscription_cache, _profile_cache):
+        cache._lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -4,9 +4,9 @@ Additional tables and functions for conversation history, training sessions,
 progress tracking, calendar, injuries, drills, goals, nutrition, and mental performance.
 """
 import logging
-import json
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
+from psycopg2.extras import Json
 from src.database import db_pool
 
 logger = logging.getLogger(__name__)
@@ -481,7 +481,6 @@ def log_training_session(session_data: Dict) -> Optional[int]:
             %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
         ) RETURNING id
     """
-    import json
     params = (
         session_data.get('user_id'),
         session_data.get('session_date'),
@@ -489,8 +488,8 @@ def log_training_session(session_data: Dict) -> Optional[int]:
         session_data.get('duration_minutes'),
         session_data.get('distance_meters'),
         session_data.get('workout_description'),
-        json.dumps(session_data.get('splits')) if session_data.get('splits') else None,
-        json.dumps(session_data.get('heart_rate')) if session_data.get('heart_rate') else None,
+        Json(session_data.get('splits')) if session_data.get('splits') else None,
+        Json(session_data.get('heart_rate')) if session_data.get('heart_rate') else None,
         session_data.get('rpe'),
         session_data.get('notes'),
         session_data.get('mood_before'),
@@ -1017,10 +1016,60 @@ def get_recent_achievements(user_id: str, days: int = 30) -> List[Dict]:
 # VOICE INTERACTION FUNCTIONS
 # =============================================================================
 
+# Months whose voice_interactions partition this process has already ensured
+_voice_partitions_ready = set()
+
+def ensure_voice_partition():
+    """
+    Create this month's and next month's voice_interactions partitions
+    
+    The months come from the database clock, which fills created_at, so app
+    clock skew around a month boundary can't leave a row without its
+    partition; a DEFAULT partition catches anything that still slips through.
+    A month whose rows already landed in the DEFAULT partition is skipped with
+    a warning. A no-op when the table isn't partitioned (installs predating
+    scripts/add_voice_interactions_table.py's partitioned layout), and checked
+    once per month per process.
+    """
+    month = datetime.now().date().replace(day=1)
+    if month in _voice_partitions_ready:
+        return
+    
+    db_pool.execute_write("""
+        DO $$
+        DECLARE
+            start date;
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                WHERE c.relname = 'voice_interactions'
+            ) THEN
+                FOR ahead IN 0..1 LOOP
+                    start := (date_trunc('month', now()) + make_interval(months => ahead))::date;
+                    BEGIN
+                        EXECUTE format(
+                            'CREATE TABLE IF NOT EXISTS %I PARTITION OF voice_interactions FOR VALUES FROM (%L) TO (%L)',
+                            'voice_interactions_' || to_char(start, 'YYYY_MM'),
+                            start, (start + interval '1 month')::date
+                        );
+                    EXCEPTION
+                        WHEN check_violation THEN
+                            RAISE WARNING 'voice_interactions_default already holds rows for %, partition not created', start;
+                    END;
+                END LOOP;
+                CREATE TABLE IF NOT EXISTS voice_interactions_default
+                PARTITION OF voice_interactions DEFAULT;
+            END IF;
+        END $$
+    """)
+    _voice_partitions_ready.add(month)
+
 def log_voice_interaction(user_id: str, audio_url: str, transcription: str, 
                          response_text: str, response_audio_url: str, 
                          duration: int) -> Optional[int]:
     """Log a voice interaction"""
+    ensure_voice_partition()
     query = """
         INSERT INTO voice_interactions (
             user_id, audio_file_url, transcription, response_text, 
@@ -5,8 +5,7 @@ Track running shoes, spikes, and gear with mileage alerts and replacement recomm
 import logging
 from typing import Dict, List, Any, Optional
 from datetime import datetime, date, timedelta
-from src.database import get_db_connection
-import psycopg2.extras
+from src.database import db_cursor, execute_cached, INTERNAL_ERROR
 
 logger = logging.getLogger(__name__)
 
@@ -21,71 +20,170 @@ EQUIPMENT_LIFESPANS = {
 
 REPLACEMENT_WARNING_THRESHOLD = 0.85  # Warn at 85% of lifespan
 
+# Active gear at or past the warning threshold. Inlined (not a parameter) in
+# the alert queries so it matches idx_equipment_alerts' predicate literally,
+# which scripts/migrate_database.py builds from this same string
+EQUIPMENT_ALERT_PREDICATE = f"status = 'active' AND wear_ratio >= {REPLACEMENT_WARNING_THRESHOLD}"
+
+# Replacement suggestions per equipment type
+EQUIPMENT_SUGGESTIONS = {
+    "training_shoes": [
+        "Nike Air Zoom Pegasus",
+        "Adidas Adizero Boston",
+        "Brooks Ghost",
+        "ASICS Gel-Nimbus",
+        "Hoka Clifton"
+    ],
+    "racing_spikes": [
+        "Nike Superfly Elite",
+        "Adidas Adizero Prime SP",
+        "New Balance MD-X",
+        "Puma evoSPEED Sprint"
+    ],
+    "racing_flats": [
+        "Nike Zoom Victory",
+        "Adidas Adizero Takumi Sen",
+        "Saucony Endorphin Pro"
+    ]
+}
+
+# (name, lowercased name) pairs so the brand filter doesn't re-lower static data
+_SUGGESTIONS_LC = {
+    equipment_type: [(name, name.lower()) for name in names]
+    for equipment_type, names in EQUIPMENT_SUGGESTIONS.items()
+}
+
+# SQL twin of get_equipment_health, so listings come back already enriched
+# instead of being post-processed row by row in Python
+_HEALTH_STATUS_SQL = """
+    CASE WHEN max_mileage IS NULL OR max_mileage = 0 OR max_mileage = 'Infinity'::float THEN
+        json_build_object(
+            'status', 'good',
+            'percentage', 100,
+            'message', 'No mileage tracking for this equipment'
+        )
+    ELSE
+        json_build_object(
+            'status', CASE
+                WHEN wear_ratio < 0.70 THEN 'excellent'
+                WHEN wear_ratio < 0.85 THEN 'good'
+                WHEN wear_ratio < 0.95 THEN 'warning'
+                ELSE 'critical'
+            END,
+            'percentage', round((wear_ratio * 100)::numeric, 1),
+            'miles_remaining', max_mileage - current_mileage,
+            'message', CASE
+                WHEN wear_ratio < 0.70 THEN 'Great condition'
+                WHEN wear_ratio < 0.85 THEN 'Still good to go'
+                WHEN wear_ratio < 0.95 THEN 'Consider replacing soon'
+                ELSE 'Replacement recommended'
+            END
+        )
+    END
+"""
+
+
+# =============================================================================
+# HOT QUERIES (prepared per pooled connection by execute_cached)
+# =============================================================================
+
+# Listed rather than *: a prepared SELECT * fails with "cached plan must not
+# change result type" on every pooled connection once a column is added
+_EQUIPMENT_COLUMNS = (
+    "equipment_id, user_id, equipment_type, brand, model, purchase_date, initial_mileage, "
+    "current_mileage, max_mileage, status, notes, created_at, wear_ratio"
+)
+
+_ADD_EQUIPMENT_SQL = """
+    INSERT INTO equipment 
+    (user_id, equipment_type, brand, model, purchase_date, initial_mileage, current_mileage, max_mileage)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING equipment_id, equipment_type, brand, model, current_mileage, max_mileage
+"""
+
+_LOG_EQUIPMENT_USAGE_SQL = """
+    WITH ins AS (
+        INSERT INTO equipment_usage (equipment_id, user_id, miles_added, usage_date, session_type, notes)
+        VALUES (%(equipment_id)s, %(user_id)s, %(miles_added)s, %(usage_date)s, %(session_type)s, %(notes)s)
+        RETURNING usage_id
+    )
+    UPDATE equipment
+    SET current_mileage = current_mileage + %(miles_added)s
+    WHERE equipment_id = %(equipment_id)s
+    RETURNING (SELECT usage_id FROM ins) AS usage_id, current_mileage, max_mileage, brand, model
+"""
+
+_USER_EQUIPMENT_SQL = f"""
+    SELECT {_EQUIPMENT_COLUMNS}, {_HEALTH_STATUS_SQL} AS health_status FROM equipment
+    WHERE user_id = %s
+    ORDER BY purchase_date DESC
+"""
+
+_USER_EQUIPMENT_BY_STATUS_SQL = f"""
+    SELECT {_EQUIPMENT_COLUMNS}, {_HEALTH_STATUS_SQL} AS health_status FROM equipment
+    WHERE user_id = %s AND status = %s
+    ORDER BY purchase_date DESC
+"""
+
 # =============================================================================
 # DATABASE FUNCTIONS
 # =============================================================================
 
 def create_equipment_tables():
     """Create equipment tracking tables"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
     try:
-        # Equipment inventory
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS equipment (
-                equipment_id SERIAL PRIMARY KEY,
-                user_id VARCHAR(255) NOT NULL,
-                equipment_type VARCHAR(100) NOT NULL,
-                brand VARCHAR(100),
-                model VARCHAR(100),
-                purchase_date DATE,
-                initial_mileage FLOAT DEFAULT 0.0,
-                current_mileage FLOAT DEFAULT 0.0,
-                max_mileage FLOAT,
-                status VARCHAR(50) DEFAULT 'active',
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Equipment usage logs
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS equipment_usage (
-                usage_id SERIAL PRIMARY KEY,
-                equipment_id INTEGER REFERENCES equipment(equipment_id),
-                user_id VARCHAR(255) NOT NULL,
-                miles_added FLOAT NOT NULL,
-                usage_date DATE NOT NULL,
-                session_type VARCHAR(100),
-                notes TEXT,
-                logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Equipment maintenance
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS equipment_maintenance (
-                maintenance_id SERIAL PRIMARY KEY,
-                equipment_id INTEGER REFERENCES equipment(equipment_id),
-                maintenance_type VARCHAR(100) NOT NULL,
-                maintenance_date DATE NOT NULL,
-                cost DECIMAL(10, 2),
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
+        with db_cursor() as cur:
+            # Equipment inventory
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS equipment (
+                    equipment_id SERIAL PRIMARY KEY,
+                    user_id VARCHAR(255) NOT NULL,
+                    equipment_type VARCHAR(100) NOT NULL,
+                    brand VARCHAR(100),
+                    model VARCHAR(100),
+                    purchase_date DATE,
+                    initial_mileage FLOAT DEFAULT 0.0,
+                    current_mileage FLOAT DEFAULT 0.0,
+                    max_mileage FLOAT,
+                    status VARCHAR(50) DEFAULT 'active',
+                    notes TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    wear_ratio FLOAT GENERATED ALWAYS AS (current_mileage / NULLIF(max_mileage, 0)) STORED
+                )
+            """)
+            
+            # Equipment usage logs
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS equipment_usage (
+                    usage_id SERIAL PRIMARY KEY,
+                    equipment_id INTEGER REFERENCES equipment(equipment_id),
+                    user_id VARCHAR(255) NOT NULL,
+                    miles_added FLOAT NOT NULL,
+                    usage_date DATE NOT NULL,
+                    session_type VARCHAR(100),
+                    notes TEXT,
+                    logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Equipment maintenance
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS equipment_maintenance (
+                    maintenance_id SERIAL PRIMARY KEY,
+                    equipment_id INTEGER REFERENCES equipment(equipment_id),
+                    maintenance_type VARCHAR(100) NOT NULL,
+                    maintenance_date DATE NOT NULL,
+                    cost DECIMAL(10, 2),
+                    notes TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
         logger.info("Equipment tracking tables created successfully")
         
     except Exception as e:
         logger.error(f"Error creating equipment tables: {e}")
-        conn.rollback()
         raise
-    finally:
-        cur.close()
-        conn.close()
 
 # =============================================================================
 # EQUIPMENT MANAGEMENT
@@ -100,22 +198,16 @@ def add_equipment(
     initial_mileage: float = 0.0
 ) -> Dict[str, Any]:
     """Add new equipment to inventory"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        # Get max mileage for equipment type
-        max_mileage = EQUIPMENT_LIFESPANS.get(equipment_type, 400)
-        
-        cur.execute("""
-            INSERT INTO equipment 
-            (user_id, equipment_type, brand, model, purchase_date, initial_mileage, current_mileage, max_mileage)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING equipment_id, equipment_type, brand, model, current_mileage, max_mileage
-        """, (user_id, equipment_type, brand, model, purchase_date, initial_mileage, initial_mileage, max_mileage))
-        
-        equipment = cur.fetchone()
-        conn.commit()
+        with db_cursor(dict_cursor=True) as cur:
+            # Get max mileage for equipment type
+            max_mileage = EQUIPMENT_LIFESPANS.get(equipment_type, 400)
+            
+            execute_cached(cur, _ADD_EQUIPMENT_SQL, (
+                user_id, equipment_type, brand, model, purchase_date, initial_mileage, initial_mileage, max_mileage
+            ))
+            
+            equipment = cur.fetchone()
         
         logger.info(f"Equipment added for user {user_id}: {brand} {model}")
         return {
@@ -124,13 +216,9 @@ def add_equipment(
             "message": f"{brand} {model} added to your gear inventory"
         }
         
-    except Exception as e:
-        logger.error(f"Error adding equipment: {e}")
-        conn.rollback()
-        return {"success": False, "error": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+    except Exception:
+        logger.exception("Error adding equipment")
+        return INTERNAL_ERROR
 
 
 def log_equipment_usage(
@@ -142,29 +230,22 @@ def log_equipment_usage(
     notes: Optional[str] = None
 ) -> Dict[str, Any]:
     """Log miles on equipment"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        # Log usage
-        cur.execute("""
-            INSERT INTO equipment_usage (equipment_id, user_id, miles_added, usage_date, session_type, notes)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING usage_id
-        """, (equipment_id, user_id, miles_added, usage_date, session_type, notes))
-        
-        usage = cur.fetchone()
-        
-        # Update equipment mileage
-        cur.execute("""
-            UPDATE equipment
-            SET current_mileage = current_mileage + %s
-            WHERE equipment_id = %s
-            RETURNING current_mileage, max_mileage, brand, model
-        """, (miles_added, equipment_id))
-        
-        equipment = cur.fetchone()
-        conn.commit()
+        with db_cursor(dict_cursor=True) as cur:
+            # Log usage and bump the mileage in one statement
+            execute_cached(cur, _LOG_EQUIPMENT_USAGE_SQL, {
+                "equipment_id": equipment_id,
+                "user_id": user_id,
+                "miles_added": miles_added,
+                "usage_date": usage_date,
+                "session_type": session_type,
+                "notes": notes
+            })
+            
+            equipment = cur.fetchone()
+            if not equipment:
+                # Roll back the usage row too
+                raise LookupError(equipment_id)
         
         # Check if replacement warning needed
         warning = None
@@ -173,61 +254,40 @@ def log_equipment_usage(
         
         return {
             "success": True,
-            "usage_id": usage["usage_id"],
+            "usage_id": equipment["usage_id"],
             "current_mileage": equipment["current_mileage"],
             "max_mileage": equipment["max_mileage"],
             "warning": warning
         }
         
-    except Exception as e:
-        logger.error(f"Error logging equipment usage: {e}")
-        conn.rollback()
-        return {"success": False, "error": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+    except LookupError:
+        return {"success": False, "error": "Equipment not found"}
+    except Exception:
+        logger.exception("Error logging equipment usage")
+        return INTERNAL_ERROR
 
 
 def get_user_equipment(user_id: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
     """Get all equipment for user"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        if status:
-            cur.execute("""
-                SELECT * FROM equipment
-                WHERE user_id = %s AND status = %s
-                ORDER BY purchase_date DESC
-            """, (user_id, status))
-        else:
-            cur.execute("""
-                SELECT * FROM equipment
-                WHERE user_id = %s
-                ORDER BY purchase_date DESC
-            """, (user_id,))
-        
-        equipment = cur.fetchall()
-        
-        # Add health status to each item
-        result = []
-        for item in equipment:
-            item_dict = dict(item)
-            item_dict["health_status"] = get_equipment_health(item_dict)
-            result.append(item_dict)
-        
-        return result
-        
+        with db_cursor() as cur:
+            if status:
+                execute_cached(cur, _USER_EQUIPMENT_BY_STATUS_SQL, (user_id, status))
+            else:
+                execute_cached(cur, _USER_EQUIPMENT_SQL, (user_id,))
+            
+            # Plain tuples zipped once into the dicts we return, rather than a
+            # RealDictRow per row that then gets copied
+            columns = [col[0] for col in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+            
     except Exception as e:
         logger.error(f"Error fetching equipment: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def get_equipment_health(equipment: Dict[str, Any]) -> Dict[str, Any]:
-    """Calculate equipment health status"""
+    """Calculate equipment health status (see _HEALTH_STATUS_SQL for the query-side version)"""
     current = equipment.get("current_mileage", 0)
     maximum = equipment.get("max_mileage")
     
@@ -263,60 +323,49 @@ def get_equipment_health(equipment: Dict[str, Any]) -> Dict[str, Any]:
 
 def get_equipment_alerts(user_id: str) -> List[Dict[str, Any]]:
     """Get equipment replacement alerts"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            SELECT * FROM equipment
-            WHERE user_id = %s 
-            AND status = 'active'
-            AND max_mileage IS NOT NULL
-            AND current_mileage >= (max_mileage * %s)
-            ORDER BY (current_mileage / max_mileage) DESC
-        """, (user_id, REPLACEMENT_WARNING_THRESHOLD))
-        
-        equipment = cur.fetchall()
-        
-        alerts = []
-        for item in equipment:
-            health = get_equipment_health(dict(item))
-            alerts.append({
-                "equipment_id": item["equipment_id"],
-                "type": item["equipment_type"],
-                "brand": item["brand"],
-                "model": item["model"],
-                "current_mileage": item["current_mileage"],
-                "max_mileage": item["max_mileage"],
-                "health": health,
-                "alert_level": health["status"]
-            })
-        
-        return alerts
-        
+        with db_cursor() as cur:
+            cur.execute(f"""
+                SELECT equipment_id, equipment_type, brand, model, current_mileage, max_mileage
+                FROM equipment
+                WHERE user_id = %s 
+                AND {EQUIPMENT_ALERT_PREDICATE}
+                ORDER BY wear_ratio DESC
+            """, (user_id,))
+            
+            alerts = []
+            for equipment_id, equipment_type, brand, model, current_mileage, max_mileage in cur.fetchall():
+                health = get_equipment_health({"current_mileage": current_mileage, "max_mileage": max_mileage})
+                alerts.append({
+                    "equipment_id": equipment_id,
+                    "type": equipment_type,
+                    "brand": brand,
+                    "model": model,
+                    "current_mileage": current_mileage,
+                    "max_mileage": max_mileage,
+                    "health": health,
+                    "alert_level": health["status"]
+                })
+            
+            return alerts
+            
     except Exception as e:
         logger.error(f"Error fetching equipment alerts: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def retire_equipment(equipment_id: int, user_id: str, notes: Optional[str] = None) -> Dict[str, Any]:
     """Retire equipment"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            UPDATE equipment
-            SET status = 'retired', notes = %s
-            WHERE equipment_id = %s AND user_id = %s
-            RETURNING equipment_id, brand, model, current_mileage
-        """, (notes, equipment_id, user_id))
-        
-        equipment = cur.fetchone()
-        conn.commit()
+        with db_cursor(dict_cursor=True) as cur:
+            cur.execute("""
+                UPDATE equipment
+                SET status = 'retired', notes = %s
+                WHERE equipment_id = %s AND user_id = %s
+                RETURNING equipment_id, brand, model, current_mileage
+            """, (notes, equipment_id, user_id))
+            
+            equipment = cur.fetchone()
         
         if equipment:
             return {
@@ -327,36 +376,27 @@ def retire_equipment(equipment_id: int, user_id: str, notes: Optional[str] = Non
         else:
             return {"success": False, "error": "Equipment not found"}
         
-    except Exception as e:
-        logger.error(f"Error retiring equipment: {e}")
-        conn.rollback()
-        return {"success": False, "error": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+    except Exception:
+        logger.exception("Error retiring equipment")
+        return INTERNAL_ERROR
 
 
 def get_equipment_usage_history(equipment_id: int) -> List[Dict[str, Any]]:
     """Get usage history for equipment"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            SELECT * FROM equipment_usage
-            WHERE equipment_id = %s
-            ORDER BY usage_date DESC
-        """, (equipment_id,))
-        
-        usage = cur.fetchall()
-        return [dict(u) for u in usage]
-        
+        with db_cursor() as cur:
+            cur.execute("""
+                SELECT * FROM equipment_usage
+                WHERE equipment_id = %s
+                ORDER BY usage_date DESC
+            """, (equipment_id,))
+            
+            columns = [col[0] for col in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+            
     except Exception as e:
         logger.error(f"Error fetching usage history: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def log_equipment_maintenance(
@@ -367,18 +407,15 @@ def log_equipment_maintenance(
     notes: Optional[str] = None
 ) -> Dict[str, Any]:
     """Log equipment maintenance (cleaning, repairs, etc.)"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        cur.execute("""
-            INSERT INTO equipment_maintenance (equipment_id, maintenance_type, maintenance_date, cost, notes)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING maintenance_id
-        """, (equipment_id, maintenance_type, maintenance_date, cost, notes))
-        
-        maintenance = cur.fetchone()
-        conn.commit()
+        with db_cursor(dict_cursor=True) as cur:
+            cur.execute("""
+                INSERT INTO equipment_maintenance (equipment_id, maintenance_type, maintenance_date, cost, notes)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING maintenance_id
+            """, (equipment_id, maintenance_type, maintenance_date, cost, notes))
+            
+            maintenance = cur.fetchone()
         
         return {
             "success": True,
@@ -386,114 +423,108 @@ def log_equipment_maintenance(
             "message": f"Maintenance logged for equipment"
         }
         
-    except Exception as e:
-        logger.error(f"Error logging maintenance: {e}")
-        conn.rollback()
-        return {"success": False, "error": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+    except Exception:
+        logger.exception("Error logging maintenance")
+        return INTERNAL_ERROR
 
 
 def get_equipment_analytics(user_id: str) -> Dict[str, Any]:
     """Get equipment analytics and insights"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    
     try:
-        # Total miles across all equipment
-        cur.execute("""
-            SELECT 
-                equipment_type,
-                COUNT(*) as count,
-                SUM(current_mileage - initial_mileage) as total_miles,
-                AVG(current_mileage - initial_mileage) as avg_miles_per_item
-            FROM equipment
-            WHERE user_id = %s
-            GROUP BY equipment_type
-        """, (user_id,))
-        
-        equipment_stats = cur.fetchall()
-        
-        # Most used equipment
-        cur.execute("""
-            SELECT 
-                e.equipment_id,
-                e.brand,
-                e.model,
-                e.equipment_type,
-                e.current_mileage - e.initial_mileage as total_miles
-            FROM equipment e
-            WHERE e.user_id = %s
-            ORDER BY (e.current_mileage - e.initial_mileage) DESC
-            LIMIT 5
-        """, (user_id,))
-        
-        most_used = cur.fetchall()
-        
-        # Equipment needing replacement
-        alerts = get_equipment_alerts(user_id)
-        
-        return {
-            "equipment_stats": [dict(stat) for stat in equipment_stats],
-            "most_used": [dict(item) for item in most_used],
-            "replacement_alerts": alerts,
-            "total_equipment": sum(stat["count"] for stat in equipment_stats)
-        }
-        
+        with db_cursor() as cur:
+            # Stats, top 5 and replacement alerts in one round-trip
+            cur.execute(f"""
+                WITH owned AS (
+                    SELECT * FROM equipment WHERE user_id = %(user_id)s
+                ),
+                stats AS (
+                    SELECT 
+                        equipment_type,
+                        COUNT(*) as count,
+                        SUM(current_mileage - initial_mileage) as total_miles,
+                        AVG(current_mileage - initial_mileage) as avg_miles_per_item
+                    FROM owned
+                    GROUP BY equipment_type
+                ),
+                most_used AS (
+                    SELECT 
+                        equipment_id,
+                        brand,
+                        model,
+                        equipment_type,
+                        current_mileage - initial_mileage as total_miles
+                    FROM owned
+                    ORDER BY (current_mileage - initial_mileage) DESC
+                    LIMIT 5
+                ),
+                alerts AS (
+                    SELECT equipment_id, equipment_type, brand, model, current_mileage, max_mileage,
+                           wear_ratio, {_HEALTH_STATUS_SQL} AS health
+                    FROM owned
+                    WHERE {EQUIPMENT_ALERT_PREDICATE}
+                )
+                SELECT json_build_object(
+                    'equipment_stats', COALESCE((SELECT json_agg(stats) FROM stats), '[]'::json),
+                    'most_used', COALESCE((SELECT json_agg(most_used ORDER BY total_miles DESC) FROM most_used), '[]'::json),
+                    'replacement_alerts', COALESCE((
+                        SELECT json_agg(json_build_object(
+                            'equipment_id', equipment_id,
+                            'type', equipment_type,
+                            'brand', brand,
+                            'model', model,
+                            'current_mileage', current_mileage,
+                            'max_mileage', max_mileage,
+                            'health', health,
+                            'alert_level', health->>'status'
+                        ) ORDER BY wear_ratio DESC)
+                        FROM alerts
+                    ), '[]'::json),
+                    'total_equipment', (SELECT COUNT(*) FROM owned)
+                )
+            """, {"user_id": user_id})
+            
+            return cur.fetchone()[0]
+            
     except Exception as e:
         logger.error(f"Error fetching equipment analytics: {e}")
         return {}
-    finally:
-        cur.close()
-        conn.close()
 
 
 def get_replacement_recommendations(user_id: str) -> List[Dict[str, Any]]:
     """Get personalized equipment replacement recommendations"""
-    alerts = get_equipment_alerts(user_id)
-    
-    recommendations = []
-    for alert in alerts:
-        if alert["health"]["status"] in ["warning", "critical"]:
-            recommendation = {
-                "equipment_id": alert["equipment_id"],
-                "current": f"{alert['brand']} {alert['model']}",
-                "reason": alert["health"]["message"],
-                "urgency": alert["alert_level"],
-                "suggestions": get_similar_equipment_suggestions(alert["type"], alert["brand"])
-            }
-            recommendations.append(recommendation)
-    
-    return recommendations
+    try:
+        with db_cursor() as cur:
+            # Every alert at or above the warning threshold is already at
+            # "warning" or "critical", so the partial alerts index is the filter
+            cur.execute(f"""
+                SELECT equipment_id, equipment_type, brand, model, {_HEALTH_STATUS_SQL} AS health
+                FROM equipment
+                WHERE user_id = %s
+                AND {EQUIPMENT_ALERT_PREDICATE}
+                ORDER BY wear_ratio DESC
+            """, (user_id,))
+            
+            return [
+                {
+                    "equipment_id": equipment_id,
+                    "current": f"{brand} {model}",
+                    "reason": health["message"],
+                    "urgency": health["status"],
+                    "suggestions": get_similar_equipment_suggestions(equipment_type, brand)
+                }
+                for equipment_id, equipment_type, brand, model, health in cur.fetchall()
+            ]
+            
+    except Exception as e:
+        logger.error(f"Error fetching replacement recommendations: {e}")
+        return []
 
 
 def get_similar_equipment_suggestions(equipment_type: str, current_brand: str) -> List[str]:
     """Get suggestions for similar equipment (could integrate with product API)"""
-    suggestions = {
-        "training_shoes": [
-            "Nike Air Zoom Pegasus",
-            "Adidas Adizero Boston",
-            "Brooks Ghost",
-            "ASICS Gel-Nimbus",
-            "Hoka Clifton"
-        ],
-        "racing_spikes": [
-            "Nike Superfly Elite",
-            "Adidas Adizero Prime SP",
-            "New Balance MD-X",
-            "Puma evoSPEED Sprint"
-        ],
-        "racing_flats": [
-            "Nike Zoom Victory",
-            "Adidas Adizero Takumi Sen",
-            "Saucony Endorphin Pro"
-        ]
-    }
-    
     # Return suggestions for equipment type, excluding current brand if possible
-    all_suggestions = suggestions.get(equipment_type, [])
-    return [s for s in all_suggestions if current_brand.lower() not in s.lower()][:3]
+    brand_lc = current_brand.lower()
+    return [name for name, name_lc in _SUGGESTIONS_LC.get(equipment_type, ()) if brand_lc not in name_lc][:3]
 
 
 # Initialize tables on import
@@ -6,10 +6,29 @@ Handles cases where Azure App Service doesn't automatically resolve @Microsoft.K
 import os
 import re
 import logging
-from typing import Optional
+import functools
+import threading
+from types import MappingProxyType
+from typing import Dict, Iterable, Mapping, Optional
+
+try:
+    from azure.identity import DefaultAzureCredential
+    from azure.keyvault.secrets import SecretClient
+    _AZURE_AVAILABLE = True
+except ImportError:
+    _AZURE_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# One credential (cached AAD token) and one SecretClient (warm HTTPS session)
+# per vault, shared by every lookup
+_credential = None
+_clients: Dict[str, "SecretClient"] = {}
+_clients_lock = threading.Lock()
+
+_KV_PREFIX = "@Microsoft.KeyVault("
+_KV_RE = re.compile(r'@Microsoft\.KeyVault\(SecretUri=([^)]+)\)')
+
 def resolve_keyvault_reference(value: Optional[str]) -> Optional[str]:
     """
     Resolve Key Vault reference if it wasn't automatically resolved by App Service.
@@ -20,11 +39,11 @@ def resolve_keyvault_reference(value: Optional[str]) -> Optional[str]:
     Returns:
         Resolved secret value or original value if not a Key Vault reference
     """
-    if not value or not value.startswith("@Microsoft.KeyVault("):
+    if not value or not value.startswith(_KV_PREFIX):
         return value
     
     # Extract the secret URI from the reference
-    match = re.match(r'@Microsoft\.KeyVault\(SecretUri=([^)]+)\)', value)
+    match = _KV_RE.match(value)
     if not match:
         logger.error(f"Failed to parse Key Vault reference: {value}")
         return value
@@ -32,42 +51,56 @@ def resolve_keyvault_reference(value: Optional[str]) -> Optional[str]:
     secret_uri = match.group(1)
     logger.info(f"Resolving Key Vault reference: {secret_uri}")
     
-    try:
-        # Use Azure Identity to authenticate with managed identity
-        from azure.identity import DefaultAzureCredential
-        from azure.keyvault.secrets import SecretClient
-        
-        # Parse vault URL from secret URI (e.g., https://vault.vault.azure.net/secrets/secret-name/)
-        vault_match = re.match(r'(https://[^/]+)/', secret_uri)
-        if not vault_match:
-            logger.error(f"Failed to extract vault URL from: {secret_uri}")
-            return value
-        
-        vault_url = vault_match.group(1)
-        secret_name_match = re.match(r'https://[^/]+/secrets/([^/]+)', secret_uri)
-        if not secret_name_match:
-            logger.error(f"Failed to extract secret name from: {secret_uri}")
-            return value
-            
-        secret_name = secret_name_match.group(1)
-        
-        # Create credential and secret client
-        credential = DefaultAzureCredential()
-        client = SecretClient(vault_url=vault_url, credential=credential)
-        
-        # Retrieve the secret
-        secret = client.get_secret(secret_name)
-        logger.info(f"Successfully resolved Key Vault reference for: {secret_name}")
-        return secret.value
-        
-    except ImportError:
+    if not _AZURE_AVAILABLE:
         logger.error("azure-identity or azure-keyvault-secrets not installed")
         return value
+    
+    # e.g. https://vault.vault.azure.net/secrets/secret-name/ -> (vault URL, secret name)
+    vault_url, _, rest = secret_uri.partition("/secrets/")
+    secret_name = rest.split("/", 1)[0]
+    if not vault_url.startswith("https://") or not secret_name:
+        logger.error(f"Failed to extract vault URL and secret name from: {secret_uri}")
+        return value
+    
+    try:
+        return _fetch_secret(vault_url, secret_name)
     except Exception as e:
         logger.error(f"Failed to resolve Key Vault reference: {e}")
         return value
 
 
+@functools.lru_cache(maxsize=256)
+def _fetch_secret(vault_url: str, secret_name: str) -> str:
+    """
+    Fetch a secret from Key Vault, memoized per (vault, name).
+    
+    Failures raise and are not cached, so a transient error is retried on
+    the next lookup instead of pinning the unresolved reference.
+    """
+    secret = _get_secret_client(vault_url).get_secret(secret_name)
+    logger.info(f"Successfully resolved Key Vault reference for: {secret_name}")
+    return secret.value
+
+
+def _get_secret_client(vault_url: str) -> "SecretClient":
+    """Shared SecretClient for a vault, created on first use"""
+    global _credential
+    client = _clients.get(vault_url)
+    if client is None:
+        with _clients_lock:
+            if _credential is None:
+                _credential = DefaultAzureCredential(exclude_interactive_browser_credential=True)
+            client = _clients.get(vault_url)
+            if client is None:
+                client = _clients[vault_url] = SecretClient(vault_url=vault_url, credential=_credential)
+    return client
+
+
+def clear_keyvault_cache():
+    """Drop memoized secrets, e.g. after a secret has been rotated"""
+    _fetch_secret.cache_clear()
+
+
 def get_env_with_keyvault_resolution(key: str, default: Optional[str] = None) -> Optional[str]:
     """
     Get environment variable with automatic Key Vault reference resolution.
@@ -81,3 +114,19 @@ def get_env_with_keyvault_resolution(key: str, default: Optional[str] = None) ->
     """
     value = os.getenv(key, default)
     return resolve_keyvault_reference(value)
+
+
+def load_config(keys: Iterable[str]) -> Mapping[str, Optional[str]]:
+    """
+    Resolve a set of settings once and freeze them.
+    
+    Settings are fixed for the life of the process, so resolve them (Key Vault
+    included) at startup and read the returned read-only mapping afterwards.
+    
+    Args:
+        keys: Environment variable names
+        
+    Returns:
+        Read-only mapping of key -> resolved value (None when unset)
+    """
+    return MappingProxyType({key: get_env_with_keyvault_resolution(key) for key in keys})
@@ -11,20 +11,25 @@ import requests
 from datetime import datetime, timezone, timedelta
 import json
 import base64
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from anyio import to_thread
 import stripe
 
 # Load environment variables
 load_dotenv()
 
 # Import production modules
-from src.auth_middleware import require_auth, optional_auth, require_roles
+from src.auth_middleware import require_auth, optional_auth, require_roles, AuthASGIMiddleware, revoked_tokens
 from src.observability import observability, ObservabilityMiddleware, logger, track_performance
 from src.database import (
-    db_pool, get_athlete_profile, get_user_subscription, update_user_subscription,
-    track_query_usage, get_monthly_usage, create_athlete_profile, update_athlete_profile,
+    db_pool, get_athlete_profile, update_user_subscription,
+    track_query_usage, create_athlete_profile, update_athlete_profile,
     delete_athlete_profile, update_athlete_mood, get_knowledge_items, get_knowledge_item_by_id,
     create_knowledge_item, update_knowledge_item, delete_knowledge_item, search_knowledge_items,
-    get_coach_athletes, link_coach_athlete, unlink_coach_athlete, get_query_usage_details
+    get_coach_athletes, link_coach_athlete, unlink_coach_athlete, iter_query_usage_details,
+    aget_athlete_profile, aget_user_subscription, aget_monthly_usage
 )
 
 # Debug environment variables (you can remove this later)
@@ -75,13 +80,23 @@ from src.additional_endpoints import (
 )
 
 # Initialize Azure OpenAI client with Azure AD (Managed Identity)
-from src.keyvault_helper import get_env_with_keyvault_resolution
+from src.keyvault_helper import load_config
 from azure.identity import DefaultAzureCredential
 
+# Secrets and endpoints resolved once at startup (Key Vault references included)
+settings = load_config((
+    "AZURE_OPENAI_ENDPOINT",
+    "AZURE_OPENAI_KEY",
+    "OPENAI_API_KEY",
+    "AZURE_OPENAI_DEPLOYMENT",
+    "AZURE_OPENAI_DEPLOYMENT_NAME",
+    "STRIPE_SECRET_KEY",
+))
+
 # Initialize client with graceful fallback for testing
 try:
-    endpoint = get_env_with_keyvault_resolution("AZURE_OPENAI_ENDPOINT")
-    api_key = get_env_with_keyvault_resolution("AZURE_OPENAI_KEY") or get_env_with_keyvault_resolution("OPENAI_API_KEY")
+    endpoint = settings["AZURE_OPENAI_ENDPOINT"]
+    api_key = settings["AZURE_OPENAI_KEY"] or settings["OPENAI_API_KEY"]
     if endpoint:
         if api_key:
             # Use API key authentication (faster, no RBAC propagation delay)
@@ -100,7 +115,7 @@ try:
                 azure_ad_token_provider=lambda: credential.get_token("https://cognitiveservices.azure.com/.default").token,
                 api_version="2024-02-15-preview"
             )
-        AZURE_OPENAI_DEPLOYMENT = get_env_with_keyvault_resolution("AZURE_OPENAI_DEPLOYMENT") or get_env_with_keyvault_resolution("AZURE_OPENAI_DEPLOYMENT_NAME")
+        AZURE_OPENAI_DEPLOYMENT = settings["AZURE_OPENAI_DEPLOYMENT"] or settings["AZURE_OPENAI_DEPLOYMENT_NAME"]
         logger.info(f"Azure OpenAI initialized: endpoint={endpoint}, deployment={AZURE_OPENAI_DEPLOYMENT}")
 
         # Initialize async client for streaming
@@ -138,7 +153,7 @@ def ensure_ai_available():
 
 # Initialize Stripe with graceful fallback
 try:
-    stripe_key = get_env_with_keyvault_resolution("STRIPE_SECRET_KEY")
+    stripe_key = settings["STRIPE_SECRET_KEY"]
     if stripe_key:
         stripe.api_key = stripe_key
     else:
@@ -149,16 +164,35 @@ except Exception as e:
 # Allowed origins for TrackLit integration
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "https://tracklit.app,https://www.tracklit.app,https://api.tracklit.app").split(",")
 
+# Worker threads for blocking work (sync endpoints, psycopg2 calls offloaded
+# with asyncio.to_thread). anyio defaults to 40, asyncio to min(32, cpus + 4)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Size the worker thread pools and start the revoked-token sync before serving requests"""
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREADPOOL_SIZE, thread_name_prefix="aria-worker")
+    )
+    # SCAN + pub/sub thread; off the loop since the prime is a Redis round trip
+    await asyncio.to_thread(revoked_tokens.start)
+    yield
+
 # FastAPI app instance
 app = FastAPI(
     title="Aria API",
     description="AI-powered running coach API integrated with TrackLit platform",
-    version="0.2.0"
+    version="0.2.0",
+    lifespan=lifespan
 )
 
 # Add observability middleware first (for request/response logging)
 app.add_middleware(ObservabilityMiddleware)
 
+# Capture credentials at the ASGI layer; verified lazily by require_auth/optional_auth
+app.add_middleware(AuthASGIMiddleware)
+
 # Add CORS middleware with restricted origins for production
 app.add_middleware(
     CORSMiddleware,
@@ -168,21 +202,6 @@ app.add_middleware(
     allow_headers=["Authorization", "Content-Type", "X-API-Key"],
 )
 
-# Middleware to parse JSON body for rate limiting
-@app.middleware("http")
-async def parse_json_body(request: Request, call_next):
-    """Middleware to parse JSON body for rate limiting"""
-    if request.headers.get("content-type") == "application/json":
-        try:
-            body = await request.body()
-            if body:
-                request._json_body = json.loads(body.decode())
-        except:
-            pass
-    
-    response = await call_next(request)
-    return response
-
 # Include companion feature routers
 app.include_router(companion_router, prefix="/api/v1", tags=["Companion Features"])
 
@@ -523,7 +542,7 @@ async def track_usage_internal(user_id: str, endpoint: str, tokens_consumed: int
     """Internal function to track usage"""
     try:
         # Use database.py function instead of Supabase REST API
-        track_query_usage(user_id)
+        track_query_usage(user_id, endpoint, tokens_consumed)
         logger.info(f"Usage tracked for user {user_id}", endpoint=endpoint, tokens=tokens_consumed)
     except Exception as e:
         logger.error(f"Usage tracking error: {e}", user_id=user_id)
@@ -538,8 +557,8 @@ async def get_subscription_status(request: Request, user_id: str):
     """Get user's current subscription status and usage"""
     try:
         # Use database.py functions instead of Supabase
-        subscription = get_user_subscription(user_id)
-        monthly_usage = get_monthly_usage(user_id)
+        subscription = await aget_user_subscription(user_id)
+        monthly_usage = await aget_monthly_usage(user_id)
         
         if subscription:
             tier = subscription.get("tier", "free")
@@ -631,7 +650,7 @@ async def upgrade_subscription(request: Request, upgrade_req: SubscriptionUpgrad
             stripe_customer_id=update_data.get("stripe_customer_id")
         )
         
-        cache.delete(f"subscription:{upgrade_req.user_id}")
+        rate_limiter.invalidate_subscription(upgrade_req.user_id)
         
         return {
             "message": f"Successfully upgraded to {upgrade_req.new_tier} tier",
@@ -646,48 +665,55 @@ async def upgrade_subscription(request: Request, upgrade_req: SubscriptionUpgrad
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/usage/monthly/{user_id}")
-@apply_rate_limit("general")
-async def get_monthly_usage(request: Request, user_id: str):
-    """Get detailed monthly usage breakdown"""
-    try:
-        current_usage = rate_limiter.get_monthly_usage(user_id)
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=30)
-        
-        # Get detailed usage from database
-        usage_data = get_query_usage_details(user_id, start_date.isoformat(), end_date.isoformat())
+def _summarize_monthly_usage(user_id: str) -> dict:
+    """Blocking body of get_monthly_usage: the DB reads and the aggregation"""
+    current_usage = rate_limiter.get_monthly_usage(user_id)
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=30)
+    
+    # Get detailed usage from database
+    usage_data = iter_query_usage_details(user_id, start_date.isoformat(), end_date.isoformat())
+    
+    usage_details = []
+    queries_by_type = {}
+    daily_usage = {}
+    
+    for record in usage_data:
+        endpoint = record.get("endpoint", "unknown")
+        date = record.get("query_timestamp", "")[:10]
         
-        usage_details = []
-        queries_by_type = {}
-        daily_usage = {}
+        queries_by_type[endpoint] = queries_by_type.get(endpoint, 0) + 1
+        daily_usage[date] = daily_usage.get(date, 0) + 1
         
-        for record in usage_data:
-            endpoint = record.get("endpoint", "unknown")
-            date = record.get("query_timestamp", "")[:10]
-            
-            queries_by_type[endpoint] = queries_by_type.get(endpoint, 0) + 1
-            daily_usage[date] = daily_usage.get(date, 0) + 1
-            
+        # Only the 50 most recent are returned; don't hold the rest
+        if len(usage_details) < 50:
             usage_details.append({
                 "date": record.get("query_timestamp"),
                 "endpoint": endpoint,
                 "tokens_consumed": record.get("tokens_consumed", 0)
             })
-        
-        daily_usage_list = [
-            {"date": date, "queries": count}
-            for date, count in sorted(daily_usage.items(), reverse=True)
-        ]
-        
-        return {
-            "user_id": user_id,
-            "current_month": datetime.now().strftime("%Y-%m"),
-            "total_queries": current_usage,
-            "queries_by_type": queries_by_type,
-            "daily_usage": daily_usage_list[:7],
-            "usage_details": usage_details[:50]
-        }
+    
+    daily_usage_list = [
+        {"date": date, "queries": count}
+        for date, count in sorted(daily_usage.items(), reverse=True)
+    ]
+    
+    return {
+        "user_id": user_id,
+        "current_month": datetime.now().strftime("%Y-%m"),
+        "total_queries": current_usage,
+        "queries_by_type": queries_by_type,
+        "daily_usage": daily_usage_list[:7],
+        "usage_details": usage_details[:50]
+    }
+
+@app.get("/usage/monthly/{user_id}")
+@apply_rate_limit("general")
+async def get_monthly_usage(request: Request, user_id: str):
+    """Get detailed monthly usage breakdown"""
+    try:
+        # The usage cursor is a blocking generator; drain it off the event loop
+        return await asyncio.to_thread(_summarize_monthly_usage, user_id)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -770,7 +796,7 @@ async def cancel_subscription(request: Request, user_data: dict):
             status="cancelled"
         )
         
-        cache.delete(f"subscription:{user_id}")
+        rate_limiter.invalidate_subscription(user_id)
         
         return {
             "message": "Subscription cancelled successfully",
@@ -947,7 +973,7 @@ async def ask_aria_stream(request: Request, req: AskRequest):
 @apply_rate_limit("ask_media")
 async def ask_media(request: Request, user_id: str = Form(...), user_input: str = Form(...), file: UploadFile = File(...)):
     try:
-        user = get_athlete_profile(user_id)
+        user = await aget_athlete_profile(user_id)
         mood = user.get("mood", "neutral")
         tone_instruction = COACH_MODES.get(user.get("coach_mode", "supportive"), COACH_MODES["supportive"])
 
@@ -1001,7 +1027,7 @@ Badges: {user.get('badges', [])}
 @apply_rate_limit("generate_plan")
 async def generate_plan(request: Request, req: PlanRequest):
     try:
-        user = get_athlete_profile(req.user_id)
+        user = await aget_athlete_profile(req.user_id)
 
         context = f"""
 Name: {user['name']}
@@ -1039,7 +1065,7 @@ Competition Date: {req.competition_date}
 async def ask_aria_enhanced(request: Request, req: AskRequest):
     """Enhanced AI consultation that includes wearable device data in analysis"""
     try:
-        user = get_athlete_profile(req.user_id)
+        user = await aget_athlete_profile(req.user_id)
         
         base_context = f"""
 Name: {user['name']}
@@ -1143,7 +1169,7 @@ async def create_user(request: Request, user: UserCreate):
 async def get_user(request: Request, user_id: str):
     """Get user profile"""
     try:
-        user = get_athlete_profile(user_id)
+        user = await aget_athlete_profile(user_id)
         return user
     except HTTPException:
         raise
@@ -1187,7 +1213,7 @@ async def delete_user(request: Request, user_id: str):
             raise HTTPException(status_code=404, detail="User not found")
 
         cache.delete(f"athlete_profile:{user_id}")
-        cache.delete(f"subscription:{user_id}")
+        rate_limiter.invalidate_subscription(user_id)
         cache.clear_pattern(f"wearable_*:{user_id}:*")
 
         return {"message": "User deleted successfully"}
@@ -1482,7 +1508,7 @@ async def get_training_readiness(request: Request, user_id: str):
         if not daily_data.get("success"):
             raise HTTPException(status_code=404, detail="No wearable data found")
         
-        user = get_athlete_profile(user_id)
+        user = await aget_athlete_profile(user_id)
         
         wearable_insights = daily_data.get("training_insights", {})
         sleep_data = daily_data.get("sleep", {})
@@ -0,0 +1,24 @@
+"""
+Schema migrations for Aria's own tables
+Run once per deployment, before the workers start:
+
+    python -m src.migrate
+"""
+import logging
+import sys
+
+from src.database import run_migrations
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main() -> int:
+    try:
+        run_migrations()
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,49 +1,97 @@
 # rate_limit.py
+import os
+import re
+import asyncio
 import time
 import json
 import functools
-from typing import Optional, Dict, Any
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Tuple, Callable
 from fastapi import Request, HTTPException
+from pydantic import BaseModel
 from src.cache import cache
 import logging
 from datetime import datetime, timedelta
-from src.database import get_user_subscription, get_monthly_usage, track_query_usage as db_track_query_usage
+from src.auth_middleware import principal_from_scope
+from src.database import (
+    TTLCache, get_user_subscription, get_monthly_usage, forget_cached_subscription
+)
 
 logger = logging.getLogger(__name__)
 
+# Per-worker L1 in front of Redis; subscriptions change rarely, usage often
+SUBSCRIPTION_L1_TTL = int(os.getenv("SUBSCRIPTION_L1_TTL", "60"))
+USAGE_L1_TTL = int(os.getenv("USAGE_L1_TTL", "10"))
+RATE_LIMIT_L1_MAX_ENTRIES = int(os.getenv("RATE_LIMIT_L1_MAX_ENTRIES", "10000"))
+
+# Seconds a computed get_user_rate_limit_summary result is reused
+RATE_LIMIT_SUMMARY_TTL = int(os.getenv("RATE_LIMIT_SUMMARY_TTL", "5"))
+
+# AI endpoints whose allowed requests count against the monthly quota
+USAGE_COUNTED_ENDPOINTS = frozenset({"ask", "ask_media", "generate_plan", "training_readiness"})
+
+# Redis pub/sub channel carrying user ids whose subscription changed
+SUB_INVALIDATE_CHANNEL = "sub_invalidate"
+
+# [start of next month (epoch seconds), "YYYY-MM"] for the current local month
+_month_cache = [0.0, ""]
+
+def _current_month() -> str:
+    """Current "YYYY-MM", reformatted only when the month rolls over"""
+    now = time.time()
+    if now >= _month_cache[0]:
+        today = datetime.fromtimestamp(now)
+        next_month = (today.replace(day=1) + timedelta(days=32)).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0
+        )
+        _month_cache[:] = [next_month.timestamp(), today.strftime("%Y-%m")]
+    return _month_cache[1]
+
+# User id in the path after one of these segments (ids are longer than 10 chars)
+_CLIENT_ID_PATH_RE = re.compile(r"/(?:user|subscription|usage|wearables)/([^/]{11,})")
+
 class RateLimiter:
     """Enhanced rate limiting system with subscription tier management for Aria API"""
     
     def __init__(self):
         self.cache = cache
+        self._sub_l1 = TTLCache(RATE_LIMIT_L1_MAX_ENTRIES, SUBSCRIPTION_L1_TTL)
+        self._usage_l1 = TTLCache(RATE_LIMIT_L1_MAX_ENTRIES, USAGE_L1_TTL)
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
     
-    def _get_client_id(self, request: Request) -> str:
-        """Get client identifier from request"""
-        # Try to get user_id from request body (for authenticated requests)
-        if hasattr(request, '_json_body'):
-            body = request._json_body
-            if isinstance(body, dict) and 'user_id' in body:
-                return f"user:{body['user_id']}"
-        
-        # Try to get user_id from form data (for file uploads)
-        if hasattr(request, '_form_data'):
-            form_data = request._form_data
-            if isinstance(form_data, dict) and 'user_id' in form_data:
-                return f"user:{form_data['user_id']}"
-        
-        # Try to get user_id from path parameters
-        if hasattr(request, 'path_params'):
-            if 'user_id' in request.path_params:
-                return f"user:{request.path_params['user_id']}"
-        
-        # Try to extract from URL path
-        path_segments = request.url.path.split('/')
-        for i, segment in enumerate(path_segments):
-            if segment in ['user', 'subscription', 'usage', 'wearables'] and i + 1 < len(path_segments):
-                # Check if next segment looks like a user ID (UUID pattern or similar)
-                potential_user_id = path_segments[i + 1]
-                if len(potential_user_id) > 10:  # Simple check for user ID length
-                    return f"user:{potential_user_id}"
+    def _get_client_id(self, request: Request, user_id: Optional[str] = None) -> str:
+        """
+        Get client identifier from request
+        
+        Per-user limits are keyed on the principal the request authenticated
+        as. A user_id the client sends (body, form, path or URL) is only a
+        claim: it is used when it matches that principal, or when a trusted
+        service (API key) acts on a user's behalf. Anything else falls back
+        to the IP, so unauthenticated callers can't mint fresh windows or
+        spend another user's quota.
+        
+        Args:
+            request: FastAPI request object
+            user_id: User id already parsed by FastAPI from the body, form or
+                path (see apply_rate_limit)
+        """
+        principal = principal_from_scope(request)
+        if principal:
+            claimed = user_id or request.path_params.get('user_id')
+            if not claimed:
+                match = _CLIENT_ID_PATH_RE.search(request.url.path)
+                claimed = match.group(1) if match else None
+            
+            if principal.get("role") == "system":
+                if claimed:
+                    return f"user:{claimed}"
+            elif principal.get("user_id") and (not claimed or str(claimed) == str(principal["user_id"])):
+                return f"user:{principal['user_id']}"
         
         # Fall back to IP address
         forwarded_for = request.headers.get("X-Forwarded-For")
@@ -60,21 +108,117 @@ class RateLimiter:
     
     def _get_monthly_usage_key(self, user_id: str) -> str:
         """Generate Redis key for monthly usage tracking"""
-        current_month = datetime.now().strftime("%Y-%m")
-        return f"monthly_usage:{user_id}:{current_month}"
+        return f"monthly_usage:{user_id}:{_current_month()}"
     
-    def _get_current_window(self, window_size: int) -> int:
+    def _seconds_until_month_end(self) -> int:
+        """Seconds left until the monthly usage key rolls over"""
+        _current_month()
+        return max(int(_month_cache[0] - time.time()) + 1, 1)
+    
+    def _get_current_window(self, window_size: int, now: Optional[float] = None) -> int:
         """Get current time window"""
-        return int(time.time()) // window_size
+        if now is None:
+            now = time.time()
+        return int(now) // window_size
+    
+    def _start_invalidation_listener(self):
+        """Subscribe this worker to SUB_INVALIDATE_CHANNEL (once per process)"""
+        if self._listener_pid == os.getpid() or self.cache.redis is None:
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            # Tried once per process; without it L1 entries just age out
+            self._listener_pid = os.getpid()
+            try:
+                pubsub = self.cache.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{SUB_INVALIDATE_CHANNEL: self._on_invalidate})
+                pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+            except Exception as e:
+                logger.warning(f"Subscription invalidation listener not started: {e}")
+    
+    def _on_invalidate(self, message: Dict[str, Any]):
+        """Drop a user's subscription from this worker's in-process caches"""
+        user_id = message.get("data")
+        self._sub_l1.pop(user_id)
+        forget_cached_subscription(user_id)
+    
+    def invalidate_subscription(self, user_id: str):
+        """
+        Drop a user's cached subscription in Redis and in every worker
+        
+        Call after any subscription write.
+        """
+        self._sub_l1.pop(user_id)
+        forget_cached_subscription(user_id)
+        self.cache.delete(f"subscription:{user_id}")
+        self.cache.delete(f"summary:{user_id}")
+        try:
+            if self.cache.redis is not None:
+                self.cache.redis.publish(SUB_INVALIDATE_CHANNEL, user_id)
+        except Exception as e:
+            logger.warning(f"Failed to publish subscription invalidation for {user_id}: {e}")
+    
+    def _after_fork_in_child(self):
+        """Forked children start with empty L1s and their own listener"""
+        self._sub_l1 = TTLCache(RATE_LIMIT_L1_MAX_ENTRIES, SUBSCRIPTION_L1_TTL)
+        self._usage_l1 = TTLCache(RATE_LIMIT_L1_MAX_ENTRIES, USAGE_L1_TTL)
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+    
+    def _get_or_fetch(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Single-flight: concurrent callers for the same key share one loader call
+        
+        The first caller runs `loader`; the rest wait on its Future and get the
+        same result (or exception), so a cold key costs one database query
+        instead of one per concurrent request.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            result = loader()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
     
     def get_user_subscription(self, user_id: str) -> Dict[str, Any]:
         """Get user subscription information from database with caching"""
+        self._start_invalidation_listener()
+        subscription = self._sub_l1.get(user_id)
+        if subscription is not None:
+            return subscription
+        
         cache_key = f"subscription:{user_id}"
         cached_subscription = self.cache.get(cache_key)
         
         if cached_subscription:
+            self._sub_l1.set(user_id, cached_subscription)
             return cached_subscription
         
+        return self._load_subscription(user_id)
+    
+    def _load_subscription(self, user_id: str) -> Dict[str, Any]:
+        """Fetch subscription from the database, coalescing concurrent misses"""
+        return self._get_or_fetch(f"sub:{user_id}", lambda: self._fetch_subscription(user_id))
+    
+    def _fetch_subscription(self, user_id: str) -> Dict[str, Any]:
+        """Fetch subscription from the database and repopulate the cache"""
+        cache_key = f"subscription:{user_id}"
         try:
             # Fetch from PostgreSQL using database.py
             subscription = get_user_subscription(user_id)
@@ -82,6 +226,7 @@ class RateLimiter:
             if subscription:
                 # Cache for 5 minutes
                 self.cache.set(cache_key, subscription, ttl=300)
+                self._sub_l1.set(user_id, subscription)
                 return subscription
             
             # Default to free tier if no subscription found
@@ -92,6 +237,7 @@ class RateLimiter:
                 "subscription_status": "active"
             }
             self.cache.set(cache_key, default_subscription, ttl=300)
+            self._sub_l1.set(user_id, default_subscription)
             return default_subscription
             
         except Exception as e:
@@ -108,41 +254,133 @@ class RateLimiter:
         """Get current month's query usage for user from database"""
         usage_key = self._get_monthly_usage_key(user_id)
         
-        # Try cache first
+        # Try the in-process cache, then Redis
+        cached_usage = self._usage_l1.get(usage_key)
+        if cached_usage is not None:
+            return cached_usage
+        
         cached_usage = self.cache.get(usage_key)
         if cached_usage is not None:
+            self._usage_l1.set(usage_key, cached_usage)
             return cached_usage
         
+        return self._load_monthly_usage(user_id)
+    
+    def _load_monthly_usage(self, user_id: str) -> int:
+        """Fetch monthly usage from the database, coalescing concurrent misses"""
+        return self._get_or_fetch(f"usage:{user_id}", lambda: self._fetch_monthly_usage(user_id))
+    
+    def _fetch_monthly_usage(self, user_id: str) -> int:
+        """Fetch monthly usage from the database and repopulate the cache"""
+        usage_key = self._get_monthly_usage_key(user_id)
+        
         # Fetch from database using database.py
         db_usage = get_monthly_usage(user_id)
         
-        # Cache for 1 minute
-        self.cache.set(usage_key, db_usage, ttl=60)
+        # Seed the month's running counter; increment_monthly_usage INCRs it
+        # from here on, so it lives until the month rolls over
+        self.cache.set(usage_key, db_usage, ttl=self._seconds_until_month_end())
+        self._usage_l1.set(usage_key, db_usage)
         
         return db_usage
     
-    def increment_monthly_usage(self, user_id: str) -> int:
-        """Increment monthly usage counter in database and cache"""
-        # Track in database
-        db_track_query_usage(user_id)
+    def increment_monthly_usage(self, user_id: str) -> Optional[int]:
+        """
+        Count one query against the cached monthly usage
+        
+        Only the Redis and in-process counts are bumped, with a single INCR
+        that keeps the key's end-of-month expiry; the query_usage row itself
+        is recorded (with tokens) by the endpoint via track_query_usage, which
+        buffers and batch-writes it. A count that isn't cached is left alone
+        and seeded from the database on the next lookup.
         
-        # Update cache
+        Returns:
+            The new cached count, or None if it wasn't cached
+        """
         usage_key = self._get_monthly_usage_key(user_id)
-        new_usage = self.get_monthly_usage(user_id)  # This will fetch fresh from DB
+        new_usage = self.cache.incr_if_exists(usage_key)
+        
+        if new_usage is None:
+            cached_usage = self._usage_l1.get(usage_key)
+            if cached_usage is not None:
+                new_usage = cached_usage + 1
+        if new_usage is not None:
+            self._usage_l1.set(usage_key, new_usage)
         
         return new_usage
     
-    def check_subscription_limit(self, user_id: str, endpoint: str) -> Dict[str, Any]:
-        """Check if user is within their subscription tier limits"""
-        subscription = self.get_user_subscription(user_id)
+    def _increment_monthly_usage_later(self, user_id: str):
+        """Run increment_monthly_usage off the event loop when called from one"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Plain sync caller (already off the loop)
+            self.increment_monthly_usage(user_id)
+            return
+        loop.run_in_executor(None, self.increment_monthly_usage, user_id)
+    
+    def _prefetch(self, user_id: str) -> Tuple[Dict[str, Any], int]:
+        """
+        Read the cached subscription and monthly usage in one MGET round trip
+        
+        The in-process L1 is consulted first and only its misses go to Redis;
+        only Redis misses fall back to the database.
+        
+        Returns:
+            Tuple of (subscription, monthly_usage)
+        """
+        self._start_invalidation_listener()
+        usage_key = self._get_monthly_usage_key(user_id)
+        subscription = self._sub_l1.get(user_id)
+        monthly_usage = self._usage_l1.get(usage_key)
+        
+        missing = []
+        if subscription is None:
+            missing.append(f"subscription:{user_id}")
+        if monthly_usage is None:
+            missing.append(usage_key)
+        fetched = dict(zip(missing, self.cache.get_many(missing)))
+        
+        if subscription is None:
+            subscription = fetched.get(f"subscription:{user_id}")
+            if subscription:
+                self._sub_l1.set(user_id, subscription)
+        if monthly_usage is None:
+            monthly_usage = fetched.get(usage_key)
+            if monthly_usage is not None:
+                self._usage_l1.set(usage_key, monthly_usage)
+        
+        if not subscription:
+            subscription = self._load_subscription(user_id)
+        if monthly_usage is None:
+            monthly_usage = self._load_monthly_usage(user_id)
+        
+        return subscription, monthly_usage
+    
+    def check_subscription_limit(
+        self,
+        user_id: str,
+        endpoint: str,
+        subscription: Optional[Dict[str, Any]] = None,
+        monthly_usage: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Check if user is within their subscription tier limits
+        
+        Args:
+            user_id: User identifier
+            endpoint: Endpoint identifier
+            subscription: Already-fetched subscription (looked up if None)
+            monthly_usage: Already-fetched monthly usage (looked up if None)
+        """
+        if subscription is None:
+            subscription = self.get_user_subscription(user_id)
         tier = subscription.get("tier", "free")
-        monthly_usage = self.get_monthly_usage(user_id)
+        if monthly_usage is None:
+            monthly_usage = self.get_monthly_usage(user_id)
         
         # Get limits for this tier and endpoint
-        tier_limits = SUBSCRIPTION_LIMITS.get(tier, SUBSCRIPTION_LIMITS["free"])
-        endpoint_limits = tier_limits.get(endpoint, tier_limits.get("default", {}))
-        
-        monthly_limit = endpoint_limits.get("monthly_queries", 1)
+        monthly_limit = _get_limits(tier, endpoint).monthly_limit
         
         # Check monthly limit (unlimited = -1)
         if monthly_limit != -1 and monthly_usage >= monthly_limit:
@@ -168,7 +406,8 @@ class RateLimiter:
         request: Request, 
         endpoint: str, 
         max_requests: int = None, 
-        window_seconds: int = 60
+        window_seconds: int = 60,
+        user_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Enhanced rate limiting with subscription tier support
@@ -178,6 +417,7 @@ class RateLimiter:
             endpoint: Endpoint identifier
             max_requests: Override for max requests (uses tier limits if None)
             window_seconds: Time window in seconds
+            user_id: User id from the endpoint's parsed parameters, if any
         
         Returns:
             Dictionary with rate limit status
@@ -193,72 +433,97 @@ class RateLimiter:
             }
         
         try:
-            client_id = self._get_client_id(request)
-            current_window = self._get_current_window(window_seconds)
+            now = int(time.time())
+            client_id = self._get_client_id(request, user_id)
+            current_window = self._get_current_window(window_seconds, now)
             
             # For authenticated users, check subscription limits first
             if client_id.startswith("user:"):
                 user_id = client_id.split(":", 1)[1]
                 
                 # Check subscription-based monthly limits
-                subscription_check = self.check_subscription_limit(user_id, endpoint)
+                subscription, monthly_usage = self._prefetch(user_id)
+                subscription_check = self.check_subscription_limit(
+                    user_id, endpoint, subscription=subscription, monthly_usage=monthly_usage
+                )
                 if not subscription_check["allowed"]:
                     return subscription_check
                 
-                # Get tier-specific rate limits
+                # Get tier-specific rate limits; the hour/day limits are
+                # enforced alongside the per-minute one when configured
                 tier = subscription_check["tier"]
-                tier_limits = SUBSCRIPTION_LIMITS.get(tier, SUBSCRIPTION_LIMITS["free"])
-                endpoint_config = tier_limits.get(endpoint, tier_limits.get("default", {}))
-                effective_limit = endpoint_config.get("rate_per_minute", 1)
+                limits = _get_limits(tier, endpoint)
+                effective_limit = limits.rate_per_minute
+                extra_windows = [
+                    (size, limit)
+                    for size, limit in ((3600, limits.rate_per_hour), (86400, limits.rate_per_day))
+                    if limit is not None and limit >= 0
+                ]
                 
             else:
                 # For unauthenticated requests, use default limits
                 effective_limit = max_requests or RATE_LIMITS.get(endpoint, {}).get("max_requests", 10)
+                extra_windows = []
             
-            # Redis key for this client/endpoint/window
-            rate_key = self._get_rate_limit_key(client_id, endpoint, str(current_window))
+            # (key, ttl, limit, reset_time) per window; the primary window
+            # keeps the plain rate_limit:{client}:{endpoint}:{window} key
+            windows = [(
+                self._get_rate_limit_key(client_id, endpoint, str(current_window)),
+                window_seconds * 2,
+                effective_limit,
+                (current_window + 1) * window_seconds
+            )]
+            for size, limit in extra_windows:
+                index = now // size
+                windows.append((
+                    self._get_rate_limit_key(client_id, endpoint, f"{size}:{index}"),
+                    size * 2,
+                    limit,
+                    (index + 1) * size
+                ))
             
-            # Get current count
-            current_count = self.cache.get(rate_key)
-            if current_count is None:
-                current_count = 0
+            # Check and count every window in one atomic round trip; a
+            # rejected request increments nothing
+            outcome = self.cache.incr_windows(
+                [window[0] for window in windows],
+                [window[1] for window in windows],
+                [window[2] for window in windows]
+            )
+            if outcome is None:
+                raise RuntimeError("rate limit counter unavailable")
             
             # Check if rate limit exceeded
-            if current_count >= effective_limit:
-                reset_time = (current_window + 1) * window_seconds
-                retry_after = reset_time - int(time.time())
+            if not outcome[0]:
+                _, blocked, blocked_count = outcome
+                reset_time = windows[blocked - 1][3]
+                retry_after = reset_time - now
                 
                 return {
                     "allowed": False,
                     "reason": "rate_limit_exceeded",
-                    "requests_made": current_count,
+                    "requests_made": blocked_count,
                     "requests_remaining": 0,
                     "reset_time": reset_time,
                     "retry_after": max(retry_after, 1)
                 }
             
-            # Increment counter
-            new_count = current_count + 1
-            self.cache.set(rate_key, new_count, ttl=window_seconds * 2)
-            
-            # For authenticated users with AI endpoints, increment monthly usage
-            if client_id.startswith("user:") and endpoint in ["ask", "ask_media", "generate_plan", "training_readiness"]:
-                user_id = client_id.split(":", 1)[1]
-                self.increment_monthly_usage(user_id)
-            
-            reset_time = (current_window + 1) * window_seconds
+            new_count = outcome[2]
             
             result = {
                 "allowed": True,
                 "requests_made": new_count,
                 "requests_remaining": effective_limit - new_count,
-                "reset_time": reset_time,
+                "reset_time": windows[0][3],
                 "retry_after": None
             }
             
             # Add subscription info for authenticated users
             if client_id.startswith("user:"):
                 result.update(subscription_check)
+                
+                # For AI endpoints, count the query without holding up the response
+                if endpoint in USAGE_COUNTED_ENDPOINTS:
+                    self._increment_monthly_usage_later(user_id)
             
             return result
             
@@ -273,6 +538,19 @@ class RateLimiter:
                 "error": str(e)
             }
     
+    async def acheck_rate_limit(
+        self,
+        request: Request,
+        endpoint: str,
+        max_requests: int = None,
+        window_seconds: int = 60,
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Async check_rate_limit; its Redis and DB calls run in a worker thread"""
+        return await asyncio.to_thread(
+            self.check_rate_limit, request, endpoint, max_requests, window_seconds, user_id
+        )
+    
     def get_rate_limit_info(self, client_id: str, endpoint: str, window_seconds: int = 60) -> Dict[str, Any]:
         """Get current rate limit status for a client/endpoint"""
         if not self.cache.is_connected():
@@ -326,34 +604,42 @@ class RateLimiter:
             return 0
     
     def get_user_rate_limit_summary(self, user_id: str) -> Dict[str, Any]:
-        """Get comprehensive rate limit summary for a user"""
+        """
+        Get comprehensive rate limit summary for a user
+        
+        The computed summary is cached in Redis for RATE_LIMIT_SUMMARY_TTL
+        seconds so a polling client doesn't reach Postgres.
+        """
+        summary_key = f"summary:{user_id}"
+        cached_summary = self.cache.get(summary_key)
+        if cached_summary:
+            return cached_summary
+        
         try:
-            subscription = self.get_user_subscription(user_id)
-            monthly_usage = self.get_monthly_usage(user_id)
+            subscription, monthly_usage = self._prefetch(user_id)
             tier = subscription.get("tier", "free")
-            tier_limits = SUBSCRIPTION_LIMITS.get(tier, SUBSCRIPTION_LIMITS["free"])
+            limits_tier = tier if tier in SUBSCRIPTION_LIMITS else "free"
+            
+            limits = {}
+            for endpoint in _TIER_ENDPOINTS[limits_tier]:
+                cfg = _FLAT_LIMITS[(limits_tier, endpoint)]
+                unlimited = cfg.monthly_limit == -1
+                limits[endpoint] = {
+                    "monthly_limit": cfg.monthly_limit,
+                    "monthly_remaining": -1 if unlimited else cfg.monthly_limit - monthly_usage,
+                    "rate_per_minute": cfg.rate_per_minute,
+                    "unlimited": unlimited
+                }
             
             summary = {
                 "user_id": user_id,
                 "subscription_tier": tier,
                 "monthly_usage": monthly_usage,
-                "limits": {},
+                "limits": limits,
                 "status": "active" if subscription.get("subscription_status") == "active" else "inactive"
             }
             
-            # Add limits for each endpoint
-            for endpoint, config in tier_limits.items():
-                if endpoint != "default":
-                    monthly_limit = config.get("monthly_queries", -1)
-                    remaining = monthly_limit - monthly_usage if monthly_limit != -1 else -1
-                    
-                    summary["limits"][endpoint] = {
-                        "monthly_limit": monthly_limit,
-                        "monthly_remaining": remaining,
-                        "rate_per_minute": config.get("rate_per_minute", 1),
-                        "unlimited": monthly_limit == -1
-                    }
-            
+            self.cache.set(summary_key, summary, ttl=RATE_LIMIT_SUMMARY_TTL)
             return summary
             
         except Exception as e:
@@ -363,6 +649,8 @@ class RateLimiter:
 # Initialize global rate limiter
 rate_limiter = RateLimiter()
 
+os.register_at_fork(after_in_child=rate_limiter._after_fork_in_child)
+
 # Enhanced subscription tier limits configuration
 SUBSCRIPTION_LIMITS = {
     "free": {
@@ -444,6 +732,34 @@ SUBSCRIPTION_LIMITS = {
     }
 }
 
+# SUBSCRIPTION_LIMITS flattened to (tier, endpoint) -> limits once at import,
+# so the per-request lookup is a single dict hit; missing values fall back
+# to 1 (or None for the unenforced hour/day limits) as the nested lookups did
+_LimitCfg = namedtuple("_LimitCfg", "monthly_limit rate_per_minute rate_per_hour rate_per_day")
+
+_FLAT_LIMITS: Dict[Tuple[str, str], _LimitCfg] = {
+    (tier, endpoint): _LimitCfg(
+        config.get("monthly_queries", 1),
+        config.get("rate_per_minute", 1),
+        config.get("rate_per_hour"),
+        config.get("rate_per_day")
+    )
+    for tier, tier_limits in SUBSCRIPTION_LIMITS.items()
+    for endpoint, config in tier_limits.items()
+}
+
+# Each tier's endpoints, without its "default" entry
+_TIER_ENDPOINTS: Dict[str, Tuple[str, ...]] = {
+    tier: tuple(endpoint for endpoint in tier_limits if endpoint != "default")
+    for tier, tier_limits in SUBSCRIPTION_LIMITS.items()
+}
+
+def _get_limits(tier: str, endpoint: str) -> _LimitCfg:
+    """Limits for tier/endpoint; unknown tiers get free, unknown endpoints the tier default"""
+    if tier not in SUBSCRIPTION_LIMITS:
+        tier = "free"
+    return _FLAT_LIMITS.get((tier, endpoint)) or _FLAT_LIMITS[(tier, "default")]
+
 # Legacy rate limiting configurations (for backward compatibility and unauthenticated requests)
 RATE_LIMITS = {
     "ask": {"max_requests": 5, "window_seconds": 60},        # Conservative for unauthenticated
@@ -455,13 +771,40 @@ RATE_LIMITS = {
     "mood_report": {"max_requests": 10, "window_seconds": 60}, # Mood reports
 }
 
+def _user_id_from_params(params: Dict[str, Any]) -> Optional[str]:
+    """
+    User id from an endpoint's already-parsed parameters
+    
+    FastAPI has validated the body model / form fields / path by the time the
+    wrapper runs, so there's no need to re-read or re-parse the request body.
+    The result is client-supplied; _get_client_id only honours it when it
+    matches the authenticated principal.
+    """
+    user_id = params.get("user_id")
+    if user_id is None:
+        for value in params.values():
+            if isinstance(value, BaseModel):
+                user_id = getattr(value, "user_id", None)
+                if user_id is not None:
+                    break
+    return str(user_id) if user_id else None
+
+# Success-response header names, pre-encoded (raw header names are lowercase)
+_H_MADE = b"x-ratelimit-requests-made"
+_H_REMAINING = b"x-ratelimit-requests-remaining"
+_H_RESET = b"x-ratelimit-reset"
+_H_TIER = b"x-subscription-tier"
+_H_QUERIES_REMAINING = b"x-monthly-queries-remaining"
+
 def apply_rate_limit(endpoint: str):
     """Decorator to apply enhanced rate limiting with subscription support to endpoints"""
     def decorator(func):
         @functools.wraps(func)
         async def wrapper(request: Request, *args, **kwargs):
             # Check rate limit with subscription support
-            rate_status = rate_limiter.check_rate_limit(request, endpoint)
+            rate_status = await rate_limiter.acheck_rate_limit(
+                request, endpoint, user_id=_user_id_from_params(kwargs)
+            )
             
             # If not allowed, raise appropriate HTTP exception
             if not rate_status["allowed"]:
@@ -511,17 +854,29 @@ def apply_rate_limit(endpoint: str):
             # Execute the endpoint function
             response = await func(request, *args, **kwargs)
             
-            # Add rate limit headers to successful responses
-            if hasattr(response, 'headers'):
-                response.headers["X-RateLimit-Requests-Made"] = str(rate_status.get("requests_made", 0))
-                response.headers["X-RateLimit-Requests-Remaining"] = str(rate_status.get("requests_remaining", 0))
-                response.headers["X-RateLimit-Reset"] = str(rate_status.get("reset_time", int(time.time()) + 60))
+            # Add rate limit headers to successful responses; requests_made is
+            # 0 only on the no-Redis fallback, where the counts mean nothing
+            if rate_status.get("requests_made", 0) and hasattr(response, 'headers'):
+                headers = [
+                    (_H_MADE, rate_status["requests_made"]),
+                    (_H_REMAINING, rate_status.get("requests_remaining", 0)),
+                    (_H_RESET, rate_status.get("reset_time", int(time.time()) + 60))
+                ]
                 
                 # Add subscription info for authenticated users
                 if "tier" in rate_status:
-                    response.headers["X-Subscription-Tier"] = rate_status["tier"]
+                    headers.append((_H_TIER, rate_status["tier"]))
                     if "queries_remaining" in rate_status and rate_status["queries_remaining"] != -1:
-                        response.headers["X-Monthly-Queries-Remaining"] = str(rate_status["queries_remaining"])
+                        headers.append((_H_QUERIES_REMAINING, rate_status["queries_remaining"]))
+                
+                # Starlette responses keep their headers as a raw list of
+                # (bytes, bytes); appending skips the case-insensitive lookup
+                raw_headers = getattr(response, 'raw_headers', None)
+                if isinstance(raw_headers, list):
+                    raw_headers.extend((name, str(value).encode("latin-1")) for name, value in headers)
+                else:
+                    for name, value in headers:
+                        response.headers[name.decode("latin-1")] = str(value)
             
             return response
         
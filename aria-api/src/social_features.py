@@ -5,6 +5,7 @@ Athlete interactions, messaging, teams, and leaderboards
 from typing import Dict, Any, List, Optional
 import logging
 from datetime import datetime, timedelta
+from psycopg2.extras import Json
 from src.database import db_pool
 
 logger = logging.getLogger(__name__)
@@ -476,7 +477,7 @@ def post_activity(
                 INSERT INTO activity_feed (user_id, activity_type, activity_data, is_public)
                 VALUES (%s, %s, %s, %s)
                 RETURNING activity_id
-            """, (user_id, activity_type, json.dumps(activity_data), is_public))
+            """, (user_id, activity_type, Json(activity_data), is_public))
             
             activity_id = cursor.fetchone()[0]
             return {"success": True, "activity_id": activity_id}
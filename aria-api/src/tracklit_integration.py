@@ -14,6 +14,7 @@ from src.database import (
     get_user_subscription, update_user_subscription
 )
 from src.cache import cache
+from src.rate_limit import rate_limiter
 
 load_dotenv()
 
@@ -158,7 +159,7 @@ def sync_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
         
         # Clear cache for this user
         cache.delete(f"athlete_profile:{user_id}")
-        cache.delete(f"subscription:{user_id}")
+        rate_limiter.invalidate_subscription(user_id)
         
         return updated
         
@@ -364,7 +365,7 @@ def webhook_handler(event_type: str, payload: Dict[str, Any]) -> bool:
                 stripe_subscription_id=subscription_data.get("stripe_subscription_id"),
                 stripe_customer_id=subscription_data.get("stripe_customer_id")
             )
-            cache.delete(f"subscription:{user_id}")
+            rate_limiter.invalidate_subscription(user_id)
             logger.info(f"Updated subscription from webhook: {user_id}")
             return True
         
@@ -375,7 +376,7 @@ def webhook_handler(event_type: str, payload: Dict[str, Any]) -> bool:
                 tier="free",
                 status="cancelled"
             )
-            cache.delete(f"subscription:{user_id}")
+            rate_limiter.invalidate_subscription(user_id)
             logger.info(f"Cancelled subscription from webhook: {user_id}")
             return True
         
@@ -384,7 +385,7 @@ def webhook_handler(event_type: str, payload: Dict[str, Any]) -> bool:
             from src.database import delete_athlete_profile
             deleted = delete_athlete_profile(user_id)
             cache.delete(f"athlete_profile:{user_id}")
-            cache.delete(f"subscription:{user_id}")
+            rate_limiter.invalidate_subscription(user_id)
             logger.info(f"Deleted user from webhook: {user_id}")
             return deleted
         
@@ -15,5 +15,8 @@ echo "Directory contents:"
 ls -la "${APP_DIR}" | head -20
 echo "================================"
 
+# Create Aria's tables once here rather than on every worker import
+python -m src.migrate || echo "WARNING: database migrations failed"
+
 # Start uvicorn
 exec uvicorn src.main:app --host 0.0.0.0 --port 8000
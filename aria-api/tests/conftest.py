@@ -19,6 +19,10 @@ os.environ.setdefault("REDIS_PASSWORD", "")
 os.environ.setdefault("REDIS_DB", "0")
 os.environ.setdefault("ENVIRONMENT", "test")
 
+# Open the DB pool on first use, so modules import without a database and
+# tests that need one can skip
+os.environ.setdefault("ARIA_LAZY_POOL", "1")
+
 # Azure OpenAI credentials (will use from GitHub secrets if available)
 if "AZURE_OPENAI_API_KEY" not in os.environ:
     os.environ["AZURE_OPENAI_API_KEY"] = ""
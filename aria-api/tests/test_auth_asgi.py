@@ -0,0 +1,237 @@
+"""
+Tests for AuthASGIMiddleware, the verified-token cache and the
+revoked-token index (auth_middleware.py)
+"""
+import time
+import jwt
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from src import auth_middleware
+from src.auth_middleware import (
+    AuthASGIMiddleware, RevokedTokenIndex, principal_from_scope,
+    BLACKLIST_KEY_PREFIX, _token_cache_key, _verified_token_cache
+)
+
+SECRET = b"asgi-test-secret"
+
+
+class FakeRedis:
+    """Just enough Redis for cache.get/set and the revocation publish"""
+    
+    def __init__(self):
+        self.store = {}
+        self.gets = []
+    
+    def ping(self):
+        return True
+    
+    def get(self, key):
+        self.gets.append(key)
+        return self.store.get(key)
+    
+    def setex(self, key, ttl, value):
+        self.store[key] = value
+        return True
+    
+    def publish(self, channel, message):
+        return 0
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Fresh Redis, revoked-token index and token cache for each test"""
+    redis = FakeRedis()
+    monkeypatch.setattr(auth_middleware.cache, "redis", redis)
+    monkeypatch.setattr(auth_middleware, "revoked_tokens", RevokedTokenIndex())
+    monkeypatch.setattr(auth_middleware.auth_middleware, "_secret_bytes", SECRET)
+    _verified_token_cache.clear()
+    yield redis
+    _verified_token_cache.clear()
+
+
+@pytest.fixture
+def verify_calls(monkeypatch):
+    """Count full JWT verifications (calls that reach jwt.decode)"""
+    calls = []
+    decode = jwt.decode
+    
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+    
+    monkeypatch.setattr(auth_middleware.jwt, "decode", counting_decode)
+    return calls
+
+
+def make_token(user_id="athlete_1", expires_in=3600):
+    return jwt.encode(
+        {"user_id": user_id, "role": "athlete", "exp": int(time.time()) + expires_in},
+        SECRET,
+        algorithm="HS256"
+    )
+
+
+def make_client():
+    """App with one protected prefix and routes that do / don't read the principal"""
+    app = FastAPI()
+    
+    @app.get("/admin/ping")
+    async def admin_ping(request: Request):
+        return {"user_id": principal_from_scope(request)["user_id"]}
+    
+    @app.get("/whoami")
+    async def whoami(request: Request):
+        principal = principal_from_scope(request)
+        return {"user_id": principal["user_id"] if principal else None}
+    
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+    
+    app.add_middleware(AuthASGIMiddleware, protected_paths=("/admin",))
+    return TestClient(app)
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+class TestAuthASGIMiddleware:
+    """Test up-front rejection on protected paths and lazy verification elsewhere"""
+    
+    def test_protected_path_without_credentials_is_401(self, fake_redis):
+        """The middleware answers itself; the route never runs"""
+        response = make_client().get("/admin/ping")
+        
+        assert response.status_code == 401
+        assert response.headers["www-authenticate"] == "Bearer"
+        assert response.json() == {"detail": "Authentication required. Provide JWT token or API key."}
+    
+    def test_protected_path_with_bad_token_is_401(self, fake_redis):
+        """The verification error detail is passed through"""
+        response = make_client().get("/admin/ping", headers=bearer("not-a-jwt"))
+        
+        assert response.status_code == 401
+        assert response.json() == {"detail": "Invalid authentication token"}
+    
+    def test_protected_path_with_valid_token(self, fake_redis):
+        response = make_client().get("/admin/ping", headers=bearer(make_token("coach_7")))
+        
+        assert response.status_code == 200
+        assert response.json() == {"user_id": "coach_7"}
+    
+    def test_unread_credentials_are_never_verified(self, fake_redis, verify_calls):
+        """A route that doesn't ask for the principal costs no JWT check or Redis GET"""
+        response = make_client().get("/health", headers=bearer(make_token()))
+        
+        assert response.status_code == 200
+        assert verify_calls == []
+        assert fake_redis.gets == []
+    
+    def test_principal_from_scope_verifies_on_first_access(self, fake_redis, verify_calls):
+        response = make_client().get("/whoami", headers=bearer(make_token("athlete_9")))
+        
+        assert response.json() == {"user_id": "athlete_9"}
+        assert len(verify_calls) == 1
+    
+    def test_principal_from_scope_never_raises(self, fake_redis):
+        """Bad credentials outside protected paths read as no principal"""
+        response = make_client().get("/whoami", headers=bearer("not-a-jwt"))
+        
+        assert response.status_code == 200
+        assert response.json() == {"user_id": None}
+    
+    def test_principal_from_scope_without_middleware(self):
+        """A request that never passed through the middleware has no principal"""
+        request = Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+        
+        assert principal_from_scope(request) is None
+
+
+class TestVerifiedTokenCache:
+    """Test that caching verified tokens never outlives revocation or its TTL"""
+    
+    def test_repeat_token_skips_decode(self, fake_redis, verify_calls):
+        token = make_token()
+        auth_middleware.auth_middleware.verify_jwt_token(token)
+        auth_middleware.auth_middleware.verify_jwt_token(token)
+        
+        assert len(verify_calls) == 1
+    
+    def test_cached_token_rejected_after_local_revocation(self, fake_redis):
+        token = make_token()
+        auth_middleware.auth_middleware.verify_jwt_token(token)
+        
+        auth_middleware.auth_middleware.revoke_token(token)
+        
+        with pytest.raises(auth_middleware.HTTPException) as exc:
+            auth_middleware.auth_middleware.verify_jwt_token(token)
+        assert exc.value.status_code == 401
+        assert exc.value.detail == "Token has been revoked"
+    
+    def test_cached_token_rejected_after_revocation_elsewhere(self, fake_redis):
+        """Another replica's revocation (Redis key + pub/sub digest) beats this replica's cache"""
+        index = auth_middleware.revoked_tokens
+        index._ready = True
+        token = make_token()
+        auth_middleware.auth_middleware.verify_jwt_token(token)
+        
+        digest = _token_cache_key(token).hex()
+        fake_redis.store[BLACKLIST_KEY_PREFIX + digest] = "true"
+        index.add(digest)
+        
+        with pytest.raises(auth_middleware.HTTPException) as exc:
+            auth_middleware.auth_middleware.verify_jwt_token(token)
+        assert exc.value.detail == "Token has been revoked"
+    
+    def test_entry_expires_after_ttl(self, fake_redis, verify_calls, monkeypatch):
+        """Past TOKEN_CACHE_TTL_SECONDS the entry is dropped and the JWT decoded again"""
+        token = make_token()
+        auth_middleware.auth_middleware.verify_jwt_token(token)
+        assert _token_cache_key(token) in _verified_token_cache
+        
+        later = time.time() + auth_middleware.TOKEN_CACHE_TTL_SECONDS + 1
+        monkeypatch.setattr(auth_middleware.time, "time", lambda: later)
+        auth_middleware.auth_middleware.verify_jwt_token(token)
+        
+        assert len(verify_calls) == 2
+    
+    def test_entry_never_outlives_token_exp(self, fake_redis):
+        """A token expiring before the TTL is only cached until its exp"""
+        token = make_token(expires_in=5)
+        payload = auth_middleware.auth_middleware.verify_jwt_token(token)
+        key = _token_cache_key(token)
+        
+        assert auth_middleware._get_cached_token(key, payload["exp"] - 1) == payload
+        assert auth_middleware._get_cached_token(key, payload["exp"]) is None
+        assert key not in _verified_token_cache
+
+
+class TestRevokedTokenIndex:
+    """Test when the in-process index lets verification skip Redis"""
+    
+    def test_not_ready_index_falls_back_to_redis(self, fake_redis):
+        """Before the first scan every token is a "maybe" and Redis decides"""
+        token = make_token()
+        digest = _token_cache_key(token).hex()
+        fake_redis.store[BLACKLIST_KEY_PREFIX + digest] = "true"
+        
+        with pytest.raises(auth_middleware.HTTPException) as exc:
+            auth_middleware.auth_middleware.verify_jwt_token(token)
+        assert exc.value.detail == "Token has been revoked"
+        assert fake_redis.gets == [BLACKLIST_KEY_PREFIX + digest]
+    
+    def test_not_ready_index_accepts_unrevoked_token(self, fake_redis):
+        token = make_token()
+        
+        assert auth_middleware.auth_middleware.verify_jwt_token(token)["user_id"] == "athlete_1"
+        assert len(fake_redis.gets) == 1
+    
+    def test_ready_index_miss_skips_redis(self, fake_redis):
+        """Once primed, a digest outside the index never costs a GET"""
+        auth_middleware.revoked_tokens._ready = True
+        
+        auth_middleware.auth_middleware.verify_jwt_token(make_token())
+        
+        assert fake_redis.gets == []
@@ -0,0 +1,184 @@
+"""
+Tests for data_export.py: GDPR erasure
+"""
+import asyncio
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from src import data_export
+from src.database import db_cursor
+
+
+@pytest.fixture
+def erasure_tables(monkeypatch):
+    """
+    Two throwaway user-data tables (one keyed on user_id, one on a pair of
+    user columns like athlete_connections) standing in for the real list
+    """
+    try:
+        with db_cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS deletion_requests (
+                    request_id SERIAL PRIMARY KEY,
+                    user_id VARCHAR(255) NOT NULL,
+                    verification_code VARCHAR(255) NOT NULL,
+                    status VARCHAR(50) DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    completed_at TIMESTAMP
+                );
+                CREATE TABLE erasure_test_items (id SERIAL PRIMARY KEY, user_id VARCHAR(255));
+                CREATE TABLE erasure_test_links (follower_id VARCHAR(255), following_id VARCHAR(255));
+            """)
+    except Exception as e:
+        pytest.skip(f"Database not available: {e}")
+    
+    monkeypatch.setattr(data_export, "_USER_DATA_TABLES", ("erasure_test_items", "erasure_test_links"))
+    monkeypatch.setattr(data_export, "_USER_DATA_COLUMNS", {"erasure_test_links": ("follower_id", "following_id")})
+    monkeypatch.setattr(data_export, "_present_user_data_tables", None)
+    yield
+    with db_cursor() as cur:
+        cur.execute("DROP TABLE erasure_test_items, erasure_test_links")
+        cur.execute("DELETE FROM deletion_requests WHERE user_id LIKE %s", ("erasure_%",))
+
+
+def seed(user_id, other_id, code, requested_at=None):
+    """Rows for the user and for someone else, plus a pending deletion request"""
+    with db_cursor() as cur:
+        cur.execute(
+            "INSERT INTO erasure_test_items (user_id) VALUES (%s), (%s), (%s)",
+            (user_id, user_id, other_id)
+        )
+        cur.execute(
+            "INSERT INTO erasure_test_links VALUES (%s, %s), (%s, %s), (%s, 'erasure_third')",
+            (user_id, other_id, other_id, user_id, other_id)
+        )
+        cur.execute(
+            "INSERT INTO deletion_requests (user_id, verification_code, created_at) VALUES (%s, %s, %s)",
+            (user_id, code, requested_at or datetime.now())
+        )
+
+
+def row_counts(user_id):
+    """Rows left that reference the user, per table"""
+    with db_cursor() as cur:
+        cur.execute("SELECT count(*) FROM erasure_test_items WHERE user_id = %s", (user_id,))
+        items = cur.fetchone()[0]
+        cur.execute(
+            "SELECT count(*) FROM erasure_test_links WHERE follower_id = %s OR following_id = %s",
+            (user_id, user_id)
+        )
+        return {"erasure_test_items": items, "erasure_test_links": cur.fetchone()[0]}
+
+
+@pytest.fixture
+def users():
+    suffix = uuid.uuid4().hex[:12]
+    return f"erasure_{suffix}", f"erasure_other_{suffix}"
+
+
+@pytest.mark.database
+class TestDeleteUserData:
+    """Test the single-statement verify + delete"""
+    
+    def test_valid_code_deletes_and_counts(self, erasure_tables, users):
+        """A valid code removes every row matching the user, on any user column"""
+        user_id, other_id = users
+        seed(user_id, other_id, "code-ok")
+        
+        result = asyncio.run(data_export.delete_user_data(user_id, "code-ok"))
+        
+        assert result["success"]
+        assert result["deleted_counts"] == {"erasure_test_items": 2, "erasure_test_links": 2}
+        assert row_counts(user_id) == {"erasure_test_items": 0, "erasure_test_links": 0}
+        # The other user's own rows stay
+        assert row_counts(other_id) == {"erasure_test_items": 1, "erasure_test_links": 1}
+    
+    def test_wrong_code_deletes_nothing(self, erasure_tables, users):
+        """An unknown code fails and leaves the data alone"""
+        user_id, other_id = users
+        seed(user_id, other_id, "code-right")
+        
+        result = asyncio.run(data_export.delete_user_data(user_id, "code-wrong"))
+        
+        assert not result["success"]
+        assert row_counts(user_id) == {"erasure_test_items": 2, "erasure_test_links": 2}
+    
+    def test_expired_code_deletes_nothing(self, erasure_tables, users):
+        """A request older than 24 hours can't be confirmed"""
+        user_id, other_id = users
+        seed(user_id, other_id, "code-old", requested_at=datetime.now() - timedelta(hours=25))
+        
+        result = asyncio.run(data_export.delete_user_data(user_id, "code-old"))
+        
+        assert not result["success"]
+        assert row_counts(user_id) == {"erasure_test_items": 2, "erasure_test_links": 2}
+    
+    def test_code_is_single_use(self, erasure_tables, users):
+        """Replaying a completed request's code deletes nothing new"""
+        user_id, other_id = users
+        seed(user_id, other_id, "code-once")
+        assert asyncio.run(data_export.delete_user_data(user_id, "code-once"))["success"]
+        
+        with db_cursor() as cur:
+            cur.execute("INSERT INTO erasure_test_items (user_id) VALUES (%s)", (user_id,))
+        result = asyncio.run(data_export.delete_user_data(user_id, "code-once"))
+        
+        assert not result["success"]
+        assert row_counts(user_id)["erasure_test_items"] == 1
+    
+    def test_missing_table_is_skipped(self, erasure_tables, users, monkeypatch):
+        """A listed table that doesn't exist is left out of the statement"""
+        monkeypatch.setattr(
+            data_export, "_USER_DATA_TABLES",
+            ("erasure_test_items", "erasure_test_missing", "erasure_test_links")
+        )
+        user_id, other_id = users
+        seed(user_id, other_id, "code-missing")
+        
+        result = asyncio.run(data_export.delete_user_data(user_id, "code-missing"))
+        
+        assert result["success"]
+        assert result["deleted_counts"] == {"erasure_test_items": 2, "erasure_test_links": 2}
+        # Not cached while a table is missing, so a later migration is picked up
+        assert data_export._present_user_data_tables is None
+
+
+@pytest.fixture
+def export_version(monkeypatch):
+    """Stub the version query; set version["value"] or version["error"] per test"""
+    version = {"value": "1:100|0:0"}
+    
+    def fetch_all(query, params):
+        if "error" in version:
+            raise version["error"]
+        return [{"version": version["value"]}]
+    
+    monkeypatch.setattr(data_export, "_fetch_all", fetch_all)
+    return version
+
+
+class TestExportEtag:
+    """Test the export ETag derived from the version query"""
+    
+    def test_stable_while_unchanged(self, export_version):
+        first = asyncio.run(data_export.get_export_etag("7", "json"))
+        
+        assert first.startswith('W/"')
+        assert asyncio.run(data_export.get_export_etag("7", "json")) == first
+    
+    def test_changes_with_version(self, export_version):
+        before = asyncio.run(data_export.get_export_etag("7", "json"))
+        export_version["value"] = "1:100|1:-2291"
+        
+        assert asyncio.run(data_export.get_export_etag("7", "json")) != before
+    
+    def test_differs_per_format_and_user(self, export_version):
+        tag = asyncio.run(data_export.get_export_etag("7", "json"))
+        
+        assert asyncio.run(data_export.get_export_etag("7", "zip")) != tag
+        assert asyncio.run(data_export.get_export_etag("8", "json")) != tag
+    
+    def test_none_when_version_unavailable(self, export_version):
+        export_version["error"] = RuntimeError("connection refused")
+        
+        assert asyncio.run(data_export.get_export_etag("7", "json")) is None
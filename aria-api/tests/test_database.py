@@ -12,7 +12,7 @@ from database import (
     get_monthly_usage, get_query_usage_details, get_knowledge_items,
     get_knowledge_item_by_id, create_knowledge_item, update_knowledge_item,
     delete_knowledge_item, search_knowledge_items, get_coach_athletes,
-    link_coach_athlete, unlink_coach_athlete
+    link_coach_athlete, unlink_coach_athlete, link_coach_athletes_bulk
 )
 
 
@@ -397,6 +397,24 @@ class TestCoachAthleteRelationships:
         unlink_coach_athlete(coach_email, test_athlete_data["id"])
         delete_athlete_profile(test_athlete_data["id"])
     
+    def test_link_coach_athletes_bulk(self, test_db, test_athlete_data):
+        """Test linking several athletes to a coach at once"""
+        # Create athlete
+        create_athlete_profile(test_athlete_data)
+        
+        # Link to coach (repeated id is linked once)
+        coach_email = "coach_bulk@example.com"
+        linked = link_coach_athletes_bulk(
+            coach_email, [test_athlete_data["id"], test_athlete_data["id"]]
+        )
+        
+        assert len(linked) == 1
+        assert linked[0]["athlete_id"] == test_athlete_data["id"]
+        
+        # Cleanup
+        unlink_coach_athlete(coach_email, test_athlete_data["id"])
+        delete_athlete_profile(test_athlete_data["id"])
+    
     def test_get_coach_athletes(self, test_db, test_athlete_data):
         """Test retrieving coach's athletes"""
         # Create athlete
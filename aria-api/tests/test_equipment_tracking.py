@@ -0,0 +1,133 @@
+"""
+Tests for equipment_tracking.py: SQL-side health and analytics against
+their Python / multi-query originals
+"""
+import uuid
+import pytest
+from src import equipment_tracking
+from src.equipment_tracking import get_equipment_health, get_equipment_alerts
+from src.database import db_cursor
+
+
+@pytest.fixture
+def user_id():
+    """A throwaway equipment owner; skips when no database is reachable"""
+    try:
+        equipment_tracking.create_equipment_tables()
+    except Exception as e:
+        pytest.skip(f"Database not available: {e}")
+    user_id = f"equipment_test_{uuid.uuid4().hex[:12]}"
+    yield user_id
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM equipment WHERE user_id = %s", (user_id,))
+
+
+def insert_equipment(user_id, current_mileage, max_mileage, equipment_type="training_shoes",
+                     initial_mileage=0.0, status="active"):
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO equipment
+            (user_id, equipment_type, brand, model, purchase_date, initial_mileage, current_mileage, max_mileage, status)
+            VALUES (%s, %s, 'Brooks', 'Ghost', CURRENT_DATE, %s, %s, %s, %s)
+        """, (user_id, equipment_type, initial_mileage, current_mileage, max_mileage, status))
+
+
+def old_equipment_analytics(user_id):
+    """get_equipment_analytics as it was before the single JSON query"""
+    with db_cursor(dict_cursor=True) as cur:
+        cur.execute("""
+            SELECT
+                equipment_type,
+                COUNT(*) as count,
+                SUM(current_mileage - initial_mileage) as total_miles,
+                AVG(current_mileage - initial_mileage) as avg_miles_per_item
+            FROM equipment
+            WHERE user_id = %s
+            GROUP BY equipment_type
+        """, (user_id,))
+        equipment_stats = cur.fetchall()
+        
+        cur.execute("""
+            SELECT
+                e.equipment_id,
+                e.brand,
+                e.model,
+                e.equipment_type,
+                e.current_mileage - e.initial_mileage as total_miles
+            FROM equipment e
+            WHERE e.user_id = %s
+            ORDER BY (e.current_mileage - e.initial_mileage) DESC
+            LIMIT 5
+        """, (user_id,))
+        most_used = cur.fetchall()
+    
+    return {
+        "equipment_stats": [dict(stat) for stat in equipment_stats],
+        "most_used": [dict(item) for item in most_used],
+        "replacement_alerts": get_equipment_alerts(user_id),
+        "total_equipment": sum(stat["count"] for stat in equipment_stats)
+    }
+
+
+def by_type(stats):
+    return sorted(stats, key=lambda stat: stat["equipment_type"])
+
+
+@pytest.mark.database
+class TestHealthStatusSQL:
+    """Test that _HEALTH_STATUS_SQL agrees with get_equipment_health"""
+    
+    @pytest.mark.parametrize("current_mileage,max_mileage", [
+        (0.0, 400.0),
+        (279.9, 400.0),
+        (280.0, 400.0),   # 0.70
+        (339.9, 400.0),
+        (340.0, 400.0),   # 0.85
+        (379.9, 400.0),
+        (380.0, 400.0),   # 0.95
+        (520.0, 400.0),
+        (70.0, 100.0),
+        (85.0, 100.0),
+        (95.0, 100.0),
+        (150.0, None),
+        (150.0, 0.0),
+        (150.0, float("inf")),
+    ])
+    def test_matches_python(self, user_id, current_mileage, max_mileage):
+        insert_equipment(user_id, current_mileage, max_mileage)
+        
+        rows = equipment_tracking.get_user_equipment(user_id)
+        
+        assert len(rows) == 1
+        assert rows[0]["health_status"] == get_equipment_health(rows[0])
+
+
+@pytest.mark.database
+class TestEquipmentAnalytics:
+    """Test that the single-query analytics keep the old response shape"""
+    
+    def test_matches_old_shape(self, user_id):
+        insert_equipment(user_id, 120.0, 400.0)
+        insert_equipment(user_id, 390.0, 400.0)
+        insert_equipment(user_id, 350.0, 400.0, initial_mileage=50.0)
+        insert_equipment(user_id, 290.0, 300.0, equipment_type="racing_spikes")
+        insert_equipment(user_id, 299.0, 300.0, equipment_type="racing_spikes", status="retired")
+        insert_equipment(user_id, 40.0, float("inf"), equipment_type="compression_gear")
+        
+        analytics = equipment_tracking.get_equipment_analytics(user_id)
+        expected = old_equipment_analytics(user_id)
+        
+        assert analytics.keys() == expected.keys()
+        assert analytics["total_equipment"] == expected["total_equipment"] == 6
+        assert analytics["most_used"] == expected["most_used"]
+        assert analytics["replacement_alerts"] == expected["replacement_alerts"]
+        # Group order isn't specified by either query
+        assert by_type(analytics["equipment_stats"]) == by_type(expected["equipment_stats"])
+    
+    def test_no_equipment(self, user_id):
+        assert equipment_tracking.get_equipment_analytics(user_id) == {
+            "equipment_stats": [],
+            "most_used": [],
+            "replacement_alerts": [],
+            "total_equipment": 0
+        }
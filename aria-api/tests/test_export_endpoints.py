@@ -0,0 +1,169 @@
+"""
+Tests for the data export endpoints (additional_endpoints.py export_router):
+conditional GETs and background export jobs
+"""
+import sys
+import types
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+additional_endpoints = pytest.importorskip("src.additional_endpoints", exc_type=ImportError)
+from src import rate_limit
+
+
+class FakeAsyncResult:
+    def __init__(self, job_id, status, result=None):
+        self.id = job_id
+        self.status = status
+        self.result = result
+    
+    def ready(self):
+        return self.status in ("SUCCESS", "FAILURE")
+    
+    def successful(self):
+        return self.status == "SUCCESS"
+
+
+class FakeCelery:
+    """celery_app stand-in: send_task queues, AsyncResult reads back jobs[job_id]"""
+    
+    def __init__(self):
+        self.jobs = {}
+        self.sent = []
+    
+    def send_task(self, name, args=None):
+        self.sent.append((name, args))
+        job = FakeAsyncResult(f"job-{len(self.sent)}", "PENDING")
+        self.jobs[job.id] = job
+        return job
+    
+    def AsyncResult(self, job_id):
+        return self.jobs.get(job_id) or FakeAsyncResult(job_id, "PENDING")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Export router alone, with rate limiting always allowing"""
+    async def allow(request, endpoint, user_id=None):
+        return {"allowed": True}
+    
+    monkeypatch.setattr(rate_limit.rate_limiter, "acheck_rate_limit", allow)
+    app = FastAPI()
+    app.include_router(additional_endpoints.export_router)
+    return TestClient(app)
+
+
+@pytest.fixture
+def export_state(monkeypatch):
+    """Current export version (drives the ETag) and how many exports were built"""
+    state = {"etag": 'W/"v1"', "builds": 0}
+    
+    async def get_export_etag(user_id, format):
+        return state["etag"]
+    
+    async def export_user_data(user_id, format):
+        state["builds"] += 1
+        return {"success": True, "user_id": user_id, "data": {"goals": []}}
+    
+    monkeypatch.setattr(additional_endpoints, "get_export_etag", get_export_etag)
+    monkeypatch.setattr(additional_endpoints, "export_user_data", export_user_data)
+    return state
+
+
+@pytest.fixture
+def celery_app(monkeypatch):
+    app = FakeCelery()
+    module = types.ModuleType("scripts.celery_tasks")
+    module.celery_app = app
+    monkeypatch.setitem(sys.modules, "scripts.celery_tasks", module)
+    return app
+
+
+class TestExportConditionalGet:
+    """Test If-None-Match handling on GET /export/{user_id}/export"""
+    
+    def test_first_download_sets_etag(self, client, export_state):
+        response = client.get("/export/7/export")
+        
+        assert response.status_code == 200
+        assert response.headers["etag"] == 'W/"v1"'
+        assert response.headers["cache-control"] == additional_endpoints.EXPORT_CACHE_CONTROL
+        assert response.json()["user_id"] == "7"
+    
+    def test_matching_etag_is_304_without_building(self, client, export_state):
+        response = client.get("/export/7/export", headers={"If-None-Match": 'W/"v1"'})
+        
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == 'W/"v1"'
+        assert export_state["builds"] == 0
+    
+    def test_changed_data_is_200_with_new_etag(self, client, export_state):
+        export_state["etag"] = 'W/"v2"'
+        
+        response = client.get("/export/7/export", headers={"If-None-Match": 'W/"v1"'})
+        
+        assert response.status_code == 200
+        assert response.headers["etag"] == 'W/"v2"'
+        assert export_state["builds"] == 1
+    
+    def test_no_etag_when_version_unknown(self, client, export_state):
+        """Without a version the export is always built and never cacheable"""
+        export_state["etag"] = None
+        
+        response = client.get("/export/7/export", headers={"If-None-Match": 'W/"v1"'})
+        
+        assert response.status_code == 200
+        assert "etag" not in response.headers
+
+
+class TestExportJobs:
+    """Test enqueueing a background export and polling its status"""
+    
+    def test_enqueue(self, client, celery_app):
+        response = client.post("/export/7/export/jobs")
+        
+        assert response.json() == {
+            "job_id": "job-1",
+            "status": "queued",
+            "status_url": "/api/v1/export/jobs/job-1"
+        }
+        assert celery_app.sent == [("celery_tasks.generate_data_export", ["7", "zip"])]
+    
+    def test_pending(self, client, celery_app):
+        job_id = client.post("/export/7/export/jobs").json()["job_id"]
+        
+        assert client.get(f"/export/jobs/{job_id}").json() == {"job_id": job_id, "status": "pending"}
+    
+    def test_completed(self, client, celery_app):
+        job_id = client.post("/export/7/export/jobs").json()["job_id"]
+        celery_app.jobs[job_id].status = "SUCCESS"
+        celery_app.jobs[job_id].result = {"success": True, "download_url": "https://exports.example/7.zip"}
+        
+        assert client.get(f"/export/jobs/{job_id}").json() == {
+            "job_id": job_id,
+            "status": "completed",
+            "success": True,
+            "download_url": "https://exports.example/7.zip"
+        }
+    
+    def test_task_reported_failure(self, client, celery_app):
+        """A task that returns success=False is reported as failed"""
+        job_id = client.post("/export/7/export/jobs").json()["job_id"]
+        celery_app.jobs[job_id].status = "SUCCESS"
+        celery_app.jobs[job_id].result = {"success": False, "error": "Export too large"}
+        
+        assert client.get(f"/export/jobs/{job_id}").json() == {
+            "job_id": job_id, "status": "failed", "error": "Export too large"
+        }
+    
+    def test_task_raised(self, client, celery_app):
+        """A task that raised is reported as failed with the exception text"""
+        job_id = client.post("/export/7/export/jobs").json()["job_id"]
+        celery_app.jobs[job_id].status = "FAILURE"
+        celery_app.jobs[job_id].result = RuntimeError("worker lost")
+        
+        assert client.get(f"/export/jobs/{job_id}").json() == {
+            "job_id": job_id, "status": "failed", "error": "worker lost"
+        }
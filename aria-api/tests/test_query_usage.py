@@ -0,0 +1,99 @@
+"""
+Tests for the buffered query usage writer (database.py track_query_usage)
+"""
+import contextlib
+import psycopg2
+import pytest
+from src import database
+
+
+class FakeUsageTable:
+    """query_usage stand-in: a cursor whose rows land only when its db_cursor() block commits"""
+    
+    def __init__(self, bad_users=()):
+        self.rows = []
+        self.statements = []
+        self.bad_users = set(bad_users)
+    
+    @contextlib.contextmanager
+    def db_cursor(self, dict_cursor=False):
+        cur = FakeCursor(self)
+        yield cur
+        self.rows.extend(cur.rows)
+    
+    def execute_values(self, cur, sql, rows, template=None, page_size=None):
+        if any(row[0] in self.bad_users for row in rows):
+            raise psycopg2.Error("insert or update on table \"query_usage\" violates foreign key constraint")
+        cur.rows.extend(rows)
+    
+    def count(self, query, params):
+        return sum(1 for row in self.rows if row[0] == int(params[0]))
+
+
+class FakeCursor:
+    def __init__(self, table):
+        self.table = table
+        self.rows = []
+    
+    def execute(self, sql):
+        self.table.statements.append(sql)
+
+
+@pytest.fixture
+def usage_table(monkeypatch):
+    """Empty buffer, no flusher thread, and writes going to a FakeUsageTable"""
+    table = FakeUsageTable(bad_users={13})
+    monkeypatch.setattr(database, "db_cursor", table.db_cursor)
+    monkeypatch.setattr(database.extras, "execute_values", table.execute_values)
+    monkeypatch.setattr(database.db_pool, "execute_scalar", table.count)
+    # A started flusher would race the test for the buffer
+    monkeypatch.setattr(database, "_usage_thread", object())
+    database._usage_buffer.clear()
+    yield table
+    database._usage_buffer.clear()
+
+
+class TestQueryUsageBuffer:
+    """Test that buffering usage rows never loses or hides them"""
+    
+    def test_buffered_row_counts_immediately(self, usage_table):
+        """get_monthly_usage writes the user's pending rows before counting"""
+        database.track_query_usage("42", "ask", 120)
+        database.track_query_usage("7", "ask", 80)
+        
+        assert usage_table.rows == []
+        assert database.get_monthly_usage("42") == 1
+        # Only that user's rows were written; the rest stay batched
+        assert [row[0] for row in database._usage_buffer] == [7]
+    
+    def test_bad_row_does_not_drop_batch(self, usage_table):
+        """A failing batch is retried row by row and only the bad row is dropped"""
+        for user_id in ("1", "13", "2"):
+            database.track_query_usage(user_id, "ask")
+        
+        database.flush_query_usage()
+        
+        assert [row[0] for row in usage_table.rows] == [1, 2]
+        assert usage_table.statements.count("ROLLBACK TO SAVEPOINT usage_row") == 1
+        assert not database._usage_buffer
+    
+    def test_non_numeric_user_is_not_buffered(self, usage_table):
+        """query_usage.user_id is an integer FK, so such a row would fail its batch"""
+        database.track_query_usage("guest", "ask")
+        
+        assert not database._usage_buffer
+    
+    def test_flush_registered_at_exit(self, usage_table, monkeypatch):
+        """Starting the flusher registers flush_query_usage, which drains the buffer"""
+        registered = []
+        monkeypatch.setattr(database.atexit, "register", registered.append)
+        monkeypatch.setattr(database.threading.Thread, "start", lambda self: None)
+        monkeypatch.setattr(database, "_usage_thread", None)
+        
+        database.track_query_usage("42", "ask")
+        database.track_query_usage("43", "generate_plan")
+        
+        assert registered == [database.flush_query_usage]
+        registered[0]()
+        assert [row[0] for row in usage_table.rows] == [42, 43]
+        assert not database._usage_buffer
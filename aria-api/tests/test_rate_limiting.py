@@ -2,7 +2,11 @@
 import pytest
 import time
 from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from starlette.requests import Request
 from main import app
+import src.rate_limit as rate_limit
+from src.cache import AriaCache, _INCR_WINDOWS_SCRIPT
 
 client = TestClient(app)
 
@@ -321,5 +325,134 @@ class TestRateLimitingIntegration:
         status_response = client.get("/admin/rate-limits/status")
         assert status_response.status_code == 200
 
+class FakeScript:
+    """Stands in for redis-py's Script; runs the Lua logic in Python"""
+    
+    def __init__(self, client, source):
+        self.registered_client = client
+        self.source = source
+    
+    def __call__(self, keys=[], args=[], client=None):
+        assert self.source == _INCR_WINDOWS_SCRIPT
+        return self.registered_client.incr_windows(keys, args)
+
+class FakeRedis:
+    """Minimal Redis with register_script and no eval, so EVAL would fail"""
+    
+    def __init__(self):
+        self.store = {}
+        self.registered = []
+    
+    def ping(self):
+        return True
+    
+    def register_script(self, source):
+        self.registered.append(source)
+        return FakeScript(self, source)
+    
+    def incr_windows(self, keys, args):
+        # Same steps as _INCR_WINDOWS_SCRIPT: check every window, then count
+        for i, key in enumerate(keys):
+            count = self.store.get(key, 0)
+            if count >= int(args[2 * i + 1]):
+                return [0, i + 1, count]
+        for key in keys:
+            self.store[key] = self.store.get(key, 0) + 1
+        return [1, 0] + [self.store[key] for key in keys]
+
+def make_request(path="/knowledge_library"):
+    """Bare HTTP request from a fixed client IP, with no credentials"""
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "headers": [],
+        "query_string": b"",
+        "client": ("203.0.113.9", 5000),
+        "path_params": {},
+    })
+
+# Window tests (fake Redis, no server needed)
+class TestRateLimitWindows:
+    """Test window counting, blocking and user id extraction"""
+    
+    @pytest.fixture
+    def limiter(self, monkeypatch):
+        fake = FakeRedis()
+        monkeypatch.setattr(AriaCache, "_connect", lambda self: setattr(self, "redis", fake))
+        limiter = rate_limit.RateLimiter()
+        limiter.cache = AriaCache()
+        return limiter
+    
+    def test_script_registered_once(self, limiter):
+        """The Lua script is registered at startup, not sent on every request"""
+        fake = limiter.cache.redis
+        for _ in range(3):
+            result = limiter.check_rate_limit(make_request(), "general", max_requests=10)
+            assert "error" not in result
+        
+        assert fake.registered.count(_INCR_WINDOWS_SCRIPT) == 1
+    
+    def test_rejected_request_increments_nothing(self, limiter):
+        """A request over the limit is refused without counting it"""
+        request = make_request()
+        assert limiter.check_rate_limit(request, "general", max_requests=2)["allowed"]
+        assert limiter.check_rate_limit(request, "general", max_requests=2)["allowed"]
+        
+        for _ in range(3):
+            result = limiter.check_rate_limit(request, "general", max_requests=2)
+            assert not result["allowed"]
+            assert result["requests_made"] == 2
+            assert result["retry_after"] >= 1
+        
+        assert list(limiter.cache.redis.store.values()) == [2]
+    
+    def test_hour_window_blocks_with_its_retry_after(self, limiter, monkeypatch):
+        """When the hour window is full, retry_after points at the hour's end"""
+        now = 10 * 3600 + 1800
+        monkeypatch.setattr(rate_limit.time, "time", lambda: now)
+        monkeypatch.setattr(rate_limit, "principal_from_scope", lambda request: {"user_id": "42", "role": "user"})
+        monkeypatch.setattr(limiter, "_prefetch", lambda user_id: (None, 0))
+        monkeypatch.setattr(
+            limiter, "check_subscription_limit",
+            lambda user_id, endpoint, **kwargs: {"allowed": True, "tier": "pro"}
+        )
+        monkeypatch.setattr(rate_limit, "_get_limits", lambda tier, endpoint: rate_limit._LimitCfg(1000, 100, 2, None))
+        
+        request = make_request()
+        assert limiter.check_rate_limit(request, "general")["allowed"]
+        assert limiter.check_rate_limit(request, "general")["allowed"]
+        result = limiter.check_rate_limit(request, "general")
+        
+        assert not result["allowed"]
+        assert result["requests_made"] == 2
+        assert result["reset_time"] == 11 * 3600
+        assert result["retry_after"] == 1800
+        # Neither the minute nor the hour counter moved on the rejection
+        assert sorted(limiter.cache.redis.store.values()) == [2, 2]
+    
+    def test_user_id_from_body_model(self):
+        """user_id is read from a parsed request body model"""
+        class Body(BaseModel):
+            user_id: str
+            user_input: str
+        
+        params = {"req": Body(user_id="u1", user_input="hi"), "request": make_request()}
+        assert rate_limit._user_id_from_params(params) == "u1"
+    
+    def test_user_id_from_form_field(self):
+        """user_id is read from a form field parameter"""
+        params = {"user_id": "u2", "file": object(), "request": make_request()}
+        assert rate_limit._user_id_from_params(params) == "u2"
+    
+    def test_user_id_from_path_param(self):
+        """An int path parameter comes back as a string"""
+        params = {"user_id": 7, "request": make_request("/usage/monthly/7")}
+        assert rate_limit._user_id_from_params(params) == "7"
+    
+    def test_user_id_absent(self):
+        """No user_id anywhere gives None"""
+        assert rate_limit._user_id_from_params({"request": make_request()}) is None
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Tests for execute_cached's placeholder rewriting and per-connection
+prepared statement cache (database.py)
+"""
+import pytest
+from src import database
+from src.database import db_pool, execute_cached, _convert_placeholders
+
+
+@pytest.fixture
+def pooled_conn():
+    """A pooled PreparingConnection; skips when no database is reachable"""
+    try:
+        conn = db_pool.get_connection()
+    except Exception as e:
+        pytest.skip(f"Database not available: {e}")
+    yield conn
+    conn.rollback()
+    db_pool.return_connection(conn)
+
+
+def prepared_names(conn):
+    """Statement names currently prepared on the connection's session"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT name FROM pg_prepared_statements")
+        names = {row[0] for row in cur.fetchall()}
+    conn.rollback()
+    return names
+
+
+class TestConvertPlaceholders:
+    """Test the %s / %(name)s to $n rewrite used for PREPARE"""
+    
+    def test_positional(self):
+        """%s placeholders are numbered in order"""
+        assert _convert_placeholders("SELECT * FROM t WHERE a = %s AND b = %s") == (
+            "SELECT * FROM t WHERE a = $1 AND b = $2", 2
+        )
+    
+    def test_named(self):
+        """%(name)s placeholders map to $n with the parameter order"""
+        assert _convert_placeholders("SELECT * FROM t WHERE a = %(a)s AND b = %(b)s") == (
+            "SELECT * FROM t WHERE a = $1 AND b = $2", ("a", "b")
+        )
+    
+    def test_repeated_named(self):
+        """A repeated name reuses its number and is passed once"""
+        assert _convert_placeholders("UPDATE t SET a = %(x)s WHERE b = %(y)s OR c = %(x)s") == (
+            "UPDATE t SET a = $1 WHERE b = $2 OR c = $1", ("x", "y")
+        )
+    
+    def test_escaped_percent(self):
+        """%% becomes a literal % since PREPARE text isn't interpolated"""
+        assert _convert_placeholders("SELECT * FROM t WHERE a LIKE 'x%%' AND b = %s") == (
+            "SELECT * FROM t WHERE a LIKE 'x%' AND b = $1", 1
+        )
+    
+    def test_no_params(self):
+        """A statement without placeholders is preparable with zero params"""
+        assert _convert_placeholders("SELECT 1") == ("SELECT 1", 0)
+    
+    def test_placeholder_inside_literal(self):
+        """psycopg2 interpolates inside quotes, PREPARE can't"""
+        assert _convert_placeholders("SELECT NOW() - INTERVAL '%s days'") is None
+    
+    def test_placeholder_after_closed_literal(self):
+        """Quotes that close before the placeholder don't hide it"""
+        assert _convert_placeholders("SELECT * FROM t WHERE s = 'a' AND b = %s") == (
+            "SELECT * FROM t WHERE s = 'a' AND b = $1", 1
+        )
+    
+    def test_mixed_styles(self):
+        """Positional and named placeholders together are rejected"""
+        assert _convert_placeholders("SELECT * FROM t WHERE a = %s AND b = %(b)s") is None
+    
+    @pytest.mark.parametrize("query", [
+        "CREATE TABLE t (id INT)",
+        "DROP INDEX idx_t",
+        "SELECT 1; SELECT 2",
+        "UPDATE t SET a = %s; DELETE FROM t",
+    ])
+    def test_ddl_and_multi_statement(self, query):
+        """Only a single SELECT/INSERT/UPDATE/DELETE/WITH/VALUES is prepared"""
+        assert _convert_placeholders(query) is None
+    
+    def test_trailing_semicolon(self):
+        """One statement with a trailing semicolon is still preparable"""
+        assert _convert_placeholders("SELECT %s;") == ("SELECT $1;", 1)
+
+
+@pytest.mark.database
+class TestStatementCache:
+    """Test the per-connection prepared statement cache against Postgres"""
+    
+    def test_repeated_query_is_prepared_once(self, pooled_conn):
+        """The second run reuses the statement the first one PREPAREd"""
+        query = "SELECT %s::int + 1 AS n"
+        with pooled_conn.cursor() as cur:
+            execute_cached(cur, query, (1,))
+            assert cur.fetchone()[0] == 2
+            name = pooled_conn.stmt_cache[query]
+            execute_cached(cur, query, (2,))
+            assert cur.fetchone()[0] == 3
+        pooled_conn.rollback()
+        
+        assert name in prepared_names(pooled_conn)
+    
+    def test_lru_eviction_deallocates(self, pooled_conn, monkeypatch):
+        """The least recently used statement is DEALLOCATEd past the cap"""
+        monkeypatch.setattr(database, "STMT_CACHE_SIZE", 2)
+        pooled_conn.stmt_cache.clear()
+        queries = [f"SELECT %s::int + {i}" for i in range(3)]
+        
+        with pooled_conn.cursor() as cur:
+            execute_cached(cur, queries[0], (1,))
+            first = pooled_conn.stmt_cache[queries[0]]
+            execute_cached(cur, queries[1], (1,))
+            execute_cached(cur, queries[2], (1,))
+        pooled_conn.rollback()
+        
+        assert list(pooled_conn.stmt_cache) == queries[1:]
+        names = prepared_names(pooled_conn)
+        assert first not in names
+        assert set(pooled_conn.stmt_cache.values()) <= names
+    
+    def test_stale_plan_retried_at_transaction_start(self, pooled_conn):
+        """A plan broken by ALTER TABLE is re-prepared and the query retried"""
+        with pooled_conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE stmt_cache_stale (a INT)")
+            cur.execute("INSERT INTO stmt_cache_stale VALUES (1)")
+        pooled_conn.commit()
+        
+        query = "SELECT * FROM stmt_cache_stale WHERE a = %s"
+        with pooled_conn.cursor() as cur:
+            execute_cached(cur, query, (1,))
+            assert cur.fetchone() == (1,)
+            pooled_conn.commit()
+            
+            cur.execute("ALTER TABLE stmt_cache_stale ADD COLUMN b INT DEFAULT 2")
+            pooled_conn.commit()
+            
+            execute_cached(cur, query, (1,))
+            assert cur.fetchone() == (1, 2)
+        pooled_conn.rollback()
+    
+    def test_stale_plan_mid_transaction_raises_then_recovers(self, pooled_conn):
+        """Mid-transaction the error surfaces; the next use re-prepares"""
+        with pooled_conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE stmt_cache_stale_tx (a INT)")
+            cur.execute("INSERT INTO stmt_cache_stale_tx VALUES (1)")
+        pooled_conn.commit()
+        
+        query = "SELECT * FROM stmt_cache_stale_tx WHERE a = %s"
+        with pooled_conn.cursor() as cur:
+            execute_cached(cur, query, (1,))
+            pooled_conn.commit()
+            cur.execute("ALTER TABLE stmt_cache_stale_tx ADD COLUMN b INT DEFAULT 2")
+            pooled_conn.commit()
+            
+            cur.execute("SELECT 1")
+            with pytest.raises(database.psycopg2.errors.FeatureNotSupported):
+                execute_cached(cur, query, (1,))
+            pooled_conn.rollback()
+            
+            execute_cached(cur, query, (1,))
+            assert cur.fetchone() == (1, 2)
+        pooled_conn.rollback()
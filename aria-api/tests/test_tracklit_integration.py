@@ -316,8 +316,8 @@ class TestWebhookHandler:
         mock_sync.assert_called_once_with("user_123")
     
     @patch('tracklit_integration.update_user_subscription')
-    @patch('tracklit_integration.cache')
-    def test_handle_subscription_upgraded_webhook(self, mock_cache, mock_update):
+    @patch('tracklit_integration.rate_limiter')
+    def test_handle_subscription_upgraded_webhook(self, mock_rate_limiter, mock_update):
         """Test handling subscription.upgraded webhook"""
         payload = {
             "user_id": "user_123",
@@ -331,7 +331,7 @@ class TestWebhookHandler:
         
         assert result is True
         mock_update.assert_called_once()
-        mock_cache.delete.assert_called_with("subscription:user_123")
+        mock_rate_limiter.invalidate_subscription.assert_called_with("user_123")
     
     @patch('tracklit_integration.update_user_subscription')
     @patch('tracklit_integration.cache')